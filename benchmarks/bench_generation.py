@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+    Benchmark of TA script generation (without executing stages).
+
+    Runs «tas <spec>» several times in a scratch dir and prints wall time.
+    With --pipenv also measures what every generated command paid before
+    for «python -m pipenv run …» startup versus calling venv python directly.
+
+    With --threads N also runs generation in-process on N threads at once
+    (each into its own project dir) and checks that all of them
+    produce the same scripts as a single sequential run.
+
+    Stage wall time is measured by TA itself on real builds (tmp/stage-timings.json);
+    with --timings BASELINE RUN [RUN …] per-stage wall time of the baseline build
+    (e.g. scripts with «pipenv run») is compared with median of the series of runs.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def wall(cmd, cwd, env=None):
+    started_ = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started_
+
+
+def report(title, times):
+    print(f'{title:40} median {statistics.median(times):7.3f}s  min {min(times):7.3f}s  (n={len(times)})')
+
+
+def generated_scripts(project_dir):
+    '''
+    Scripts of the project, with project dir replaced by placeholder.
+    '''
+    return {f_: open(os.path.join(project_dir, f_), encoding='utf-8').read().replace(project_dir, '<project>')
+            for f_ in sorted(os.listdir(project_dir)) if f_.endswith('.bat')}
+
+
+def compare_timings(baseline_path, series_paths):
+    '''
+    Per-stage wall time: baseline build vs median of series of builds (saved stage-timings.json).
+    '''
+    def load(path_):
+        with open(path_, 'r', encoding='utf-8') as lf:
+            return json.load(lf)
+
+    baseline = load(baseline_path)
+    series = [load(path_) for path_ in series_paths]
+    stages_ = list(baseline) + [s_ for run_ in series for s_ in run_ if s_ not in baseline]
+    stages_ = list(dict.fromkeys(stages_))
+
+    print(f'{"stage":40} {"baseline":>10} {"after":>10} {"delta":>10}  (after: median of {len(series)} runs)')
+    totals_ = [0.0, 0.0]
+    for stage_ in stages_:
+        times_ = [run_[stage_] for run_ in series if stage_ in run_]
+        before_ = baseline.get(stage_)
+        after_ = statistics.median(times_) if times_ else None
+        if before_ is not None and after_ is not None:
+            totals_[0] += before_
+            totals_[1] += after_
+            print(f'{stage_:40} {before_:9.1f}s {after_:9.1f}s {after_ - before_:+9.1f}s')
+        else:
+            cell_ = lambda v_: f'{v_:9.1f}s' if v_ is not None else f'{"-":>10}'
+            print(f'{stage_:40} {cell_(before_)} {cell_(after_)} {"":>10}')
+    print(f'{"total (stages in both)":40} {totals_[0]:9.1f}s {totals_[1]:9.1f}s {totals_[1] - totals_[0]:+9.1f}s')
+    pass
+
+
+def check_concurrent_generation(specfile, threads):
+    '''
+    Generation of several projects on threads must not interfere
+    (no chdir, no shared mutable state).
+    '''
+    sys.path.insert(0, os.path.dirname(HERE))
+    from terrarium_assembler_win.ta import TerrariumAssembler
+    from terrarium_assembler_win.config import TAConfig
+
+    def generate(project_dir, errors):
+        try:
+            config = TAConfig(specfile=specfile, no_spec_cache=True)
+            TerrariumAssembler(config, curdir=project_dir).process()
+        except Exception as ex_:
+            errors.append(ex_)
+
+    cwd_ = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        reference_dir = os.path.join(workdir, 'reference')
+        os.makedirs(reference_dir)
+        errors = []
+        generate(reference_dir, errors)
+        assert not errors, errors
+        reference = generated_scripts(reference_dir)
+
+        dirs_ = []
+        for i_ in range(threads):
+            dirs_.append(os.path.join(workdir, f'thread{i_}'))
+            os.makedirs(dirs_[-1])
+        started_ = time.perf_counter()
+        threads_ = [threading.Thread(target=generate, args=(dir_, errors)) for dir_ in dirs_]
+        for t_ in threads_:
+            t_.start()
+        for t_ in threads_:
+            t_.join()
+        elapsed_ = time.perf_counter() - started_
+        assert not errors, errors
+        for dir_ in dirs_:
+            assert generated_scripts(dir_) == reference, f'Scripts in {dir_} differ from sequential run'
+    assert os.getcwd() == cwd_, 'Current dir was changed by generation'
+    print(f'{threads} concurrent generations: {elapsed_:.3f}s, {len(reference)} scripts each, identical')
+    pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark TA script generation')
+    ap.add_argument('specfile', nargs='?', default=os.path.join(HERE, 'sample-spec.yml'))
+    ap.add_argument('-n', type=int, default=5, help='Number of runs')
+    ap.add_argument('--threads', type=int, default=0, help='Also check concurrent in-process generation on N threads')
+    ap.add_argument('--pipenv', default=False, action='store_true', help='Also measure pipenv startup per command')
+    ap.add_argument('--timings', nargs='+', default=None, metavar='STAGE_TIMINGS_JSON',
+                    help='Only compare stage wall time: baseline stage-timings.json, then files of runs to compare')
+    args = ap.parse_args()
+
+    if args.timings:
+        assert len(args.timings) >= 2, 'Need baseline and at least one run to compare'
+        compare_timings(args.timings[0], args.timings[1:])
+        return
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(HERE), env.get('PYTHONPATH', '')])
+    specfile = os.path.abspath(args.specfile)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        times = [wall([sys.executable, '-m', 'terrarium_assembler_win.cli', specfile], workdir, env)
+                 for _ in range(args.n)]
+        report('generation', times)
+
+        if args.pipenv:
+            times = [wall([sys.executable, '-c', 'from pipenv.project import Project; Project()'], workdir, env)
+                     for _ in range(args.n)]
+            report('pipenv Project() in TA constructor', times)
+            times = [wall([sys.executable, '-m', 'pipenv', '--version'], workdir, env)
+                     for _ in range(args.n)]
+            report('pipenv startup (per command, lower bound)', times)
+            times = [wall([sys.executable, '-c', 'pass'], workdir, env)
+                     for _ in range(args.n)]
+            report('direct python startup (per command)', times)
+
+    if args.threads:
+        check_concurrent_generation(specfile, args.threads)
+    pass
+
+
+if __name__ == '__main__':
+    main()
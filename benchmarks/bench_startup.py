@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+    Benchmark of TA cold start.
+
+    * wall time of «tas --help» in a fresh interpreter;
+    * import-time profile («python -X importtime»), top modules by cumulative time;
+    * guard: heavy modules must not be imported just to start TA.
+
+    Exits with code 1 on regression (--max-ms exceeded or heavy module imported),
+    so it can be run in CI.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ['pipenv', 'jinja2', 'yaml', 'requirements', 'setuptools', 'packaging']
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark TA cold start')
+    ap.add_argument('-n', type=int, default=10, help='Number of runs')
+    ap.add_argument('--top', type=int, default=15, help='How many modules of import profile to show')
+    ap.add_argument('--max-ms', type=float, default=0, help='Fail if median «tas --help» is slower')
+    args = ap.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(HERE), env.get('PYTHONPATH', '')])
+    failed = False
+
+    times = []
+    for _ in range(args.n):
+        started_ = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'terrarium_assembler_win.cli', '--help'], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - started_) * 1000)
+    median_ = statistics.median(times)
+    print(f'tas --help: median {median_:.1f}ms, min {min(times):.1f}ms (n={args.n})')
+    if args.max_ms and median_ > args.max_ms:
+        print(f'REGRESSION: slower than {args.max_ms}ms')
+        failed = True
+
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import terrarium_assembler_win.cli'],
+                         env=env, check=True, stderr=subprocess.PIPE, text=True)
+    profile = []
+    for line_ in res.stderr.splitlines():
+        if not line_.startswith('import time:') or 'cumulative' in line_:
+            continue
+        self_us, cumulative_us, name_ = [f_.strip() for f_ in line_.split(':', 1)[1].split('|')]
+        profile.append((int(cumulative_us), int(self_us), name_))
+    print(f'Import profile (top {args.top} by cumulative time):')
+    for cumulative_us, self_us, name_ in sorted(profile, reverse=True)[:args.top]:
+        print(f'{cumulative_us/1000:9.1f}ms {self_us/1000:9.1f}ms  {name_}')
+
+    check_ = 'import sys, terrarium_assembler_win.cli; print(" ".join(m for m in %r if m in sys.modules))' % HEAVY_MODULES
+    res = subprocess.run([sys.executable, '-c', check_], env=env, check=True, stdout=subprocess.PIPE, text=True)
+    heavy_ = res.stdout.split()
+    if heavy_:
+        print(f'REGRESSION: heavy modules imported at startup: {", ".join(heavy_)}')
+        failed = True
+    else:
+        print('No heavy modules imported at startup')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
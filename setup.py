@@ -17,7 +17,8 @@ requirements = [
     'jinja2', 
     'packaging',
     'wheel_filename',
-    'requirements-parser'
+    'requirements-parser',
+    'pycdlib'
 ]
 
 test_requirements = ['pytest>=3', ]
@@ -39,10 +40,14 @@ setup(
     entry_points={
         'console_scripts': [
             'tas=terrarium_assembler_win.cli:main',
+            'tas-batch=terrarium_assembler_win.cli:batch_main',
             'terrarium_assembler_win=terrarium_assembler_win.cli:main',
         ],
     },
     install_requires=requirements,
+    extras_require={
+        'watch': ['watchdog'],
+    },
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
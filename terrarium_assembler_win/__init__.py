@@ -20,6 +20,17 @@ __version__ = '0.1.0'
 #import importlib
 #import pkgutil
 
-from .ta import *
-from .nuitkaflags import *
-from .utils import *
+# Submodules are imported lazily on first attribute access,
+# so «tas --help» and friends do not pay for the whole package.
+_LAZY_MODULES = ['ta', 'config', 'nuitkaflags', 'utils']
+
+
+def __getattr__(name):
+    import importlib
+    for module_name in _LAZY_MODULES:
+        module = importlib.import_module('.' + module_name, __name__)
+        if not name.startswith('_') and hasattr(module, name):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,163 @@
+"""
+    Compressed portable archives of output folders (stage_54_make_archive) for TA.
+
+    Zip is written in one streaming pass: files are read by chunks, chunks are
+    deflated in parallel (zlib releases GIL) and written in order, as pigz does:
+    every chunk is primed with last 32 KiB of previous data and ends with sync flush,
+    so chunks together form one deflate stream, readable by any unzip.
+    Sizes and CRC are written after data (data descriptors), so nothing is staged.
+"""
+
+import os
+import time
+import zlib
+import struct
+import collections
+
+ARCHIVE_CHUNK = 2**20
+DEFLATE_WINDOW = 2**15
+ARCHIVE_LEVEL = 6
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x08 | 0x800    # data descriptor, utf-8 names
+ZIP_DEFLATED = 8
+
+
+def deflate_chunk(data, zdict, last, level=ARCHIVE_LEVEL):
+    '''
+    Raw deflate of chunk, continuing stream with dictionary of previous data.
+    '''
+    if zdict:
+        co_ = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        co_ = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return co_.compress(data) + co_.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def dos_datetime(mtime):
+    t_ = time.localtime(mtime)
+    if t_.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t_.tm_hour << 11) | (t_.tm_min << 5) | (t_.tm_sec // 2),
+            ((t_.tm_year - 1980) << 9) | (t_.tm_mon << 5) | t_.tm_mday)
+
+
+class ZipEntry:
+    '''
+    File in archive, with what is known after its data is written.
+    '''
+
+    def __init__(self, name, size, mtime):
+        self.name = name.replace(os.sep, '/').encode('utf-8')
+        self.size = size
+        self.zip64 = size * 1.05 >= ZIP64_LIMIT
+        self.time, self.date = dos_datetime(mtime)
+        self.crc = 0
+        self.compressed = 0
+        self.offset = 0
+
+    def version(self):
+        return 45 if self.zip64 or self.offset >= ZIP64_LIMIT else 20
+
+    def local_header(self):
+        extra_ = struct.pack('<HHQQ', 1, 16, 0, 0) if self.zip64 else b''
+        sizes_ = ZIP64_LIMIT if self.zip64 else 0
+        return struct.pack('<4s5H3L2H', b'PK\x03\x04', self.version(), ZIP_FLAGS, ZIP_DEFLATED,
+                           self.time, self.date, 0, sizes_, sizes_, len(self.name), len(extra_)) + self.name + extra_
+
+    def data_descriptor(self):
+        if self.zip64:
+            return struct.pack('<4sLQQ', b'PK\x07\x08', self.crc, self.compressed, self.size)
+        return struct.pack('<4s3L', b'PK\x07\x08', self.crc, self.compressed, self.size)
+
+    def central_header(self):
+        values_ = []
+        size_, compressed_, offset_ = self.size, self.compressed, self.offset
+        if self.zip64 or size_ >= ZIP64_LIMIT:
+            values_.append(size_)
+            size_ = ZIP64_LIMIT
+        if self.zip64 or compressed_ >= ZIP64_LIMIT:
+            values_.append(compressed_)
+            compressed_ = ZIP64_LIMIT
+        if offset_ >= ZIP64_LIMIT:
+            values_.append(offset_)
+            offset_ = ZIP64_LIMIT
+        extra_ = struct.pack(f'<HH{len(values_)}Q', 1, 8 * len(values_), *values_) if values_ else b''
+        return struct.pack('<4s6H3L5H2L', b'PK\x01\x02', self.version(), self.version(), ZIP_FLAGS, ZIP_DEFLATED,
+                           self.time, self.date, self.crc, compressed_, size_,
+                           len(self.name), len(extra_), 0, 0, 0, 0, offset_) + self.name + extra_
+
+
+def end_records(entries_count, cd_offset, cd_size):
+    '''
+    End of central directory (with zip64 ones, if needed).
+    '''
+    records_ = b''
+    if entries_count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_end_offset = cd_offset + cd_size
+        records_ += struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                                entries_count, entries_count, cd_size, cd_offset)
+        records_ += struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_end_offset, 1)
+    records_ += struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0,
+                            min(entries_count, 0xFFFF), min(entries_count, 0xFFFF),
+                            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    return records_
+
+
+def write_zip(files, zip_filename, jobs=None, level=ARCHIVE_LEVEL):
+    '''
+    Zip of files {relative path: abs path}, chunks compressed by jobs threads.
+    Returns stats: files, bytes (of files), bytes_compressed (size of archive).
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    jobs = jobs or os.cpu_count() or 1
+    entries = []
+    # Writes in order: ('header', entry), ('data', entry, future of compressed chunk), ('end', entry).
+    pending = collections.deque()
+    tmp_ = zip_filename + '.tmp'
+    with open(tmp_, 'wb') as out_, ThreadPoolExecutor(jobs) as pool:
+        def drain(limit):
+            while len(pending) > limit:
+                item_ = pending.popleft()
+                entry_ = item_[1]
+                if item_[0] == 'header':
+                    entry_.offset = out_.tell()
+                    out_.write(entry_.local_header())
+                elif item_[0] == 'data':
+                    data_ = item_[2].result()
+                    out_.write(data_)
+                    entry_.compressed += len(data_)
+                else:
+                    out_.write(entry_.data_descriptor())
+            pass
+
+        for rel_, path_ in sorted(files.items()):
+            st_ = os.stat(path_)
+            entry_ = ZipEntry(rel_, st_.st_size, st_.st_mtime)
+            entries.append(entry_)
+            pending.append(('header', entry_))
+            crc_, size_, window_ = 0, 0, b''
+            with open(path_, 'rb') as lf:
+                while True:
+                    chunk_ = lf.read(ARCHIVE_CHUNK)
+                    last_ = len(chunk_) < ARCHIVE_CHUNK
+                    crc_ = zlib.crc32(chunk_, crc_)
+                    size_ += len(chunk_)
+                    pending.append(('data', entry_, pool.submit(deflate_chunk, chunk_, window_, last_, level)))
+                    window_ = (window_ + chunk_)[-DEFLATE_WINDOW:]
+                    drain(jobs * 4)
+                    if last_:
+                        break
+            entry_.crc, entry_.size = crc_, size_
+            pending.append(('end', entry_))
+        drain(0)
+
+        cd_offset = out_.tell()
+        for entry_ in entries:
+            out_.write(entry_.central_header())
+        cd_size = out_.tell() - cd_offset
+        out_.write(end_records(len(entries), cd_offset, cd_size))
+        compressed_ = out_.tell()
+    os.replace(tmp_, zip_filename)
+    return {'files': len(entries), 'bytes': sum(e_.size for e_ in entries), 'bytes_compressed': compressed_}
@@ -0,0 +1,309 @@
+"""
+    Assembly of «output folders» (stage_50_output) for TA.
+
+    Output folder is described by manifest {path in output: source file},
+    and synchronized with it by hardlinks to the builds, so several outputs
+    from the same builds cost only metadata operations,
+    and only new or changed files are touched on rebuild.
+    Across volumes hardlinks are impossible, then reflink (copy-on-write clone)
+    is tried, and only then real copy.
+"""
+
+import os
+import json
+import glob
+import shutil
+import fnmatch
+
+MANIFEST_VERSION = 2
+
+
+def resolve_output_folders(outputs, output_key, namespace, _seen=None):
+    '''
+    {folder: [sources]} of the output, with folders of inherited outputs merged
+    (folder in both — union of sources), and f-string templates of sources
+    («{buildroot}/app.dist») evaluated in namespace.
+    '''
+    _seen = set(_seen or ())
+    assert output_key not in _seen, f'Cyclic inherit of outputs: {output_key}'
+    _seen.add(output_key)
+
+    output_ = outputs[output_key]
+    folders = {}
+    for folder, sources_ in (output_.get('folders', None) or {}).items():
+        if isinstance(sources_, str):
+            sources_ = [sources_]
+        folders[folder] = [eval(f"fR'{from_}'", {}, dict(namespace)) for from_ in sources_]
+
+    if 'inherit' in output_:
+        parent_ = resolve_output_folders(outputs, output_.inherit, namespace, _seen)
+        for k, v in parent_.items():
+            if k not in folders:
+                folders[k] = v
+            else:
+                folders[k] = sorted(set(folders[k]) | set(v))
+    return folders
+
+
+def native_path(path):
+    return path.replace('\\', os.sep).replace('/', os.sep)
+
+
+def source_files(source, base_dir):
+    '''
+    [(relative path, abs file)] for source of output folder, as «xcopy /S» gives:
+    dir — all its files, file — the file, wildcard — matching files in the subtree.
+    '''
+    source = os.path.join(base_dir, native_path(source))
+    result = []
+    if os.path.isdir(source):
+        root_, pattern_ = source, '*'
+    elif os.path.isfile(source):
+        return [(os.path.basename(source), source)]
+    elif glob.has_magic(os.path.basename(source)):
+        root_, pattern_ = os.path.split(source)
+    else:
+        print(f'Source {source} does not exist')
+        return []
+
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root_, rel_dir)))
+        except OSError:
+            continue
+        for entry in entries:
+            rel_ = os.path.join(rel_dir, entry.name)
+            if entry.is_dir():
+                stack.append(rel_)
+            elif fnmatch.fnmatch(entry.name, pattern_):
+                result.append((rel_, entry.path))
+    return sorted(result)
+
+
+def build_manifest(folders, base_dir, rules=None):
+    '''
+    {path in output: abs source file}. Later sources override earlier, as with «xcopy /Y».
+    If rules dict is given, it gets «folder <- source» rule, placed every path.
+    '''
+    manifest = {}
+    for folder, sources_ in folders.items():
+        for source in sources_:
+            for rel_, file_ in source_files(source, base_dir):
+                dst_ = os.path.normpath(os.path.join(native_path(folder), rel_))
+                manifest[dst_] = file_
+                if rules is not None:
+                    rules[dst_] = f'{folder} <- {source}'
+    return dict(sorted(manifest.items()))
+
+
+def reflink(src, dst):
+    '''
+    Copy-on-write clone of file (Btrfs/XFS on Linux). Raises OSError if impossible.
+    '''
+    import fcntl
+    FICLONE = 0x40049409
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+    pass
+
+
+def place_file(src, dst):
+    '''
+    Make dst the same content as src: hardlink, reflink or copy.
+    Returns method used.
+    '''
+    tmp_ = dst + '.ta-tmp'
+    if os.path.lexists(tmp_):
+        os.unlink(tmp_)
+    method_ = 'link'
+    try:
+        os.link(src, tmp_)
+    except OSError:
+        try:
+            method_ = 'reflink'
+            reflink(src, tmp_)
+        except (OSError, ImportError):
+            method_ = 'copy'
+            shutil.copy2(src, tmp_)
+    os.replace(tmp_, dst)
+    return method_
+
+
+def same_content(src, dst, st_src, st_dst):
+    '''
+    Is dst up to date: the same file (hardlink), or same size and mtime,
+    or (same size, other mtime) same hash.
+    '''
+    if (st_src.st_dev, st_src.st_ino) == (st_dst.st_dev, st_dst.st_ino) and st_src.st_ino:
+        return True
+    if st_src.st_size != st_dst.st_size:
+        return False
+    if st_src.st_mtime_ns == st_dst.st_mtime_ns:
+        return True
+    from .utils import file_sha256
+    return file_sha256(src) == file_sha256(dst)
+
+
+def existing_files(out_dir):
+    '''
+    {relative path: abs path} of files in output folder.
+    '''
+    result = {}
+    stack = [out_dir]
+    while stack:
+        dir_ = stack.pop()
+        try:
+            entries = list(os.scandir(dir_))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                result[os.path.relpath(entry.path, out_dir)] = entry.path
+    return result
+
+
+def sync_output(manifest, out_dir):
+    '''
+    Make output folder match manifest: place new and changed files,
+    delete stale ones, keep the rest untouched.
+    Returns stats: files by method, kept and deleted, and bytes
+    copied (real data transfer), linked (metadata only) and skipped.
+    '''
+    stats = {'link': 0, 'reflink': 0, 'copy': 0, 'kept': 0, 'deleted': 0,
+             'bytes_copied': 0, 'bytes_linked': 0, 'bytes_skipped': 0}
+    os.makedirs(out_dir, exist_ok=True)
+    existing = existing_files(out_dir)
+    # Paths are compared as the file system does (case-insensitive on Windows),
+    # else case-only rename would place the file and then delete it as stale.
+    existing_keys = set(os.path.normcase(rel_) for rel_ in existing)
+    made_dirs = set()
+    for rel_, src_ in manifest.items():
+        dst_ = os.path.join(out_dir, rel_)
+        st_src = os.stat(src_)
+        if os.path.normcase(rel_) in existing_keys:
+            try:
+                if same_content(src_, dst_, st_src, os.stat(dst_)):
+                    stats['kept'] += 1
+                    stats['bytes_skipped'] += st_src.st_size
+                    continue
+            except OSError:
+                pass
+        dir_ = os.path.dirname(dst_)
+        if dir_ not in made_dirs:
+            if os.path.isfile(dir_):
+                os.unlink(dir_)
+            os.makedirs(dir_, exist_ok=True)
+            made_dirs.add(dir_)
+        if os.path.isdir(dst_):
+            shutil.rmtree(dst_)
+        method_ = place_file(src_, dst_)
+        stats[method_] += 1
+        stats['bytes_linked' if method_ == 'link' else 'bytes_copied'] += st_src.st_size
+
+    wanted_keys = set(os.path.normcase(rel_) for rel_ in manifest)
+    for rel_ in sorted(rel_ for rel_ in existing if os.path.normcase(rel_) not in wanted_keys):
+        # May be already removed, if file and dir swapped places.
+        if os.path.lexists(existing[rel_]):
+            os.unlink(existing[rel_])
+        stats['deleted'] += 1
+
+    # Remove dirs, which became empty.
+    for root_, dirs_, files_ in os.walk(out_dir, topdown=False):
+        if root_ != out_dir and not os.listdir(root_):
+            os.rmdir(root_)
+    return stats
+
+
+def pool_path(pool_dir, src):
+    '''
+    Place of source file in shared content pool.
+    '''
+    import hashlib
+    key_ = hashlib.sha256(os.path.abspath(src).encode('utf-8')).hexdigest()
+    return os.path.join(pool_dir, key_[:2], key_[2:18] + '-' + os.path.basename(src))
+
+
+def plan_shared_content(manifests, out_root, pool_dir, mode='auto'):
+    '''
+    Sources, used by several outputs, that should be staged once into pool
+    and linked from it: {source: path in pool}.
+    mode: «auto» — only sources on other volume than outputs (they cannot be hardlinked,
+    and would be copied for every output), «always», «never».
+    '''
+    if mode == 'never':
+        return {}
+    usage = {}
+    for key_, manifest in manifests.items():
+        for src_ in set(manifest.values()):
+            usage[src_] = usage.get(src_, 0) + 1
+    os.makedirs(out_root, exist_ok=True)
+    out_dev = os.stat(out_root).st_dev
+    shared = {}
+    for src_, count_ in sorted(usage.items()):
+        if count_ > 1 and (mode == 'always' or os.stat(src_).st_dev != out_dev):
+            shared[src_] = pool_path(pool_dir, src_)
+    return shared
+
+
+def stage_pool(shared, pool_dir):
+    '''
+    Bring pool up to date with shared content, remove entries not used anymore.
+    '''
+    stats = {'link': 0, 'reflink': 0, 'copy': 0, 'kept': 0, 'deleted': 0, 'bytes': 0}
+    for src_, pooled_ in shared.items():
+        st_src = os.stat(src_)
+        stats['bytes'] += st_src.st_size
+        if os.path.exists(pooled_) and same_content(src_, pooled_, st_src, os.stat(pooled_)):
+            stats['kept'] += 1
+            continue
+        os.makedirs(os.path.dirname(pooled_), exist_ok=True)
+        stats[place_file(src_, pooled_)] += 1
+
+    wanted = set(os.path.normcase(p_) for p_ in shared.values())
+    for rel_, path_ in existing_files(pool_dir).items():
+        if os.path.normcase(path_) not in wanted:
+            os.unlink(path_)
+            stats['deleted'] += 1
+    return stats
+
+
+def save_manifest(path, manifest, hashes=None, rules=None):
+    '''
+    Manifest with sizes, mtimes and (if hashes {source: sha256} are given) sha256 of sources,
+    (if rules {path in output: rule} are given) rules, placed files,
+    for later comparisons, verification and size reports.
+    '''
+    files_ = {}
+    for rel_, src_ in manifest.items():
+        st_ = os.stat(src_)
+        files_[rel_.replace(os.sep, '/')] = {'source': src_, 'size': st_.st_size, 'mtime_ns': st_.st_mtime_ns}
+        if hashes:
+            files_[rel_.replace(os.sep, '/')]['sha256'] = hashes[src_]
+        if rules:
+            files_[rel_.replace(os.sep, '/')]['rule'] = rules[rel_]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_ = path + '.tmp'
+    with open(tmp_, 'w', encoding='utf-8') as lf:
+        json.dump({'version': MANIFEST_VERSION, 'files': files_}, lf, indent=1, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_, path)
+    pass
+
+
+def load_manifest(path):
+    '''
+    {path in output (with «/»): {'source', 'size', 'mtime_ns', 'sha256', 'rule'}}, empty if absent.
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as lf:
+        return json.load(lf).get('files', {})
@@ -1,14 +1,97 @@
 """Console script for terrarium_assembler."""
 import argparse
+import os
 import sys
 from   .ta import TerrariumAssembler
 
-def main():
-    ta = TerrariumAssembler()
+def main(argv=None):
+    ta = TerrariumAssembler(TerrariumAssembler.parse_config(argv))
     ta.process()
     pass
 
 
+def default_cache_dir():
+    '''
+    Fixed per-user dir for caches of tas-batch, so runs from any dir share them.
+    '''
+    base_ = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_, 'terrarium_assembler_win')
+
+
+def batch_main(argv=None):
+    '''
+    Process several specs in one process:
+
+        tas-batch spec1.yml spec2.yml [--jobs N] [-- options of tas]
+
+    Every spec is generated (and built, if stages are given)
+    in its own project dir (dir of the spec by default),
+    module indexes, jinja environments and wheel metadata are shared.
+    '''
+    argv = sys.argv[1:] if argv is None else list(argv)
+    ta_argv = []
+    if '--' in argv:
+        pos_ = argv.index('--')
+        argv, ta_argv = argv[:pos_], argv[pos_+1:]
+
+    ap = argparse.ArgumentParser(description='Process several TA specs in one process')
+    ap.add_argument('specfiles', nargs='+', type=str, help='Specification files')
+    ap.add_argument('--jobs', default=1, type=int, help='Process specs in parallel')
+    ap.add_argument('--subdirs', default=False, action='store_true',
+                    help='Project dir of spec is «<spec dir>/<spec name>», for several specs in one dir')
+    ap.add_argument('--cache-dir', default=default_cache_dir(), type=str,
+                    help='Dir for caches, shared by all specs (user cache dir by default, not current dir)')
+    args = ap.parse_args(argv)
+
+    from .wheelhouse import WheelMetadataCache
+
+    projects = []
+    for specfile_ in args.specfiles:
+        specfile_ = os.path.abspath(specfile_)
+        curdir_ = os.path.dirname(specfile_)
+        if args.subdirs:
+            curdir_ = os.path.join(curdir_, os.path.splitext(os.path.basename(specfile_))[0])
+            os.makedirs(curdir_, exist_ok=True)
+        projects.append((specfile_, curdir_))
+
+    curdirs_ = [curdir_ for _, curdir_ in projects]
+    dups_ = sorted(set(d_ for d_ in curdirs_ if curdirs_.count(d_) > 1))
+    assert not dups_, f'Several specs in one project dir {dups_}, use --subdirs'
+
+    shared_cache = WheelMetadataCache(os.path.join(os.path.abspath(args.cache_dir), 'wheel-metadata-cache.json'))
+
+    def process(project_):
+        specfile_, curdir_ = project_
+        print(f'*** {specfile_} in {curdir_}')
+        ta = TerrariumAssembler(TerrariumAssembler.parse_config([specfile_] + ta_argv), curdir=curdir_)
+        ta.shared_wheel_cache = shared_cache
+        ta.process()
+        return specfile_
+
+    failed = []
+    if args.jobs > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(args.jobs) as pool:
+            futures_ = [(project_[0], pool.submit(process, project_)) for project_ in projects]
+            for specfile_, future_ in futures_:
+                try:
+                    future_.result()
+                except (Exception, SystemExit) as ex_:
+                    print(f'Failed {specfile_}: {ex_!r}')
+                    failed.append(specfile_)
+    else:
+        for project_ in projects:
+            try:
+                process(project_)
+            except (Exception, SystemExit) as ex_:
+                print(f'Failed {project_[0]}: {ex_!r}')
+                failed.append(project_[0])
+
+    shared_cache.save()
+    print(f'Processed {len(projects) - len(failed)} of {len(projects)} specs')
+    return 1 if failed else 0
+
+
 if __name__ == '__main__':
     res = main()
     sys.exit(0) # pragma: no cover
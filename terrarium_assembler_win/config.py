@@ -0,0 +1,152 @@
+"""
+    Options of TA run, independent from command line.
+
+    TerrariumAssembler takes TAConfig explicitly, so it may be driven in-process
+    (batch mode, services, benchmarks); «parse_config» builds it from argv.
+"""
+
+import os
+import argparse
+import dataclasses as dc
+
+from .utils import fname2stage, fname2num, fname2option
+
+# Stages over made releases (delta packages, archives, release store, which removes ISOs
+# from output folder) run only by their own options or «--steps», not by complex stage options.
+FIRST_RELEASE_STAGE = 53
+
+# Complex stage options: stage method name -> included or not.
+COMPLEX_STAGES = {
+    "stage-all": lambda stage: fname2num(stage)>0 and fname2num(stage)<FIRST_RELEASE_STAGE and not 'audit' in stage,
+    "stage-rebuild": lambda stage: fname2num(stage)>0 and fname2num(stage)<FIRST_RELEASE_STAGE and not 'checkout' in stage and not 'download' in stage and not 'audit' in stage,
+}
+
+
+@dc.dataclass
+class TAConfig:
+    '''
+    What to do with the spec.
+    Stages are given as options names without number («stage_checkout»),
+    they are also readable as boolean attributes («config.stage_checkout»).
+    '''
+    specfile: str
+    stages: set = dc.field(default_factory=set)     # stages to execute
+    debug: bool = False                             # debug version of release
+    docs: bool = False                              # output documentation version
+    folder_command: str = ''                        # shell command for all project folders
+    git_sync: str = ''                              # lazy git sync of all projects
+    update_wheel_index: bool = False
+    store_wheels: bool = False
+    lock_wheels: bool = False
+    fetch_locked_wheels: bool = False               # download missing locked wheels, or resolve all if lockfile is stale
+    assemble_output: str = ''                       # assemble output folder for this output key
+    make_iso: str = ''                              # write ISO of output folder for this output key
+    iso_name: str = ''                              # file name of ISO for make_iso
+    wix_fragments: str = ''                         # write WiX fragments of output folder for this output key
+    make_delta: str = ''                            # write delta package of last release for this output key
+    delta_base: str = ''                            # release, delta is made from (previous by default)
+    make_archive: str = ''                          # write zip of output folder for this output key
+    archive_jobs: int = dc.field(default_factory=lambda: os.cpu_count() or 1)
+    hash_jobs: int = dc.field(default_factory=lambda: os.cpu_count() or 1)
+    verify_output: str = ''                         # verify folder against manifest of this output key (or manifest file)
+    verify_dir: str = ''                            # folder to verify (output folder by default)
+    store_releases: str = ''                        # put releases of this output key to release store
+    restore_release: str = ''                       # release «output key/name» to restore from store
+    restore_to: str = ''                            # folder for restored release (output folder by default)
+    size_report: str = ''                           # write size report of output folder for this output key
+    no_spec_cache: bool = False
+    plan_jobs: int = dc.field(default_factory=lambda: min(8, os.cpu_count() or 1))
+    watch: bool = False
+    watch_interval: float = 0.5
+    dump_plan: str = ''                             # write build plan as JSON
+
+    def __getattr__(self, name):
+        if name.startswith('stage_'):
+            return name in self.stages
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def stage_enabled(self, stage):
+        return stage.replace('-', '_') in self.stages
+
+
+def parse_config(stages, argv=None):
+    '''
+    TAConfig from command line options.
+    stages — {stage method name: description}.
+    '''
+    stages_names = sorted(stages)
+
+    ap = argparse.ArgumentParser(description='Create a portable windows application')
+    ap.add_argument('--debug', default=False, action='store_true', help='Debug version of release')
+    ap.add_argument('--docs', default=False, action='store_true', help='Output documentation version')
+
+    for s_ in stages_names:
+        ap.add_argument(f'--{fname2option(fname2stage(s_))}', default=False,
+                        action='store_true', help=f'{stages[s_]}')
+
+    ap.add_argument('--folder-command', default='', type=str, help='Perform some shell command for all projects')
+    ap.add_argument('--git-sync', default='', type=str, help='Perform lazy git sync for all projects')
+    ap.add_argument('--update-wheel-index', default=False, action='store_true', help='Update local PEP 503 index over wheel directories')
+    ap.add_argument('--store-wheels', default=False, action='store_true', help='Put wheels to content-addressed store and make wheel directories hardlink views')
+    ap.add_argument('--no-spec-cache', default=False, action='store_true', help='Do not use cached resolved spec')
+    ap.add_argument('--plan-jobs', default=min(8, os.cpu_count() or 1), type=int, help='Number of threads for planning stages')
+    ap.add_argument('--watch', default=False, action='store_true', help='Keep running and regenerate scripts of stages, affected by changes of spec and sources')
+    ap.add_argument('--watch-interval', default=0.5, type=float, help='Polling interval for --watch (if watchdog is not installed)')
+    ap.add_argument('--dump-plan', default='', type=str, help='Write build plan as JSON to this file')
+    ap.add_argument('--lock-wheels', default=False, action='store_true', help='Resolve python requirements offline against local wheels and write lockfile')
+    ap.add_argument('--fetch-locked-wheels', default=False, action='store_true', help='Download wheels missing from up to date lockfile, or resolve all wheels if it is stale')
+    ap.add_argument('--assemble-output', default='', type=str, help='Assemble output folder for the output key (by hardlinks)')
+    ap.add_argument('--make-iso', default='', type=str, help='Write ISO image of output folder for the output key (with checksums)')
+    ap.add_argument('--iso-name', default='', type=str, help='File name of ISO image for --make-iso')
+    ap.add_argument('--wix-fragments', default='', type=str, help='Write WiX fragments of output folder for the output key (from its manifest)')
+    ap.add_argument('--make-delta', default='', type=str, help='Write delta update package from previous release to the last one for the output key')
+    ap.add_argument('--delta-base', default='', type=str, help='Release (ISO name or its prefix), delta package is made from')
+    ap.add_argument('--make-archive', default='', type=str, help='Write compressed portable archive (zip) of output folder for the output key')
+    ap.add_argument('--archive-jobs', default=os.cpu_count() or 1, type=int, help='Number of threads compressing the archive')
+    ap.add_argument('--hash-jobs', default=os.cpu_count() or 1, type=int, help='Number of threads hashing files for manifests and verification')
+    ap.add_argument('--verify-output', default='', type=str, help='Verify folder against manifest of the output key (or manifest file, e.g. of release)')
+    ap.add_argument('--verify-dir', default='', type=str, help='Folder (installed or mounted distribution) for --verify-output, output folder by default')
+    ap.add_argument('--store-releases', default='', type=str, help='Put releases (ISOs) of the output key to deduplicated release store and apply retention')
+    ap.add_argument('--restore-release', default='', type=str, help='Restore release «output key/release name» from release store')
+    ap.add_argument('--restore-to', default='', type=str, help='Folder for --restore-release, output folder by default')
+    ap.add_argument('--size-report', default='', type=str, help='Write size report of output folder for the output key (with changes since previous build)')
+    ap.add_argument('--steps', type=str, default='', help='Steps like page list or intervals')
+    ap.add_argument('--skip-words', type=str, default='', help='Skip steps that contain these words (comma, separated)')
+    ap.add_argument('specfile', type=str, help='Specification File')
+
+    for cs_, filter_ in COMPLEX_STAGES.items():
+        selected_stages_ = [fname2stage(s_).replace('_', '-') for s_ in stages_names if filter_(s_)]
+        desc = ' + '.join(selected_stages_)
+        ap.add_argument(f'--{cs_}', default=False, action='store_true', help=f'{desc}')
+
+    args = ap.parse_args(argv)
+    options_ = vars(args)
+
+    selected = set(fname2stage(s_) for s_ in stages_names if options_[fname2stage(s_)])
+
+    if args.steps:
+        for step_ in args.steps.split(','):
+            if '-' in step_:
+                sfrom, sto = step_.split('-')
+                for s_ in stages_names:
+                    if int(sfrom) <= fname2num(s_) <= int(sto):
+                        selected.add(fname2stage(s_))
+            else:
+                for s_ in stages_names:
+                    if fname2num(s_) == int(step_):
+                        selected.add(fname2stage(s_))
+
+    for cs_, filter_ in COMPLEX_STAGES.items():
+        if options_[cs_.replace('-','_')]:
+            for s_ in stages_names:
+                if filter_(s_):
+                    selected.add(fname2stage(s_))
+
+    if args.skip_words:
+        for word_ in args.skip_words.split(','):
+            for s_ in stages_names:
+                if word_ in s_:
+                    selected.discard(fname2stage(s_))
+
+    fields_ = {f_.name for f_ in dc.fields(TAConfig)} - {'stages'}
+    return TAConfig(stages=selected, **{k: v for k, v in options_.items() if k in fields_})
@@ -0,0 +1,137 @@
+"""
+    Delta update packages between releases of output (stage_53_delta_package) for TA.
+
+    Every ISO of output is accompanied by release manifest {path: size, sha256},
+    saved when the image is written. Delta package (zip) contains only files added
+    or changed since the base release (read from the new ISO), list of deleted
+    files and script, which applies it to installed distribution.
+"""
+
+import os
+import json
+import glob
+import time
+import shutil
+
+RELEASE_MANIFEST_SUFFIX = '.manifest.json'
+RELEASE_MANIFEST_VERSION = 1
+# Marker with name of release image, put to output folder by scripts of stage_51.
+RELEASE_MARKER = 'isodistr.txt'
+
+
+def release_manifest_path(iso_filename):
+    return os.path.splitext(iso_filename)[0] + RELEASE_MANIFEST_SUFFIX
+
+
+def save_release_manifest(iso_filename, contents):
+    '''
+    Manifest of release image: {relative path with «/»: {'size', 'sha256'}}.
+    '''
+    path_ = release_manifest_path(iso_filename)
+    tmp_ = path_ + '.tmp'
+    with open(tmp_, 'w', encoding='utf-8') as lf:
+        json.dump({'version': RELEASE_MANIFEST_VERSION, 'image': os.path.basename(iso_filename),
+                   'files': contents}, lf, indent=1, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_, path_)
+    return path_
+
+
+def releases(output_dir):
+    '''
+    Names of releases (with manifest) in output dir, oldest first
+    (names start with date, as «dir /b /o:n» in scripts).
+    ISOs of old releases may be already moved to release store, manifests stay.
+    '''
+    return [os.path.basename(manifest_)[:-len(RELEASE_MANIFEST_SUFFIX)]
+            for manifest_ in sorted(glob.glob(os.path.join(output_dir, '*' + RELEASE_MANIFEST_SUFFIX)))]
+
+
+def diff_manifests(base, target):
+    '''
+    (added, changed, deleted) relative paths between contents of releases.
+    '''
+    added = sorted(set(target) - set(base))
+    deleted = sorted(set(base) - set(target))
+    changed = sorted(rel_ for rel_ in set(base) & set(target)
+                     if (base[rel_]['size'], base[rel_]['sha256']) != (target[rel_]['size'], target[rel_]['sha256']))
+    return added, changed, deleted
+
+
+def removed_dirs(base, target):
+    '''
+    Directories of base release, absent in target, deepest first.
+    '''
+    def dirs_of(files_):
+        dirs_ = set()
+        for rel_ in files_:
+            dir_ = os.path.dirname(rel_)
+            while dir_ and dir_ not in dirs_:
+                dirs_.add(dir_)
+                dir_ = os.path.dirname(dir_)
+        return dirs_
+    return sorted(dirs_of(base) - dirs_of(target), key=lambda d_: (-d_.count('/'), d_))
+
+
+def win_path(rel_path):
+    return rel_path.replace('/', '\\')
+
+
+def apply_script(base_name, target_name, check_marker):
+    '''
+    Script, applying unpacked delta to installed distribution (folder is argument, current by default).
+    '''
+    lines_ = [
+        '@echo off',
+        f'rem Update of {base_name} to {target_name}',
+        'chcp 65001 >NUL',
+        'set "TARGET=%~1"',
+        'if "%TARGET%"=="" set "TARGET=%CD%"',
+    ]
+    if check_marker:
+        lines_ += [
+            f'findstr /B /C:"{base_name}.iso" "%TARGET%\\{RELEASE_MARKER}" >NUL',
+            f'if %errorlevel% neq 0 echo "%TARGET%" is not {base_name} & exit /b 1',
+        ]
+    lines_ += [
+        'for /f "usebackq delims=" %%f in ("%~dp0delete.txt") do if exist "%TARGET%\\%%f" del /F /Q "%TARGET%\\%%f"',
+        'for /f "usebackq delims=" %%d in ("%~dp0delete-dirs.txt") do if exist "%TARGET%\\%%d" rd "%TARGET%\\%%d" 2>NUL',
+        'if exist "%~dp0files" xcopy "%~dp0files" "%TARGET%" /E /Y /I /Q /H /R',
+        'if %errorlevel% neq 0 exit /b %errorlevel%',
+        f'echo Updated to {target_name}',
+    ]
+    return '\r\n'.join(lines_) + '\r\n'
+
+
+def write_delta(iso_filename, base_name, base, target_name, target, delta_filename):
+    '''
+    Write delta package from base release to target (image iso_filename).
+    Returns stats: added, changed, deleted, bytes (of files in package), bytes_release (all files of target).
+    '''
+    import zipfile
+    import pycdlib
+
+    added, changed, deleted = diff_manifests(base, target)
+    iso = pycdlib.PyCdlib()
+    iso.open(iso_filename)
+    tmp_ = delta_filename + '.tmp'
+    stats = {'added': len(added), 'changed': len(changed), 'deleted': len(deleted), 'bytes': 0,
+             'bytes_release': sum(f_['size'] for f_ in target.values())}
+    with zipfile.ZipFile(tmp_, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for rel_ in sorted(added + changed):
+            size_ = target[rel_]['size']
+            info_ = zipfile.ZipInfo('files/' + rel_, time.localtime()[:6])
+            info_.compress_type = zipfile.ZIP_DEFLATED
+            with iso.open_file_from_iso(rr_path='/' + rel_) as src_, \
+                 zf.open(info_, 'w', force_zip64=size_ >= zipfile.ZIP64_LIMIT) as dst_:
+                shutil.copyfileobj(src_, dst_, 2**20)
+            stats['bytes'] += size_
+        zf.writestr('delete.txt', ''.join(win_path(rel_) + '\r\n' for rel_ in deleted))
+        zf.writestr('delete-dirs.txt', ''.join(win_path(dir_) + '\r\n' for dir_ in removed_dirs(base, target)))
+        zf.writestr('delta.json', json.dumps({
+            'base': base_name, 'target': target_name,
+            'added': added, 'changed': changed, 'deleted': deleted,
+        }, indent=1, ensure_ascii=False))
+        zf.writestr('apply-delta.bat', apply_script(base_name, target_name, RELEASE_MARKER in base))
+    iso.close()
+    os.replace(tmp_, delta_filename)
+    return stats
@@ -0,0 +1,133 @@
+"""
+    Content hashes of output folders and their verification for TA.
+
+    Files are hashed in parallel (hashlib releases GIL on large buffers),
+    hashes of unchanged files (same path, size and mtime) are taken from cache,
+    so manifests of outputs with sha256 cost only hashing of rebuilt files.
+"""
+
+import os
+import json
+import threading
+
+from .utils import file_sha256
+
+HASH_CACHE = 'tmp/outputs/hash-cache.json'
+
+
+class FileHashCache:
+    '''
+    sha256 of files, remembered per (path, size, mtime).
+    '''
+
+    def __init__(self, cache_path=HASH_CACHE):
+        self.cache_path = cache_path
+        self.paths = {}
+        self.dirty = False
+        self.lock = threading.RLock()
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as lf:
+                    self.paths = json.load(lf).get('paths', {})
+            except Exception as ex_:
+                print(f'Ignoring broken cache {cache_path}: {ex_}')
+        pass
+
+    def lookup(self, path, st_):
+        known_ = self.paths.get(path)
+        if known_ and known_[:2] == [st_.st_size, st_.st_mtime_ns]:
+            return known_[2]
+        return None
+
+    def store(self, path, st_, sha_):
+        with self.lock:
+            self.paths[path] = [st_.st_size, st_.st_mtime_ns, sha_]
+            self.dirty = True
+        pass
+
+    def save(self, keep=None):
+        '''
+        Write cache, only paths from keep (if given) are remembered.
+        '''
+        with self.lock:
+            if keep is not None:
+                keep = set(keep)
+                stale_ = [p_ for p_ in self.paths if p_ not in keep]
+                for p_ in stale_:
+                    del self.paths[p_]
+                self.dirty = self.dirty or bool(stale_)
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as lf:
+                json.dump({'paths': self.paths}, lf)
+            os.replace(tmp_path, self.cache_path)
+            self.dirty = False
+        pass
+
+
+def hash_files(paths, jobs=None, cache=None):
+    '''
+    {path: sha256} for (abs) paths, computed by jobs threads, unchanged files are taken from cache.
+    Returns (hashes, number of files really hashed).
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    hashes = {}
+    todo_ = []
+    for path_ in sorted(set(paths)):
+        st_ = os.stat(path_)
+        sha_ = cache.lookup(path_, st_) if cache else None
+        if sha_:
+            hashes[path_] = sha_
+        else:
+            todo_.append((path_, st_))
+
+    def hash_one(item_):
+        path_, st_ = item_
+        sha_ = file_sha256(path_)
+        if cache:
+            cache.store(path_, st_, sha_)
+        return sha_
+
+    with ThreadPoolExecutor(jobs or os.cpu_count() or 1) as pool:
+        for (path_, _), sha_ in zip(todo_, pool.map(hash_one, todo_)):
+            hashes[path_] = sha_
+    return hashes, len(todo_)
+
+
+def verify_tree(files, root, jobs=None):
+    '''
+    Check dir against manifest files {relative path with «/»: {'size', 'sha256', …}}.
+    All present files are hashed (no cache: mtimes of installed copies prove nothing).
+    Returns {'missing': [...], 'changed': [...], 'extra': [...], 'checked': N, 'bytes': N}.
+    '''
+    from .assembly import existing_files
+
+    present_ = {rel_.replace(os.sep, '/'): path_ for rel_, path_ in existing_files(root).items()}
+    # Windows file systems are case-insensitive.
+    by_key_ = {rel_.lower(): rel_ for rel_ in present_}
+    result = {'missing': [], 'changed': [], 'extra': [], 'checked': 0, 'bytes': 0}
+    to_hash = {}
+    matched_ = set()
+    for rel_, info_ in sorted(files.items()):
+        found_ = rel_ if rel_ in present_ else by_key_.get(rel_.lower())
+        if found_ is None:
+            result['missing'].append(rel_)
+            continue
+        matched_.add(found_)
+        if os.path.getsize(present_[found_]) != info_['size']:
+            result['changed'].append(rel_)
+            continue
+        to_hash[rel_] = present_[found_]
+    result['extra'] = sorted(set(present_) - matched_)
+
+    hashes_, _ = hash_files(to_hash.values(), jobs)
+    for rel_, path_ in sorted(to_hash.items()):
+        result['checked'] += 1
+        result['bytes'] += files[rel_]['size']
+        if hashes_[path_] != files[rel_].get('sha256'):
+            result['changed'].append(rel_)
+    result['changed'].sort()
+    return result
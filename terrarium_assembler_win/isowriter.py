@@ -0,0 +1,320 @@
+"""
+    Writing ISO images of output folders (stage_51_make_iso) for TA.
+
+    Image is built by pycdlib in one pass: files are streamed into it
+    straight from output folder, files with identical content share one extent
+    (hardlinks inside ISO), MD5/SHA-256 of the image are computed while it is written,
+    so ISO is never reread for checksums.
+"""
+
+import os
+import hashlib
+
+from .utils import file_sha256
+
+COPY_BLOCKSIZE = 2**20
+ISO_BLOCK = 2048
+ISO_CHECKSUMS = ('md5', 'sha256')
+
+
+class HashingWriter:
+    '''
+    Output of pycdlib, which computes checksums of the image while it is written.
+
+    pycdlib writes metadata (volume descriptors, path tables, directory records)
+    first and in arbitrary order, so it is collected in memory and flushed (and hashed)
+    when data of first file is read.
+    Data of files are written by extents, mostly forward; holes inside logical block
+    are padding zeros. Data, written ahead of hashed part, are kept as pending ranges
+    and hashed (reread from cache of just written file) when hashed part reaches them.
+    Overwrite of already hashed part (not expected) makes checksums recomputed at the end.
+    '''
+
+    def __init__(self, fp, algorithms=ISO_CHECKSUMS):
+        self.fp = fp
+        self.hashes = {name_: hashlib.new(name_) for name_ in algorithms}
+        self.head = bytearray()
+        self.streaming = False
+        self.pos = 0        # position for pycdlib
+        self.size = 0       # end of written data
+        self.hashed = 0     # everything before is written to fp and hashed
+        self.pending = []   # [start, end] of data written ahead of hashed part
+        self.reread = 0     # bytes hashed from pending ranges
+        self.rehash = False
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.pos = offset
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def _feed(self, data):
+        for hash_ in self.hashes.values():
+            hash_.update(data)
+        pass
+
+    def _reachable(self, offset):
+        '''
+        Hole from hashed part up to offset is padding inside logical block.
+        '''
+        block_ = ISO_BLOCK
+        return self.hashed <= offset <= (self.hashed + block_ - 1) // block_ * block_
+
+    def _zeros(self, offset):
+        '''
+        Hash zeros from hashed part up to offset (hole in file reads as zeros).
+        '''
+        zeros_ = bytes(min(COPY_BLOCKSIZE, max(offset - self.hashed, 0)))
+        while self.hashed < offset:
+            chunk_ = zeros_[:offset - self.hashed]
+            self._feed(chunk_)
+            self.hashed += len(chunk_)
+        pass
+
+    def _absorb(self, final=False):
+        '''
+        Hash pending ranges, reached by hashed part (all of them, if final).
+        '''
+        while self.pending and (final or self._reachable(self.pending[0][0])):
+            start_, end_ = self.pending.pop(0)
+            self._zeros(start_)
+            self.fp.seek(start_)
+            while self.hashed < end_:
+                chunk_ = self.fp.read(min(COPY_BLOCKSIZE, end_ - self.hashed))
+                self._feed(chunk_)
+                self.hashed += len(chunk_)
+                self.reread += len(chunk_)
+        pass
+
+    def write(self, data):
+        end_ = self.pos + len(data)
+        if not self.streaming:
+            if len(self.head) < end_:
+                self.head.extend(bytes(end_ - len(self.head)))
+            self.head[self.pos:end_] = data
+        else:
+            if self.fp.tell() != self.pos:
+                self.fp.seek(self.pos)
+            # Padding, written after its hole was already hashed as zeros, changes nothing.
+            padding_ = end_ <= self.hashed and not any(data) and not any(self.fp.read(len(data)))
+            if padding_:
+                self.fp.seek(self.pos)
+            self.fp.write(data)
+            if padding_:
+                pass
+            elif self.pos < self.hashed or any(s_ < end_ and self.pos < e_ for s_, e_ in self.pending):
+                self.rehash = True
+            elif self._reachable(self.pos):
+                self._zeros(self.pos)
+                self._feed(data)
+                self.hashed = end_
+            else:
+                for range_ in self.pending:
+                    if range_[1] == self.pos:
+                        range_[1] = end_
+                        break
+                else:
+                    self.pending.append([self.pos, end_])
+                    self.pending.sort()
+            if self.pending and not self.rehash:
+                self._absorb()
+        self.pos = end_
+        self.size = max(self.size, end_)
+        return len(data)
+
+    def start_streaming(self):
+        '''
+        Metadata is complete: write it out, further writes go straight to fp.
+        '''
+        if self.streaming:
+            return
+        self.streaming = True
+        head_, self.head = bytes(self.head), bytearray()
+        self.fp.seek(0)
+        self.fp.write(head_)
+        self._feed(head_)
+        self.hashed = len(head_)
+        pass
+
+    def finish(self):
+        '''
+        Write out the rest, returns {algorithm: hexdigest}.
+        '''
+        self.start_streaming()
+        self.fp.flush()
+        if self.rehash:
+            print('ISO was overwritten while writing, rereading it for checksums')
+            self.hashes = {name_: hashlib.new(name_) for name_ in self.hashes}
+            self.hashed, self.pending = 0, [[0, self.size]]
+        self._absorb(final=True)
+        self._zeros(self.size)
+        return {name_: hash_.hexdigest() for name_, hash_ in self.hashes.items()}
+
+
+class LazySource:
+    '''
+    File of output folder, given to pycdlib.
+    It is opened only when its data is copied to the image (there may be more files than allowed handles),
+    first open means for the writer, that metadata of the image is complete.
+    Data is hashed as it is read, for manifest of the image.
+    '''
+    mode = 'rb'
+
+    def __init__(self, path, size, writer):
+        self.path = path
+        self.size = size
+        self.writer = writer
+        self.fp = None
+        self.sha256 = hashlib.sha256()
+
+    def _open(self):
+        if self.fp is None:
+            self.writer.start_streaming()
+            assert os.path.getsize(self.path) == self.size, f'{self.path} changed while writing ISO'
+            self.fp = open(self.path, 'rb')
+        pass
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._open()
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        return self.fp.tell() if self.fp else 0
+
+    def read(self, size=-1):
+        self._open()
+        data_ = self.fp.read(size)
+        self.sha256.update(data_)
+        if self.fp.tell() >= self.size:
+            self.close()
+        return data_
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        pass
+
+
+def iso_path(rel_path):
+    return '/' + rel_path.replace(os.sep, '/').replace('\\', '/')
+
+
+def plan_iso(files):
+    '''
+    Files {relative path: abs path} → ([dirs], [(relative path, abs path, size, relative path of same content or None)]).
+    Same content is found by inode (output folders are hardlinks to builds),
+    then by sha256 among files of equal size.
+    '''
+    dirs_ = set()
+    by_inode, by_size = {}, {}
+    entries = []
+    for rel_, path_ in sorted(files.items()):
+        parent_ = os.path.dirname(rel_)
+        while parent_ and parent_ not in dirs_:
+            dirs_.add(parent_)
+            parent_ = os.path.dirname(parent_)
+        st_ = os.stat(path_)
+        entries.append((rel_, path_, st_))
+        if st_.st_size:
+            by_size.setdefault(st_.st_size, []).append((rel_, path_, st_))
+
+    same_as = {}
+    for size_, group_ in by_size.items():
+        if len(group_) < 2:
+            continue
+        first_by_digest = {}
+        for rel_, path_, st_ in group_:
+            key_ = (st_.st_dev, st_.st_ino) if st_.st_ino else None
+            if key_ in by_inode:
+                same_as[rel_] = by_inode[key_]
+                continue
+            digest_ = file_sha256(path_)
+            if digest_ in first_by_digest:
+                same_as[rel_] = first_by_digest[digest_]
+            else:
+                first_by_digest[digest_] = rel_
+            if key_:
+                by_inode[key_] = same_as.get(rel_, rel_)
+
+    return sorted(dirs_, key=lambda d_: (d_.count(os.sep), d_)), \
+           [(rel_, path_, st_.st_size, same_as.get(rel_)) for rel_, path_, st_ in entries]
+
+
+def new_iso(dirs_, entries, writer=None, vol_ident=''):
+    '''
+    pycdlib image (level 4, Rock Ridge — as «genisoimage -U -iso-level 4 -R») with entries of plan_iso,
+    and {relative path: LazySource} of stored files.
+    Without writer data of files are not accessible (image only for layout).
+    '''
+    import io
+    import pycdlib
+
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=4, rock_ridge='1.09', vol_ident=vol_ident)
+    for dir_ in dirs_:
+        iso.add_directory(iso_path(dir_), rr_name=os.path.basename(dir_))
+    sources_ = {}
+    for rel_, path_, size_, same_ in entries:
+        if not same_:
+            source_ = LazySource(path_, size_, writer) if writer else io.BytesIO()
+            iso.add_fp(source_, size_, iso_path(rel_), rr_name=os.path.basename(rel_))
+            sources_[rel_] = source_
+    for rel_, path_, size_, same_ in entries:
+        if same_:
+            iso.add_hard_link(iso_old_path=iso_path(same_), iso_new_path=iso_path(rel_),
+                              rr_name=os.path.basename(rel_))
+    return iso, sources_
+
+
+def extent_order(dirs_, entries):
+    '''
+    Entries sorted by extents, pycdlib will give them.
+    pycdlib writes data of files in order of adding, and extents are assigned
+    by walk of directories, so files are added by extents for sequential writing.
+    '''
+    probe_, _ = new_iso(dirs_, entries)
+    probe_.force_consistency()
+    extents_ = {rel_: probe_.get_record(iso_path=iso_path(rel_)).extent_location()
+                for rel_, _, _, same_ in entries if not same_}
+    probe_.close()
+    return sorted(entries, key=lambda e_: (extents_.get(e_[0], 0), e_[0]))
+
+
+def write_iso(files, iso_filename, vol_ident=''):
+    '''
+    Write ISO image of files {relative path: abs path}.
+    Returns stats: files, linked (stored once for several paths), bytes (of files), bytes_deduped,
+    bytes_reread (for checksums of data, written out of order), checksums of the image,
+    and contents {relative path with «/»: {'size', 'sha256'}} (hashed while written).
+    '''
+    dirs_, entries = plan_iso(files)
+    entries = extent_order(dirs_, entries)
+
+    tmp_ = iso_filename + '.tmp'
+    with open(tmp_, 'w+b') as lf:
+        writer = HashingWriter(lf)
+        iso, sources_ = new_iso(dirs_, entries, writer, vol_ident)
+        iso.write_fp(writer, blocksize=COPY_BLOCKSIZE)
+        checksums_ = writer.finish()
+        iso.close()
+    os.replace(tmp_, iso_filename)
+
+    stats = {
+        'files': len(entries),
+        'linked': sum(1 for e_ in entries if e_[3]),
+        'bytes': sum(e_[2] for e_ in entries),
+        'bytes_deduped': sum(e_[2] for e_ in entries if e_[3]),
+        'bytes_reread': writer.reread,
+    }
+    stats.update(checksums_)
+    stats['contents'] = {}
+    for rel_, path_, size_, same_ in entries:
+        source_ = sources_[same_ or rel_]
+        stats['contents'][rel_.replace(os.sep, '/')] = {'size': size_, 'sha256': source_.sha256.hexdigest()}
+    return stats
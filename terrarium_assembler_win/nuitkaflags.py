@@ -4,26 +4,62 @@
 
 import os
 import sys
-from setuptools import find_packages
 from pkgutil import iter_modules
 
 import dataclasses as dc
 import importlib
 import pathlib
 import re
+import threading
 
-PACKAGES_DIRS = [
-os.getcwd(), 
-'/opt/venvdm/lib64/python3.8/site-packages/', 
-'/opt/venvdm/src',
-'/usr/lib/python3.8/site-packages/',
-'/usr/lib64/python3.8/site-packages/',
-]
+
+# Module indexes are shared by all assemblers of the process (batch mode),
+# so keys are absolute paths; call clear_module_caches() if sources may have changed.
+_FIND_MODULES_CACHE = {}
+_DIR4MODULE_CACHE = {}
+_IMPORT_LOCK = threading.Lock()
+
+
+def clear_module_caches(dirs=None):
+    '''
+    Forget module indexes (all, or related to given source dirs).
+    '''
+    if dirs is None:
+        _FIND_MODULES_CACHE.clear()
+        _DIR4MODULE_CACHE.clear()
+        return
+
+    def related(path_):
+        path_ = os.path.abspath(path_)
+        for dir_ in dirs:
+            dir_ = os.path.abspath(dir_)
+            try:
+                if os.path.commonpath([path_, dir_]) in (path_, dir_):
+                    return True
+            except ValueError:
+                # Different drives.
+                pass
+        return False
+
+    for key_ in [k_ for k_ in _FIND_MODULES_CACHE if related(k_)]:
+        del _FIND_MODULES_CACHE[key_]
+    for key_ in [k_ for k_, v_ in _DIR4MODULE_CACHE.items() if v_ is None or related(v_)]:
+        del _DIR4MODULE_CACHE[key_]
+    pass
 
 
 def find_modules(path):
     if not path:
         return None
+
+    key_ = os.path.abspath(path)
+    if key_ not in _FIND_MODULES_CACHE:
+        _FIND_MODULES_CACHE[key_] = frozenset(_find_modules(path))
+    return set(_FIND_MODULES_CACHE[key_])
+
+
+def _find_modules(path):
+    from setuptools import find_packages
         
     modules = set()
     rootdir, base_package_name = os.path.split(path)
@@ -51,7 +87,43 @@ def find_modules(path):
     return modules
 
 
-def dir4module(modname):
+def dir4module(modname, package_dirs=None):
+    '''
+    Directory of module: found in package_dirs (of project), else by import.
+    '''
+    package_dirs = tuple(os.path.abspath(d_) for d_ in package_dirs or [])
+    key_ = (modname, package_dirs)
+    # Importing and unloading touches sys.modules, so only one thread at a time.
+    with _IMPORT_LOCK:
+        if key_ not in _DIR4MODULE_CACHE:
+            _DIR4MODULE_CACHE[key_] = _find_module_dir(modname, package_dirs) or _dir4module(modname)
+        return _DIR4MODULE_CACHE[key_]
+
+
+def _find_module_dir(modname, package_dirs):
+    '''
+    Directory of module in package_dirs, without import.
+    '''
+    from importlib.machinery import PathFinder
+
+    if not package_dirs:
+        return None
+    spec_ = None
+    path_ = list(package_dirs)
+    for name_ in modname.split('.'):
+        spec_ = PathFinder.find_spec(name_, path_)
+        if spec_ is None:
+            return None
+        path_ = list(spec_.submodule_search_locations or [])
+    if spec_.has_location and spec_.origin:
+        return str(pathlib.Path(spec_.origin).resolve().parent)
+    if path_:
+        # Namespace package.
+        return str(pathlib.Path(path_[0]).resolve())
+    return None
+
+
+def _dir4module(modname):
     try:
         mod = importlib.__import__(modname)
     except:    
@@ -65,17 +137,20 @@ def dir4module(modname):
     return str(pathlib.Path(mod.__file__).resolve().parent)
 
 
-def dir4mnode(target_):
+def dir4mnode(target_, base_dir=None, package_dirs=None):
+    '''
+    Directory of «module» target: its «folder» (relative to base_dir) or found one.
+    '''
     module = target_.module
     module_dir = None
     if "folder" in target_:
-        module_dir = target_.folder   
+        module_dir = os.path.join(base_dir or os.getcwd(), target_.folder)
     else:    
-        module_dir = dir4module(module)
+        module_dir = dir4module(module, package_dirs)
     return module_dir
 
 
-def flags4module(modname, module_dir, block_modules=None):
+def flags4module(modname, module_dir, block_modules=None, module_arg=None):
     # modnames_ = [modname]
     mods = sorted(find_modules(module_dir)) 
     disabled_re = None
@@ -100,7 +175,7 @@ def flags4module(modname, module_dir, block_modules=None):
                 else:
                     flags.append(' --include-module ' + modname_  )
 
-    flags.append("--module  %s" % module_dir)
+    flags.append("--module  %s" % (module_arg or module_dir))
     return flags
 
 
@@ -115,9 +190,11 @@ class NuitkaFlags:
     std_flags: list = ('show-progress', 'show-scons')  # base flags
 
     # def get_flags(self, out_dir, module=None, block_modules=None):
-    def get_flags(self, out_dir, target_):
+    def get_flags(self, out_dir, target_, base_dir=None, package_dirs=None):
         '''
-        Get flags for Nuitka compiler
+        Get flags for Nuitka compiler.
+        Folders of targets are relative to base_dir (project dir),
+        modules are searched in package_dirs first.
         '''
         block_modules = None
         if block_modules in target_:
@@ -136,10 +213,11 @@ class NuitkaFlags:
             for it_ in self.block_packages:
                 flags.append('--nofollow-import-to=' + it_)
         if "module" in target_:
-            module_dir = dir4mnode(target_)
+            module_dir = dir4mnode(target_, base_dir, package_dirs)
             if not module_dir:
                 return ''
-            flags += flags4module(target_.module, module_dir, block_modules)
+            flags += flags4module(target_.module, module_dir, block_modules,
+                                  module_arg=target_.folder if "folder" in target_ else None)
         else:
             flags.append('--standalone') 
             flags.append('--follow-imports') 
@@ -0,0 +1,55 @@
+"""
+    Build plan of TA: what stages generate in one pass,
+    consumed both by script writer and by executor.
+"""
+
+import json
+import dataclasses as dc
+
+
+@dc.dataclass
+class PlanStep:
+    '''
+    One generated command file (and, optionally, python action instead of running it).
+    '''
+    name: str                   # name of the step («stage_06_checkout», «build-project»)
+    script: str                 # generated command file
+    stage: str = None           # stage option («stage_checkout»), if step is a stage
+    lines: list = dc.field(default_factory=list)    # shell commands
+    action: str = None          # TA method performed in-process instead of the script
+    depends: list = dc.field(default_factory=list)  # scripts called by this one
+    inputs: list = dc.field(default_factory=list)   # files/dirs, used by the step
+    outputs: list = dc.field(default_factory=list)  # files/dirs, produced by the step
+
+
+@dc.dataclass
+class BuildPlan:
+    '''
+    All steps in the order of generation, and environment common for all scripts.
+    '''
+    env: dict = dc.field(default_factory=dict)
+    steps: list = dc.field(default_factory=list)
+
+    def add(self, step):
+        self.steps.append(step)
+        return step
+
+    def stage_steps(self):
+        return [s_ for s_ in self.steps if s_.stage]
+
+    def to_dict(self):
+        return dc.asdict(self)
+
+    def dump(self, path):
+        '''
+        Deterministic JSON, to diff plans between runs.
+        '''
+        with open(path, 'w', encoding='utf-8') as lf:
+            json.dump(self.to_dict(), lf, indent=1, ensure_ascii=False, sort_keys=True)
+        pass
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as lf:
+            data_ = json.load(lf)
+        return cls(env=data_['env'], steps=[PlanStep(**s_) for s_ in data_['steps']])
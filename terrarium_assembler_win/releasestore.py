@@ -0,0 +1,238 @@
+"""
+    Archive of releases (ISOs) of outputs (stage_55_store_releases) for TA.
+
+    Consecutive releases share most of their bytes, so images are stored
+    as content-defined chunks (shared by all releases of all outputs) plus index
+    of every release. Data of files in ISO is aligned to sectors, and inserted or
+    changed files shift the rest by whole sectors, so chunk boundaries are chosen
+    at sector boundaries by content of the sector — the rest of image gives the same chunks.
+    Any release is restored bit-exact (checked by sha256), old ones are evicted
+    by retention policy, chunks not used by remaining releases are removed.
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+
+SECTOR = 2048
+CHUNK_MIN = 64 * 2**10
+CHUNK_AVG = 2**20           # power of two
+CHUNK_MAX = 8 * 2**20
+READ_SIZE = 8 * 2**20
+INDEX_VERSION = 1
+# Sidecar files of release, kept in its index (small, needed for deltas and checks).
+RELEASE_SIDECARS = ['.manifest.json', '.changelog.txt']
+
+
+def sector_chunks(fp, min_size=CHUNK_MIN, avg_size=CHUNK_AVG, max_size=CHUNK_MAX):
+    '''
+    Content-defined chunks of stream, boundaries are at sector boundaries,
+    where CRC of the sector matches mask (or chunk reached max size).
+    '''
+    mask_ = avg_size // SECTOR - 1
+    pending_ = []
+    pending_size = 0
+    while True:
+        block_ = fp.read(READ_SIZE)
+        if not block_:
+            break
+        view_ = memoryview(block_)
+        start_ = 0
+        for offset_ in range(0, len(block_), SECTOR):
+            end_ = min(offset_ + SECTOR, len(block_))
+            size_ = pending_size + end_ - start_
+            if size_ >= max_size or (size_ >= min_size and zlib.crc32(view_[offset_:end_]) & mask_ == mask_):
+                pending_.append(view_[start_:end_])
+                yield b''.join(pending_)
+                pending_, pending_size, start_ = [], 0, end_
+        if start_ < len(block_):
+            pending_.append(view_[start_:])
+            pending_size += len(block_) - start_
+    if pending_:
+        yield b''.join(pending_)
+
+
+class ReleaseStore:
+    '''
+    Chunks «chunks/ab/<sha256>[.z]» (zlib-compressed, if it helps) and
+    indexes «index/<output key>/<release>.json» with list of chunks of the image.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def chunk_path(self, sha_):
+        return os.path.join(self.root, 'chunks', sha_[:2], sha_)
+
+    def index_path(self, output_key, name):
+        return os.path.join(self.root, 'index', output_key.replace('/', '-'), name + '.json')
+
+    def has_chunk(self, sha_):
+        path_ = self.chunk_path(sha_)
+        return os.path.exists(path_) or os.path.exists(path_ + '.z')
+
+    def put_chunk(self, sha_, data):
+        '''
+        Store chunk, if it is new. Returns stored size (0 for known chunk).
+        '''
+        if self.has_chunk(sha_):
+            return 0
+        path_ = self.chunk_path(sha_)
+        packed_ = zlib.compress(data, 1)
+        if len(packed_) < len(data) * 0.95:
+            path_, data = path_ + '.z', packed_
+        os.makedirs(os.path.dirname(path_), exist_ok=True)
+        tmp_ = path_ + '.tmp'
+        with open(tmp_, 'wb') as lf:
+            lf.write(data)
+        os.replace(tmp_, path_)
+        return len(data)
+
+    def get_chunk(self, sha_):
+        path_ = self.chunk_path(sha_)
+        if os.path.exists(path_ + '.z'):
+            with open(path_ + '.z', 'rb') as lf:
+                return zlib.decompress(lf.read())
+        with open(path_, 'rb') as lf:
+            return lf.read()
+
+    def releases(self, output_key):
+        '''
+        Indexes of stored releases of output, oldest first.
+        '''
+        dir_ = os.path.dirname(self.index_path(output_key, 'x'))
+        if not os.path.isdir(dir_):
+            return []
+        result = []
+        for name_ in sorted(os.listdir(dir_)):
+            if name_.endswith('.json'):
+                with open(os.path.join(dir_, name_), 'r', encoding='utf-8') as lf:
+                    result.append(json.load(lf))
+        return sorted(result, key=lambda r_: (r_['created'], r_['name']))
+
+    def has_release(self, output_key, name):
+        return os.path.exists(self.index_path(output_key, name))
+
+    def put(self, output_key, iso_filename):
+        '''
+        Store image (and its sidecars). Returns stats: size, chunks, new_chunks, bytes_stored.
+        '''
+        name_ = os.path.splitext(os.path.basename(iso_filename))[0]
+        sha256_ = hashlib.sha256()
+        chunks_ = []
+        stats = {'size': 0, 'chunks': 0, 'new_chunks': 0, 'bytes_stored': 0}
+        with open(iso_filename, 'rb') as lf:
+            for chunk_ in sector_chunks(lf):
+                sha256_.update(chunk_)
+                chunk_sha = hashlib.sha256(chunk_).hexdigest()
+                stored_ = self.put_chunk(chunk_sha, chunk_)
+                chunks_.append([chunk_sha, len(chunk_)])
+                stats['size'] += len(chunk_)
+                stats['chunks'] += 1
+                stats['new_chunks'] += bool(stored_)
+                stats['bytes_stored'] += stored_
+
+        sidecars_ = {}
+        for suffix_ in RELEASE_SIDECARS:
+            path_ = os.path.splitext(iso_filename)[0] + suffix_
+            if os.path.exists(path_):
+                with open(path_, 'r', encoding='utf-8') as lf:
+                    sidecars_[suffix_] = lf.read()
+
+        index_ = {
+            'version': INDEX_VERSION,
+            'output': output_key,
+            'name': name_,
+            'image': os.path.basename(iso_filename),
+            'created': os.path.getmtime(iso_filename),
+            'size': stats['size'],
+            'sha256': sha256_.hexdigest(),
+            'chunks': chunks_,
+            'sidecars': sidecars_,
+        }
+        path_ = self.index_path(output_key, name_)
+        os.makedirs(os.path.dirname(path_), exist_ok=True)
+        tmp_ = path_ + '.tmp'
+        with open(tmp_, 'w', encoding='utf-8') as lf:
+            json.dump(index_, lf, ensure_ascii=False)
+        os.replace(tmp_, path_)
+        return stats
+
+    def restore(self, output_key, name, dest_dir):
+        '''
+        Reproduce image (and sidecars) of release in dest_dir, checked by sha256.
+        Returns path of image.
+        '''
+        path_ = self.index_path(output_key, name)
+        assert os.path.exists(path_), f'No release «{name}» of {output_key} in {self.root}'
+        with open(path_, 'r', encoding='utf-8') as lf:
+            index_ = json.load(lf)
+
+        os.makedirs(dest_dir, exist_ok=True)
+        iso_filename = os.path.join(dest_dir, index_['image'])
+        tmp_ = iso_filename + '.tmp'
+        sha256_ = hashlib.sha256()
+        with open(tmp_, 'wb') as lf:
+            for chunk_sha, size_ in index_['chunks']:
+                data_ = self.get_chunk(chunk_sha)
+                assert len(data_) == size_ and hashlib.sha256(data_).hexdigest() == chunk_sha, \
+                    f'Chunk {chunk_sha} of {name} is damaged'
+                sha256_.update(data_)
+                lf.write(data_)
+        assert sha256_.hexdigest() == index_['sha256'], f'Restored {name} differs from stored one'
+        os.replace(tmp_, iso_filename)
+        os.utime(iso_filename, (index_['created'], index_['created']))
+        for suffix_, text_ in index_['sidecars'].items():
+            sidecar_ = os.path.splitext(iso_filename)[0] + suffix_
+            if not os.path.exists(sidecar_):
+                with open(sidecar_, 'w', encoding='utf-8') as lf:
+                    lf.write(text_)
+        return iso_filename
+
+    def evict(self, output_key, keep_last=None, keep_days=None, pinned=()):
+        '''
+        Remove releases, not kept by any rule: among last keep_last,
+        younger than keep_days, or pinned (names). Returns names of removed.
+        '''
+        releases_ = self.releases(output_key)
+        now_ = time.time()
+        removed = []
+        for i_, release_ in enumerate(releases_):
+            keep_ = release_['name'] in pinned
+            keep_ = keep_ or (keep_last is not None and i_ >= len(releases_) - keep_last)
+            keep_ = keep_ or (keep_days is not None and now_ - release_['created'] < keep_days * 86400)
+            keep_ = keep_ or (keep_last is None and keep_days is None)
+            if not keep_:
+                os.unlink(self.index_path(output_key, release_['name']))
+                removed.append(release_['name'])
+        return removed
+
+    def gc(self):
+        '''
+        Remove chunks, not used by any release (of any output). Returns (chunks, bytes) removed.
+        '''
+        used_ = set()
+        index_root = os.path.join(self.root, 'index')
+        for dir_, _, files_ in os.walk(index_root):
+            for name_ in files_:
+                if name_.endswith('.json'):
+                    with open(os.path.join(dir_, name_), 'r', encoding='utf-8') as lf:
+                        used_.update(sha_ for sha_, _ in json.load(lf)['chunks'])
+        removed_, bytes_ = 0, 0
+        for dir_, _, files_ in os.walk(os.path.join(self.root, 'chunks')):
+            for name_ in files_:
+                sha_ = name_.split('.')[0]
+                if sha_ not in used_:
+                    path_ = os.path.join(dir_, name_)
+                    bytes_ += os.path.getsize(path_)
+                    os.unlink(path_)
+                    removed_ += 1
+        return removed_, bytes_
+
+    def stored_bytes(self):
+        total_ = 0
+        for dir_, _, files_ in os.walk(os.path.join(self.root, 'chunks')):
+            total_ += sum(os.path.getsize(os.path.join(dir_, f_)) for f_ in files_)
+        return total_
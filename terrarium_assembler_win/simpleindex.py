@@ -0,0 +1,120 @@
+"""
+    Local PEP 503 «simple» index over TA wheel directories.
+
+    Index is updated incrementally: page of the project is rewritten
+    only if the set of its files (names and hashes) changed.
+"""
+
+import os
+import json
+import html
+import hashlib
+import shutil
+import urllib.parse
+from pathlib import Path
+
+from .wheel_utils import parse_wheel_filename, InvalidFilenameError
+from .wheelhouse import WheelMetadataCache
+
+SIMPLE_INDEX_STATE = '.ta-index-state.json'
+ARCHIVE_EXTS = ('.whl', '.tar.gz', '.tar.bz2')
+
+
+def index_url(index_dir):
+    '''
+    URL of the index for pip «--index-url».
+    '''
+    return Path(index_dir).resolve().as_uri() + '/'
+
+
+def collect_index_files(wheel_dirs):
+    '''
+    {canonical project name: [(filename, path)]}
+    '''
+    from packaging.utils import canonicalize_name
+
+    projects = {}
+    for dir_ in wheel_dirs:
+        if not dir_ or not os.path.isdir(dir_):
+            continue
+        for file_ in sorted(os.listdir(dir_)):
+            if not file_.lower().endswith(ARCHIVE_EXTS):
+                continue
+            try:
+                project_ = parse_wheel_filename(file_).project
+            except InvalidFilenameError:
+                print(f'Skipping {file_} in index: cannot parse name')
+                continue
+            projects.setdefault(canonicalize_name(project_), []).append((file_, os.path.join(dir_, file_)))
+    return projects
+
+
+def project_page(name, files, page_dir, cache):
+    lines = ['<!DOCTYPE html>', f'<html><head><title>Links for {html.escape(name)}</title></head><body>',
+             f'<h1>Links for {html.escape(name)}</h1>']
+    seen = set()
+    for file_, path_ in files:
+        if file_ in seen:
+            # Same file in several dirs: first (by order of dirs) wins.
+            continue
+        seen.add(file_)
+        sha_ = cache.sha256(path_)
+        rel_ = os.path.relpath(os.path.abspath(path_), start=os.path.abspath(page_dir)).replace(os.sep, '/')
+        attrs_ = ''
+        if file_.endswith('.whl'):
+            try:
+                requires_python = cache.get(path_).get('requires_python')
+                if requires_python:
+                    attrs_ = f' data-requires-python="{html.escape(requires_python)}"'
+            except Exception:
+                pass
+        lines.append(f'<a href="{urllib.parse.quote(rel_)}#sha256={sha_}"{attrs_}>{html.escape(file_)}</a><br/>')
+    lines.append('</body></html>')
+    return '\n'.join(lines) + '\n'
+
+
+def update_simple_index(index_dir, wheel_dirs, cache=None):
+    '''
+    Create/refresh index. Returns list of projects with rewritten pages.
+    '''
+    if cache is None:
+        cache = WheelMetadataCache()
+    index_dir = os.path.abspath(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+
+    state_path = os.path.join(index_dir, SIMPLE_INDEX_STATE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as lf:
+            state = json.load(lf)
+
+    projects = collect_index_files(wheel_dirs)
+    changed = []
+    new_state = {}
+    for name_, files_ in sorted(projects.items()):
+        page_dir = os.path.join(index_dir, name_)
+        page_ = project_page(name_, files_, page_dir, cache)
+        digest_ = hashlib.sha256(page_.encode('utf-8')).hexdigest()
+        new_state[name_] = digest_
+        page_path = os.path.join(page_dir, 'index.html')
+        if state.get(name_) == digest_ and os.path.exists(page_path):
+            continue
+        os.makedirs(page_dir, exist_ok=True)
+        Path(page_path).write_text(page_, encoding='utf-8')
+        changed.append(name_)
+
+    for name_ in sorted(set(state) - set(new_state)):
+        shutil.rmtree(os.path.join(index_dir, name_), ignore_errors=True)
+        changed.append(name_)
+
+    if changed or not os.path.exists(os.path.join(index_dir, 'index.html')):
+        root_ = ['<!DOCTYPE html>', '<html><head><title>Simple index</title></head><body>']
+        for name_ in sorted(new_state):
+            root_.append(f'<a href="{name_}/">{name_}</a><br/>')
+        root_.append('</body></html>')
+        Path(os.path.join(index_dir, 'index.html')).write_text('\n'.join(root_) + '\n', encoding='utf-8')
+        with open(state_path, 'w', encoding='utf-8') as lf:
+            json.dump(new_state, lf, indent=1)
+
+    cache.save()
+    return changed
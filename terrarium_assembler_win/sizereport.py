@@ -0,0 +1,104 @@
+"""
+    Size reports of output folders (stage_50_output) for TA.
+
+    Size of output is broken down by source rules of spec («folder <- source»),
+    by executables (files from source dir of «.exe» and its subdirs,
+    as Nuitka «*.dist» folders are), by top folders and largest files,
+    and compared with the previous build, so growth of distribution is seen early.
+"""
+
+import os
+
+REPORT_TOP = 20
+OTHER = '(other)'
+
+
+def executable_groups(files):
+    '''
+    {path in output: executable(s)}, which source dir (deepest) contains source of the file.
+    '''
+    exe_dirs = {}
+    for rel_, info_ in files.items():
+        if rel_.lower().endswith('.exe'):
+            dir_ = os.path.normcase(os.path.dirname(info_['source']))
+            exe_dirs.setdefault(dir_, []).append(os.path.basename(rel_))
+
+    result = {}
+    for rel_, info_ in files.items():
+        dir_ = os.path.normcase(os.path.dirname(info_['source']))
+        while dir_ not in exe_dirs and os.path.dirname(dir_) != dir_:
+            dir_ = os.path.dirname(dir_)
+        result[rel_] = ', '.join(sorted(exe_dirs[dir_])) if dir_ in exe_dirs else OTHER
+    return result
+
+
+def size_breakdown(files, folder_sizes, out_dir, top=REPORT_TOP):
+    '''
+    Sizes of output: files — manifest {path: {'source', 'size', 'rule'}},
+    folder_sizes — {dir: size} of output folder on disk (utils.folder_sizes).
+    '''
+    rules_ = {}
+    executables_ = {}
+    groups_ = executable_groups(files)
+    for rel_, info_ in files.items():
+        rule_ = info_.get('rule', OTHER)
+        rules_[rule_] = rules_.get(rule_, 0) + info_['size']
+        executables_[groups_[rel_]] = executables_.get(groups_[rel_], 0) + info_['size']
+
+    out_dir = os.fspath(out_dir)
+    folders_ = {os.path.relpath(dir_, out_dir).replace(os.sep, '/'): size_
+                for dir_, size_ in folder_sizes.items() if os.path.dirname(dir_) == out_dir}
+    largest_ = sorted(files.items(), key=lambda item_: (-item_[1]['size'], item_[0]))[:top]
+    return {
+        'total': sum(f_['size'] for f_ in files.values()),
+        'disk_total': folder_sizes.get(out_dir, 0),
+        'files': len(files),
+        'rules': rules_,
+        'executables': executables_,
+        'folders': folders_,
+        'largest': {rel_: info_['size'] for rel_, info_ in largest_},
+        'sizes': {rel_: info_['size'] for rel_, info_ in files.items()},
+    }
+
+
+def mib(bytes_):
+    return f'{bytes_/2**20:.1f} MiB'
+
+
+def signed_mib(bytes_):
+    return ('+' if bytes_ >= 0 else '-') + mib(abs(bytes_))
+
+
+def report_lines(output_key, current, previous=None, top=REPORT_TOP):
+    '''
+    Text report of size breakdown, with changes since previous one (if any).
+    '''
+    def table(title, sizes_, previous_sizes, gone=True):
+        lines_ = [f'', f'{title}:']
+        for name_, size_ in sorted(sizes_.items(), key=lambda item_: (-item_[1], item_[0]))[:top]:
+            line_ = f'  {mib(size_):>12}  '
+            if previous_sizes is not None:
+                line_ += f'{signed_mib(size_ - previous_sizes.get(name_, 0)):>12}  ' if name_ in previous_sizes else f'{"new":>12}  '
+            lines_.append(line_ + name_)
+        if previous_sizes is not None and gone:
+            for name_ in sorted(set(previous_sizes) - set(sizes_)):
+                lines_.append(f'  {"":>12}  {signed_mib(-previous_sizes[name_]):>12}  {name_} (gone)')
+        return lines_
+
+    has_previous = previous is not None
+    lines = [f'Output {output_key}: {current["files"]} files, {mib(current["total"])} '
+             f'({mib(current["disk_total"])} in folder)']
+    if has_previous:
+        lines.append(f'Since previous build: {signed_mib(current["total"] - previous["total"])}, '
+                     f'{current["files"] - previous["files"]:+} files')
+    for key_, title_ in [('rules', 'By source rule'), ('executables', 'By executable'), ('folders', 'By folder')]:
+        lines += table(title_, current[key_], previous[key_] if has_previous else None)
+    lines += table('Largest files', current['largest'], previous['sizes'] if has_previous else None, gone=False)
+
+    if has_previous:
+        growth_ = {rel_: size_ - previous['sizes'].get(rel_, 0) for rel_, size_ in current['sizes'].items()}
+        growth_ = {rel_: delta_ for rel_, delta_ in growth_.items() if delta_ > 0}
+        lines += table('Grown files', growth_, None)
+        removed_ = {rel_: size_ for rel_, size_ in previous['sizes'].items() if rel_ not in current['sizes']}
+        lines += table('Removed files', removed_, None)
+    return lines
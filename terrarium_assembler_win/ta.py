@@ -1,21 +1,21 @@
 """Main module."""
 
-import argparse
 import os
 import subprocess
 import shutil
 import sys
-from tempfile import mkstemp
+import time
 import re
-import yaml
+import threading
 import dataclasses as dc
 import json
-import csv
-import requirements
 
+# Heavy modules (yaml, jinja2, setuptools, requirements, packaging)
+# are imported only in stages that need them, to keep startup fast.
 from .wheel_utils import parse_wheel_filename
 from .utils import *
-from .nuitkaflags import *
+from .plan import BuildPlan, PlanStep
+from .config import TAConfig, parse_config
 from pathlib import Path, PurePath
 
 DEBUG = False
@@ -30,6 +30,27 @@ FSUTIL DIRTY query %SystemDrive% >NUL || (
 """
 
 INSTALL_ALL_WHEELS_SCRIPT="install-all-wheels.py"
+TA_ENV_SCRIPT="ta-env.bat"
+
+# Stages to replan in «--watch» mode, when sources of projects or wheel dirs change.
+WATCH_SOURCE_STAGES = ['stage_08_build_wheels', 'stage_09_download_wheels', 'stage_40_build_projects']
+# Scripts do not depend on content of wheel dirs: lockfile is checked when stage_09 runs.
+WATCH_WHEEL_STAGES = []
+
+# Files, that scripts of stages put to output folder besides its manifest.
+OUTPUT_MARKER_FILES = ['isodistr.txt']
+
+# Script of stage_09 with full resolution of wheels, called if lockfile is absent or stale.
+RESOLVE_WHEELS_SCRIPT = 'download-wheels-resolve'
+
+# Lines, after which check of errorlevel is useless:
+# comments, «set», «for» (as before), plain echo and explicit checks.
+NO_ERRORLEVEL_CHECK_RE = re.compile(r'''^(for |set |rem |rem$|::|if %errorlevel%|goto |@?echo(?!.*[|>]))''', re.IGNORECASE)
+
+
+def need_errorlevel_check(line):
+    return bool(line.strip()) and not NO_ERRORLEVEL_CHECK_RE.match(line)
+
 
 def write_doc_table(filename, headers, rows):
     with open(filename, 'w', encoding='utf-8') as lf:
@@ -73,24 +94,28 @@ class TerrariumAssembler:
     Генерация переносимых бинарных дистрибутивов для Python-проектов под Windows
     '''
 
-    def __init__(self):
-        self.curdir = os.getcwd()
+    def __init__(self, config=None, curdir=None):
+        '''
+        config — TAConfig (from command line, if not given),
+        curdir — project dir, where scripts are generated (current dir by default).
+        All paths of the project are resolved against curdir,
+        current dir of the process is never changed.
+        '''
+        self.curdir = os.path.abspath(curdir or os.getcwd())
+        self._planning = threading.local()
+        self.shared_wheel_cache = None
         self.root_dir = None
         self.ta_name = 'terrarium_assembler'
 
-        self.pipenv_dir = ''
-        from pipenv.project import Project
-        p = Project()
-        self.pipenv_dir = p.virtualenv_location
+        # Generated scripts always create venv in project (PIPENV_VENV_IN_PROJECT=1),
+        # so pipenv is needed only to create it, and venv python is called directly.
+        self.pipenv_dir = self.project_path('.venv')
+        self.venv_python = r'%TA_PIPENV_DIR%\Scripts\python.exe'
         self.need_pips = ['pip-audit', 'pipdeptree', 'ordered-set', 'cyclonedx-bom']
 
         vars_ = {
         }
 
-        ap = argparse.ArgumentParser(description='Create a portable windows application')
-        ap.add_argument('--debug', default=False, action='store_true', help='Debug version of release')
-        ap.add_argument('--docs', default=False, action='store_true', help='Output documentation version')
-
         self.stages_names = sorted([method_name for method_name in dir(self) if method_name.startswith('stage_')])
         self.stage_methods = [getattr(self, stage_) for stage_ in self.stages_names]
 
@@ -98,151 +123,160 @@ class TerrariumAssembler:
         for s_, sm_ in zip(self.stages_names, self.stage_methods):
             self.stages[fname2stage(s_)] = sm_.__doc__.strip()
 
-        for stage, desc in self.stages.items():
-            ap.add_argument(f'--{fname2option(stage)}', default=False,
-                            action='store_true', help=f'{desc}')
-
-        ap.add_argument('--folder-command', default='', type=str, help='Perform some shell command for all projects')
-        ap.add_argument('--git-sync', default='', type=str, help='Perform lazy git sync for all projects')
-        ap.add_argument('--steps', type=str, default='', help='Steps like page list or intervals')
-        ap.add_argument('--skip-words', type=str, default='', help='Skip steps that contain these words (comma, separated)')
-        ap.add_argument('specfile', type=str, help='Specification File')
-
-
-        complex_stages = {
-            "stage-all": lambda stage: fname2num(stage)>0 and fname2num(stage)<60 and not 'audit' in stage,
-            "stage-rebuild": lambda stage: fname2num(stage)>0 and fname2num(stage)<60 and not 'checkout' in stage and not 'download' in stage and not 'audit' in stage,
-        }
-
-        for cs_, filter_ in complex_stages.items():
-            desc = []
-            selected_stages_ = [fname2stage(s_).replace('_', '-') for s_ in self.stages_names if filter_(s_)]
-            desc = ' + '.join(selected_stages_)
-            ap.add_argument(f'--{cs_}', default=False, action='store_true', help=f'{desc}')
-
-
-        self.args = args = ap.parse_args()
-
-        if args.steps:
-            for step_ in args.steps.split(','):
-                if '-' in step_:
-                    sfrom, sto = step_.split('-')
-                    for s_ in self.stages_names:
-                        if int(sfrom) <= fname2num(s_) <= int(sto):
-                            setattr(self.args, fname2stage(s_).replace('-','_'), True)
-                else:
-                    for s_ in self.stages_names:
-                        if fname2num(s_) == int(step_):
-                            setattr(self.args, fname2stage(s_).replace('-','_'), True)
-
-        for cs_, filter_ in complex_stages.items():
-            if vars(self.args)[cs_.replace('-','_')]:
-                for s_ in self.stages_names:
-                    if filter_(s_):
-                        setattr(self.args, fname2stage(s_).replace('-','_'), True)
-
-        if args.skip_words:
-            for word_ in args.skip_words.split(','):
-                for s_ in self.stages_names:
-                    if word_ in s_:
-                        setattr(self.args, fname2stage(s_).replace('-','_'), False)
-
+        if config is None:
+            config = self.parse_config()
+        # Stages and actions read options as «self.args».
+        self.config = self.args = args = config
 
-        specfile_  = expandpath(args.specfile)
+        specfile_  = expandpath(args.specfile, start=self.curdir)
+        self.specfile = specfile_
+        self.spec_vars = vars_
         self.root_dir = os.path.split(specfile_)[0]
-        os.environ['TERRA_SPECDIR'] = os.path.split(specfile_)[0]
-        self.spec, self.tvars = yaml_load(specfile_, vars_)
-        self.out_dir = 'out'
-        if "out_dir" in self.spec:
-            self.out_dir = self.spec.out_dir
-        self.output_dir = os.path.join(self.curdir, self.out_dir)
-        self.start_dir = os.getcwd()
+        # Not in os.environ: assemblers of several specs may live in one process.
+        # TA_PIPENV_DIR is set by ta-env.bat, commands run from TA itself (self.venv_python) need it too.
+        self.script_env = {'TERRA_SPECDIR': os.path.split(specfile_)[0], 'TA_PIPENV_DIR': self.pipenv_dir}
+        self.load_spec(use_cache=not args.no_spec_cache)
+        self.start_dir = self.curdir
 
         self.svace_mod = False
         self.svace_path = fr'app\svace\bin\svace.exe'
-        if Path(self.svace_path).exists():
+        if Path(self.project_path(self.svace_path)).exists():
             self.svace_mod = True
 
-        Path('reports').mkdir(exist_ok=True, parents=True)
+        Path(self.project_path('reports')).mkdir(exist_ok=True, parents=True)
         self.not_linked_python_packages_path = 'tmp/not-linked-python-packages-path.yml'
         self.pip_list_json = 'tmp/pip-list.json'
         self.snapshots_src_path = 'tmp\\snapshots-src'
         self.clean_checkouted_sources_path = 'tmp\\clean-checkouted-sources.zip'
         self.audit_archive_path = 'win-pack-for-audit.zip'
+        self.wheels_missing_lock_path = 'tmp/wheels-missing.lock'
+        self.simple_index_dir = 'tmp/simple'
+        self.stage_timings_path = 'tmp/stage-timings.json'
+        self.scripts_state_path = 'tmp/scripts-state.json'
+        self.output_pool_dir = 'tmp/outputs/pool'
+        self.stage_timings = {}
+        self.stage_plan = {}
         pass
 
-    def cmd(self, scmd):
+    @classmethod
+    def parse_config(cls, argv=None):
+        '''
+        TAConfig from command line (sys.argv[1:] by default).
+        '''
+        stages_ = {name_: getattr(cls, name_).__doc__.strip() for name_ in dir(cls) if name_.startswith('stage_')}
+        return parse_config(stages_, argv)
+
+    def load_spec(self, use_cache=True):
+        '''
+        (Re)load spec and attributes, derived from it.
+        '''
+        if use_cache:
+            self.spec, self.tvars = yaml_load_cached(self.specfile, self.spec_vars, self.project_path('tmp', 'spec-cache'))
+        else:
+            self.spec, self.tvars = yaml_load(self.specfile, self.spec_vars)
+        self.out_dir = 'out'
+        if "out_dir" in self.spec:
+            self.out_dir = self.spec.out_dir
+        self.output_dir = self.project_path(self.out_dir)
+        self.wheels_lock_path = self.spec.get('wheels_lockfile', os.path.splitext(self.specfile)[0] + '.lock')
+        self.wheel_store_dir = self.spec.get('wheelstore_dir', 'tmp/wheel-store')
+        pass
+
+    def project_path(self, *parts):
+        '''
+        Absolute path of file or dir of the project (relative paths are relative to curdir).
+        '''
+        return os.path.join(self.curdir, *parts)
+
+    def project_relpath(self, path, start=None):
         '''
-        Print command and perform it.
+        Path relative to curdir (or to other project path), as used in scripts.
+        '''
+        return os.path.relpath(self.project_path(path), start=self.project_path(start) if start else self.curdir)
+
+    def wheel_cache(self):
+        '''
+        Wheel metadata cache of the project, or the one shared by several specs in batch mode.
+        '''
+        if self.shared_wheel_cache is not None:
+            return self.shared_wheel_cache
+        from .wheelhouse import WheelMetadataCache, WHEEL_METADATA_CACHE
+        return WheelMetadataCache(self.project_path(WHEEL_METADATA_CACHE))
+
+    def cmd(self, scmd, cwd=None):
+        '''
+        Print command and perform it (in project dir, if cwd is not set).
         May be here we will can catch output and hunt for heizenbugs
         '''
         print(scmd)
-        return os.system(scmd)
+        return subprocess.call(scmd, shell=True, cwd=cwd or self.curdir, env={**os.environ, **self.script_env})
 
-    def lines2bat(self, name, lines, stage=None):
+    def self_command(self, options):
         '''
-        Записать в батник инструкции сборки,
-        и если соотвествующий этап активирован в опциях командной строки,
-        то и выполнить этот командный файл.
+        Command line to call TA itself with the same spec
+        (for stages performed in python).
+        Always single-spec entry point (not sys.argv[0]: it may be «tas-batch»
+        or other script), spec path is absolute, as scripts run in project dir.
         '''
-        import stat
-        os.chdir(self.curdir)
+        return f'''"{sys.executable}" -m terrarium_assembler_win.cli "{self.specfile}" {options}'''
 
-        fname = fname2shname(name)
+    def lines2bat(self, name, lines, stage=None, action=None, depends=None, inputs=None, outputs=None):
+        '''
+        Добавить в план сборки батник с инструкциями сборки.
+        Если соотвествующий этап активирован в опциях командной строки,
+        то он будет выполнен (батник или action — метод TA).
+        '''
         if stage:
             stage = fname2stage(stage)
 
-        if self.build_mode:
-            if stage:
-                option = stage.replace('-', '_')
-                dict_ = vars(self.args)
-                if option in dict_:
-                    if dict_[option]:
-                        print("*"*20)
-                        print("Executing ", fname)
-                        print("*"*20)
-                        res = self.cmd(fname)
-                        failmsg = f'{fname} execution failed!'
-                        if res != 0:
-                            print(failmsg)
-                        assert res==0, 'Execution of stage failed!'
-            return
+        step = PlanStep(name=name, script=fname2shname(name), stage=stage,
+                        lines=list(lines), action=action,
+                        depends=[fname2shname(d_) for d_ in depends or []],
+                        inputs=list(inputs or []), outputs=list(outputs or []))
+        # Stage is planned in thread (plan_stage), steps are merged in order of stages.
+        steps_ = getattr(self._planning, 'steps', None)
+        assert steps_ is not None, f'{name}: command files are made only by planning of stages'
+        steps_.append(step)
+        pass
 
+    def plan_stage(self, stage_):
+        '''
+        Call stage method, returns steps it planned.
+        '''
+        self._planning.steps = []
+        try:
+            stage_()
+            return self._planning.steps
+        finally:
+            self._planning.steps = None
 
-        with open(os.path.join(fname), 'w', encoding="utf-8") as lf:
-            lf.write(f"rem Generated {name} \n")
-            if stage:
-                desc = self.stages[stage]
-                stage_  = stage.replace('_', '-')
-                lf.write(f'''
+    def render_script(self, step):
+        '''
+        Text of the command file for the step of the plan.
+        '''
+        out_ = []
+        out_.append(f"rem Generated {step.name} \n")
+        if step.stage:
+            desc = self.stages[step.stage]
+            stage_  = step.stage.replace('_', '-')
+            out_.append(f'''
 rem Stage "{desc}"
 rem  Automatically called when {self.ta_name} --stage-{stage_} "{self.args.specfile}"
 ''')
-# for /f %%i in ('{self.spec.python_dir}\python -E -m pipenv --venv') do set TA_PIPENV_DIR=%%i
-            lf.write(fr'''
-set PIPENV_VENV_IN_PROJECT=1
-set TA_PROJECT_DIR=%~dp0
-set TA_PIPENV_DIR=%TA_PROJECT_DIR%\.venv
-''')
-
-            for k, v in self.tvars.items():
-                if type(v) in [type(''), type(1)]:
-                    lf.write(f'''set TA_{k}={v}\n''')
-
-            lf.write(f'''
-set PYTHONHOME=%TA_python_dir%
+        out_.append(f'''
+call "%~dp0{TA_ENV_SCRIPT}"
 ''')
-            for lines_ in lines:
-                for line_ in lines_.split('\n'):
-                    if line_:
-                        if "elevateme" in line_:
-                            lf.write(MAGIC_TO_SELF_ELEVATE)
-                        lf.write(f'''{line_}\n''')
-                        if line_.strip() and not line_.startswith('for ') and not line_.startswith('set '):
-                            lf.write(f'''if %errorlevel% neq 0 exit /b %errorlevel%\n\n''')
-
-            lf.write(f'''
-echo "OK with {name}"                     
+        for lines_ in step.lines:
+            for line_ in lines_.split('\n'):
+                if line_:
+                    if "elevateme" in line_:
+                        out_.append(MAGIC_TO_SELF_ELEVATE)
+                    out_.append(f'''{line_}\n''')
+                    if need_errorlevel_check(line_):
+                        out_.append(f'''if %errorlevel% neq 0 exit /b %errorlevel%\n\n''')
+
+        out_.append(f'''
+echo "OK with {step.name}"                     
 echo %TIME% %DATE% 
                      
 goto :EOF
@@ -251,10 +285,102 @@ goto :EOF
 echo Failed with error #%errorlevel%.
 exit /b %errorlevel%
 ''')
+        return ''.join(out_)
 
-        st = os.stat(fname)
-        os.chmod(fname, st.st_mode | stat.S_IEXEC)
+    def render_env_script(self):
+        '''
+        Shared environment of all command files, they call it once at start.
+        '''
+        out_ = []
+        out_.append(f"rem Generated environment of {self.ta_name} scripts\n")
+# for /f %%i in ('{self.spec.python_dir}\python -E -m pipenv --venv') do set TA_PIPENV_DIR=%%i
+        out_.append(fr'''
+set PIPENV_VENV_IN_PROJECT=1
+set TA_PROJECT_DIR=%~dp0
+set TA_PIPENV_DIR=%TA_PROJECT_DIR%\.venv
+''')
+        for k, v in self.plan.env.items():
+            out_.append(f'''set TA_{k}={v}\n''')
+
+        out_.append(f'''
+set PYTHONHOME=%TA_python_dir%
+''')
+        return ''.join(out_)
+
+    def write_scripts(self):
+        '''
+        Incremental writing of command files for all steps of the plan.
+        Content is rendered in memory; only changed scripts are written
+        (unchanged keep their mtimes), orphan scripts are removed.
+        Hashes of written content are kept in state file,
+        so unchanged scripts are recognized by stat only, without reading.
+        '''
+        import stat
+        import hashlib
+        scripts = [(TA_ENV_SCRIPT, self.render_env_script())]
+        scripts += [(step.script, self.render_script(step)) for step in self.plan.steps]
 
+        state_path = self.project_path(self.scripts_state_path)
+        state = {}
+        if os.path.exists(state_path):
+            try:
+                state = json.loads(Path(state_path).read_text(encoding='utf-8'))
+            except Exception as ex_:
+                print(f'Ignoring broken {state_path}: {ex_}')
+
+        new_state = {}
+        changed = []
+        for script_, text_ in scripts:
+            fname = self.project_path(script_)
+            sha_ = hashlib.sha256(text_.encode('utf-8')).hexdigest()
+            known_ = state.get(script_)
+            if known_ and known_[0] == sha_ and os.path.exists(fname):
+                st = os.stat(fname)
+                if [st.st_size, st.st_mtime_ns] == known_[1:]:
+                    new_state[script_] = known_
+                    continue
+            if write_if_changed(fname, text_):
+                changed.append(script_)
+                st = os.stat(fname)
+                os.chmod(fname, st.st_mode | stat.S_IEXEC)
+            st = os.stat(fname)
+            new_state[script_] = [sha_, st.st_size, st.st_mtime_ns]
+
+        removed = self.remove_orphan_scripts(keep=set(new_state))
+
+        if new_state != state:
+            Path(state_path).parent.mkdir(exist_ok=True, parents=True)
+            Path(state_path).write_text(json.dumps(new_state, indent=1, sort_keys=True), encoding='utf-8')
+
+        for script_ in changed:
+            print(f'  {"updated" if script_ in state else "created"}: {script_}')
+        for script_ in removed:
+            print(f'  removed: {script_}')
+        print(f'Command files: {len(scripts)}, changed: {len(changed)}, removed: {len(removed)}')
+        return changed, removed
+
+    def execute_plan(self):
+        '''
+        Perform steps of stages, activated in command line options.
+        '''
+        for step in self.plan.stage_steps():
+            option = step.stage.replace('-', '_')
+            if not self.config.stage_enabled(option):
+                continue
+            print("*"*20)
+            print("Executing ", step.action or step.script)
+            print("*"*20)
+            started_ = time.perf_counter()
+            if step.action:
+                getattr(self, step.action)()
+                res = 0
+            else:
+                res = self.cmd(step.script)
+            self.stage_timings[step.script] = time.perf_counter() - started_
+            failmsg = f'{step.script} execution failed!'
+            if res != 0:
+                print(failmsg)
+            assert res==0, 'Execution of stage failed!'
         pass
 
 
@@ -291,7 +417,7 @@ set snapshotdir={self.snapshots_src_path}\snapshot-src-before-%datestr%
 if exist {self.spec.src_dir} move {self.spec.src_dir} %snapshotdir%
 """)
 
-        in_src = os.path.relpath(self.spec.src_dir, start=self.curdir)
+        in_src = self.project_relpath(self.spec.src_dir)
         lines.append(f'if not exist {in_src} mkdir {in_src} ')
         already_checkouted = set()
 
@@ -300,7 +426,7 @@ if exist {self.spec.src_dir} move {self.spec.src_dir} %snapshotdir%
             if path_to_dir_ not in already_checkouted:
                 # probably_package_name = os.path.split(path_to_dir_)[-1]
                 already_checkouted.add(path_to_dir_)
-                path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
+                path_to_dir = self.project_relpath(path_to_dir_)
                 newpath = path_to_dir + '.new'
                 lines.append(f'rmdir /S /Q "{newpath}"')
                 
@@ -325,7 +451,7 @@ if exist "{newpath}\" (
 """)
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, outputs=[self.spec.src_dir, self.snapshots_src_path] + sorted(already_checkouted))
         pass
 
     def get_all_sources(self):
@@ -367,17 +493,18 @@ if exist "{newpath}\" (
         lines = []
         lines2 = []
         bfiles = []
-        in_src = os.path.relpath(self.spec.src_dir, start=self.curdir)
-        tmpdir = os.path.relpath(self.spec.builds_dir, start=self.curdir)
+        in_src = self.project_relpath(self.spec.src_dir)
+        tmpdir = self.project_relpath(self.spec.builds_dir)
 
-        # os.path.join(self.curdir, 'tmp', 'builds')
+        # self.project_path('tmp', 'builds')
 
         for git_url, td_ in self.spec.projects.items():
             lines = []
+            outputs = []
             git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
             projname_ = os.path.split(path_to_dir_)[-1]
             build_name = 'build-' + projname_.replace('_', '-')
-            path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
+            path_to_dir = self.project_relpath(path_to_dir_)
             if 'nuitkabuild' in td_:
                 nb_ = td_.nuitkabuild
                 srcname = nb_.input_py
@@ -407,10 +534,12 @@ if exist "{newpath}\" (
 
                 nuitka_flags = inherit_flags(nuitka_flags)
 
+                from .nuitkaflags import NuitkaFlags
                 nf_ = NuitkaFlags(**nuitka_flags)
-                nflags_ = nf_.get_flags(tmpdir, nuitka_flags)
+                nflags_ = nf_.get_flags(tmpdir, nuitka_flags, self.curdir, self.nuitka_package_dirs())
 
                 target_dir = os.path.join(tmpdir, outputname + '.dist')
+                outputs.append(os.path.join(tmpdir, defaultname + '.dist'))
 
                 src = os.path.join(path_to_dir, srcname)
                 flags_ = nflags_
@@ -473,8 +602,9 @@ editbin /largeaddressaware {tmpdir}\{defaultname}.dist\{outputname}.exe
                     folder_ = os.path.join(folder_, build.folder)
 
                 outdir_ = fr'{tmpdir}\{projname_}-jsbuild'
+                outputs.append(outdir_)
                 lines.append(fR"if not exist {outdir_} mkdir {outdir_}")
-                for file_ in os.listdir(folder_):
+                for file_ in os.listdir(self.project_path(folder_)):
                     if file_.endswith('.js'):
                         infile = os.path.join(folder_, file_)
                         outfile = os.path.join(outdir_, os.path.splitext(file_)[0] + '.exe')
@@ -492,6 +622,7 @@ C:\Windows\Microsoft.NET\Framework\v4.0.30319\jsc /out:{outfile}  {infile}
                     if 'projfile' in build:
                         projectfile_ = build.projfile
                     projectname_ = os.path.splitext(projectfile_)[0]
+                    outputs.append(fr"{tmpdir}\{projectname_}-vsbuild")
 
                     lines.append(R"""
 call "C:\Program Files (x86)\Microsoft Visual Studio\2019\BuildTools\Common7\Tools\VsDevCmd.bat"
@@ -516,7 +647,7 @@ if  exist {folder_}\packages.config nuget restore -PackagesDirectory {folder_}\.
                     if isinstance(build.platforms, list):
                         for platform_ in build.platforms:
                             odir_ = fr"{tmpdir}\{projectname_}-vsbuild\{platform_}"
-                            rodir_ = os.path.relpath(odir_, start=folder_)
+                            rodir_ = self.project_relpath(odir_, folder_)
 
                             if self.svace_mod:
                                 lines.append(fR"""
@@ -530,7 +661,7 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
                     else:
                         platform_ = build.platforms
                         odir_ = fr"{tmpdir}\{projectname_}-vsbuild\{platform_}"
-                        rodir_ = os.path.relpath(odir_, start=folder_)
+                        rodir_ = self.project_relpath(odir_, folder_)
                         if self.svace_mod:
                             lines.append(fR"""
 msbuild  {msbuild_flags} /t:Clean /p:Configuration="{build.configuration}" /p:Platform="{platform_}" {folder_}\{projectfile_}
@@ -542,7 +673,7 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
     """)
 
             if lines:
-                self.lines2bat(build_name, lines, None)
+                self.lines2bat(build_name, lines, None, inputs=[path_to_dir_], outputs=outputs)
                 bfiles.append(build_name)
             pass
 
@@ -553,7 +684,7 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
             lines.append(f'''if %errorlevel% neq 0 exit /b %errorlevel%\n\n''')
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, depends=bfiles)
         pass
 
 
@@ -567,9 +698,11 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
         packages = []
         lines = []
 
-        in_bin = os.path.relpath(self.spec.bin_dir, start=self.curdir)
+        in_bin = self.project_relpath(self.spec.bin_dir)
+        outputs = []
 
         def download_to(url_, to_, force_dir=False):
+            outputs.append(to_)
             dir2download = to_
             scmd = f'wget --no-check-certificate -P {dir2download} -c "{url_}" '
             if os.path.splitext(to_) and not force_dir:
@@ -605,7 +738,7 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
                     lines.append(scmd)
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, outputs=outputs)
         pass
 
 
@@ -618,13 +751,15 @@ msbuild  {msbuild_flags} /p:OutDir="%TA_PROJECT_DIR%{odir_}" /p:Configuration="{
         packages = []
         lines = []
 
-        Path('ta-if-symlink.ps1').write_text(r'''Get-Item $Env:TA_PROJECT_DIR | Select-Object | foreach {if($_.Target){$_.Target.replace('UNC\', '\\')+'\'}}''')
+        Path(self.project_path('ta-if-symlink.ps1')).write_text(r'''Get-Item $Env:TA_PROJECT_DIR | Select-Object | foreach {if($_.Target){$_.Target.replace('UNC\', '\\')+'\'}}''')
         lines.append(r'''
 rem elevateme
 cd %TA_PROJECT_DIR%                     
 for /f %%i in ('powershell -executionpolicy bypass -File %TA_PROJECT_DIR%\ta-if-symlink.ps1') do set "TA_SYMLINK_PREFIX=%%i"''')
 
-        in_bin = os.path.relpath(self.spec.bin_dir, start=self.curdir)
+        in_bin = self.project_relpath(self.spec.bin_dir)
+        inputs = []
+        outputs = []
 
         for name_, it_ in self.spec.download_and_install.items():
             if isinstance(it_, dict):
@@ -637,20 +772,24 @@ for /f %%i in ('powershell -executionpolicy bypass -File %TA_PROJECT_DIR%\ta-if-
 
                 if not artefact:
                     continue
+                inputs.append(artefact)
 
                 if 'unzip' in it_:
                     to_ = it_.unzip
+                    outputs.append(to_)
                     scmd = f'''powershell -command "Expand-Archive -Force '{artefact}'  '{to_}'" '''
                     #scmd = f'''tar -xf "{artefact}" --directory "{to_}" '''
                     lines.append(scmd)
 
                 if 'unzip7' in it_:
                     to_ = it_.unzip7
+                    outputs.append(to_)
                     scmd = f'7z -y x {artefact} -o{to_}'
                     lines.append(scmd)
 
                 if 'target' in it_:
                     to_ = it_.target
+                    outputs.append(to_)
                     scmds = f'''
 msiexec.exe /I %TA_SYMLINK_PREFIX%{artefact} /QB-! INSTALLDIR="{to_}" TargetDir="{to_}"
 set PATH={to_};%PATH%'''.split('\n')
@@ -665,7 +804,7 @@ set PATH={to_};%PATH%'''.split('\n')
                         lines.append(fix_win_command(scmd))
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, inputs=inputs, outputs=outputs)
         pass
 
 
@@ -675,7 +814,7 @@ set PATH={to_};%PATH%'''.split('\n')
         '''
         root_dir = self.root_dir
         
-        with open(INSTALL_ALL_WHEELS_SCRIPT, "w", encoding='utf-8') as lf:
+        with open(self.project_path(INSTALL_ALL_WHEELS_SCRIPT), "w", encoding='utf-8') as lf:
             lf.write(r"""
 import sys
 import os
@@ -713,11 +852,12 @@ del /Q Pipfile | VER>NUL
 rmdir /Q /S .venv | VER>NUL
 set PIPENV_PIPFILE=
 {python_dir}\python -E -m pipenv --python {self.spec.python_dir}\python.exe
-{python_dir}\python -E -m pipenv run python {INSTALL_ALL_WHEELS_SCRIPT} {self.spec.basewheel_dir} '
+{self.venv_python} {INSTALL_ALL_WHEELS_SCRIPT} {self.spec.basewheel_dir}
         ''')
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_,
+                       inputs=[INSTALL_ALL_WHEELS_SCRIPT, self.spec.basewheel_dir], outputs=['.venv'])
         pass
 
     def stage_51_make_iso(self):
@@ -726,6 +866,7 @@ set PIPENV_PIPFILE=
         '''
 
         lines_all = []        
+        depends = []
         for output_key, output_ in self.spec.outputs.items():
             build_output_name = f'generate-iso-for-{output_key}'
             
@@ -756,17 +897,17 @@ set pmm=%lastiso:~5,2%
 set pdd=%lastiso:~8,2%
 echo "%pyyyy%-%pmm%-%pdd%"
 {changelog_mode}
-.venv\Scripts\python .venv\Scripts\pycdlib-genisoimage -U -iso-level 4 -R -o {output_key}/%isofilename% {output_key}/iso
-@echo ;MD5: >> {output_key}/%changelogfilename%
-md5sums {output_key}/%isofilename% >> {output_key}/%changelogfilename%
+{self.self_command(f'--make-iso "{output_key}" --iso-name "%isofilename%"')}
 del /Q {output_key}\last.iso | VER>NUL
 cmd /c "mklink /H {output_key}\last.iso {output_key}\%isofilename%"
 """
-            self.lines2bat(build_output_name, [scmd])
+            self.lines2bat(build_output_name, [scmd], inputs=[self.output_folder(output_key)],
+                           outputs=[os.path.dirname(self.output_folder(output_key))])
             lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines_all, mn_)
+        self.lines2bat(mn_, lines_all, mn_, depends=depends)
         pass
 
 
@@ -776,6 +917,7 @@ cmd /c "mklink /H {output_key}\last.iso {output_key}\%isofilename%"
         '''
 
         lines_all = []        
+        depends = []
         for output_key, output_ in self.spec.outputs.items():
             build_output_name = f'generate-msi-for-{output_key}'
             
@@ -810,9 +952,9 @@ cmd /c "mklink /H {output_key}\last.iso {output_key}\%isofilename%"
 """.strip()   
             wxs_dir = fr'tmp\msi\{output_key}'
             # Потом переписать куда-нибудь наверно не в тмп.
-            Path(wxs_dir).mkdir(exist_ok=True, parents=True)
+            Path(self.project_path(wxs_dir)).mkdir(exist_ok=True, parents=True)
             wxs_filename = fr'{wxs_dir}\{output_key}.wxs'
-            Path(wxs_filename).write_text(wxs_file)
+            Path(self.project_path(wxs_filename)).write_text(wxs_file)
 
             python_dir = self.spec.python_dir.replace("/", "\\")
             scmd = fR"""
@@ -839,19 +981,80 @@ set pdd=%lastiso:~8,2%
 echo "%pyyyy%-%pmm%-%pdd%"
 set TA_DISTR_ISO=%TA_PROJECT_DIR%\{output_key}\iso
 
-C:\ta-buildroot\wixtoolset\heat.exe dir %TA_DISTR_ISO% -cg CMPG_AllOfTheFiles -ke -dr TARGETDIR -gg -sfrag -srd -o {wxs_dir}\iso-{output_key}.wxs -var env.TA_DISTR_ISO
+{self.self_command(f'--wix-fragments "{output_key}"')}
 pushd {wxs_dir}
-C:\ta-buildroot\wixtoolset\candle.exe -cultures:ru-RU  iso-{output_key}.wxs {output_key}.wxs
+for %%f in (fragments\*.wxs) do if not exist fragments\%%~nf.wixobj C:\ta-buildroot\wixtoolset\candle.exe -cultures:ru-RU -out fragments\ %%f
+C:\ta-buildroot\wixtoolset\candle.exe -cultures:ru-RU  {output_key}.wxs
 popd
-C:\ta-buildroot\wixtoolset\light.exe -cultures:ru-RU {wxs_dir}\iso-{output_key}.wixobj {wxs_dir}\{output_key}.wixobj -o {output_key}/%isofilename%
+C:\ta-buildroot\wixtoolset\light.exe -cultures:ru-RU {wxs_dir}\fragments\*.wixobj {wxs_dir}\{output_key}.wixobj -o {output_key}/%isofilename%
 del /Q {output_key}\last.msi | VER>NUL
 cmd /c "mklink /H {output_key}\last.msi {output_key}\%isofilename%"
 """
-            self.lines2bat(build_output_name, [scmd])
+            self.lines2bat(build_output_name, [scmd], inputs=[self.output_folder(output_key), wxs_filename],
+                           outputs=[wxs_dir, os.path.dirname(self.output_folder(output_key))])
+            lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
+
+        mn_ = get_method_name()
+        self.lines2bat(mn_, lines_all, mn_, depends=depends)
+        pass
+
+
+    def stage_53_delta_package(self):
+        '''
+        Make delta update packages from previous releases
+        '''
+        lines_all = []
+        depends = []
+        for output_key, output_ in self.spec.outputs.items():
+            build_output_name = f'generate-delta-for-{output_key}'
+            lines = [self.self_command(f'--make-delta "{output_key}"')]
+            releases_dir = os.path.dirname(self.output_folder(output_key))
+            self.lines2bat(build_output_name, lines, inputs=[releases_dir], outputs=[releases_dir])
+            lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
+
+        mn_ = get_method_name()
+        self.lines2bat(mn_, lines_all, mn_, depends=depends)
+        pass
+
+
+    def stage_54_make_archive(self):
+        '''
+        Make compressed portable archives
+        '''
+        lines_all = []
+        depends = []
+        for output_key, output_ in self.spec.outputs.items():
+            build_output_name = f'generate-archive-for-{output_key}'
+            lines = [self.self_command(f'--make-archive "{output_key}"')]
+            self.lines2bat(build_output_name, lines, inputs=[self.output_folder(output_key)],
+                           outputs=[os.path.dirname(self.output_folder(output_key))])
             lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines_all, mn_)
+        self.lines2bat(mn_, lines_all, mn_, depends=depends)
+        pass
+
+
+    def stage_55_store_releases(self):
+        '''
+        Put releases to deduplicated release store, evict old ones
+        '''
+        lines_all = []
+        depends = []
+        for output_key, output_ in self.spec.outputs.items():
+            build_output_name = f'store-releases-for-{output_key}'
+            lines = [self.self_command(f'--store-releases "{output_key}"')]
+            releases_dir = os.path.dirname(self.output_folder(output_key))
+            self.lines2bat(build_output_name, lines, inputs=[releases_dir],
+                           outputs=[releases_dir, self.spec.get('release_store', 'releases')])
+            lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
+
+        mn_ = get_method_name()
+        self.lines2bat(mn_, lines_all, mn_, depends=depends)
         pass
 
 
@@ -859,15 +1062,14 @@ cmd /c "mklink /H {output_key}\last.msi {output_key}\%isofilename%"
         '''
         Download base wheel python packages
         '''
-        os.chdir(self.curdir)
-
         args = self.args
 
         lines = []
-        wheel_dir = self.spec.basewheel_dir.replace("/", "\\")
+        # Download to staging dir, «--store-wheels» will update wheel_dir from it.
+        wheel_dir = self.spec.basewheel_dir.replace("/", "\\") + '.new'
         lines.append(fr'''
+rmdir /S /Q "{wheel_dir}" | VER>NUL
 if not exist "{wheel_dir}" mkdir "{wheel_dir}"
-del /q {wheel_dir}\* | VER>NUL
 set CONAN_USER_HOME=%~dp0{self.spec.libscon_dir}
 set CONANROOT=%CONAN_USER_HOME%\.conan\data
 ''')
@@ -877,25 +1079,28 @@ set CONANROOT=%CONAN_USER_HOME%\.conan\data
             if '==' in pp:
                 paths_.append(pp)
 
-        os.chdir(self.curdir)
         setup_paths = " ".join(paths_)
 
-        scmd = fr"{self.spec.python_dir}\python -m pip download {setup_paths} --dest {wheel_dir} "
-        lines.append(fix_win_command(scmd))
+        lines.append(self.self_command('--update-wheel-index'))
+        scmd = fr"{self.spec.python_dir}\python -m pip download {setup_paths} --dest {wheel_dir}"
+        lines.append(self.pip_local_first(fix_win_command(scmd)))
 
         if 'remove_python_packages_from_download' in self.spec:
             for package_ in self.spec.remove_python_packages_from_download:
                 scmd = fr'''del /Q {wheel_dir}\{package_}-*  | VER>NUL '''        
                 lines.append(scmd)                
 
+        scmd = fr"{self.spec.python_dir}\python.exe  -E  -m pip wheel --no-deps %%D -w {wheel_dir}"
         scmd = fr"""
-for %%D in ({wheel_dir}\*.tar.*) do {self.spec.python_dir}\python.exe  -E  -m pipenv run pip wheel --no-deps %%D -w {wheel_dir}
+for %%D in ({wheel_dir}\*.tar.*) do ({self.pip_local_first(scmd)})
 del /Q {wheel_dir}\*.tar.* | VER>NUL
 """
         lines.append(scmd)
+        lines.append(self.self_command('--store-wheels'))
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, inputs=[self.simple_index_dir],
+                       outputs=[self.spec.basewheel_dir, self.wheel_store_dir])
         pass
 
 
@@ -903,21 +1108,24 @@ del /Q {wheel_dir}\*.tar.* | VER>NUL
         '''
         Download needed WHL-python packages
         '''
-        os.chdir(self.curdir)
-
         root_dir = self.root_dir
         args = self.args
 
         lines = []
         wheel_dir = self.spec.depswheel_dir.replace("/", "\\")
         ourwheel_dir = self.spec.ourwheel_dir.replace("/", "\\")
+
+        # Download to staging dir, «--store-wheels» will update wheel_dir from it.
+        stage_dir = wheel_dir + '.new'
         lines.append(fr'''
-del /q {wheel_dir}\* | VER>NUL
+rmdir /S /Q "{stage_dir}" | VER>NUL
+mkdir "{stage_dir}"
 set CONAN_USER_HOME=%~dp0{self.spec.libscon_dir}
 set CONANROOT=%CONAN_USER_HOME%\.conan\data
 ''')
 
         paths_ = []
+        reqs_files = []
         for pp in self.spec.python_packages:
             paths_.append(pp)
 
@@ -930,12 +1138,10 @@ set CONANROOT=%CONAN_USER_HOME%\.conan\data
 
             path_ = setup_path = path_to_dir_
 
-            os.chdir(self.curdir)
-            if os.path.exists(setup_path):
-                os.chdir(setup_path)
+            if os.path.exists(self.project_path(setup_path)):
                 is_python_package = False
                 for file_ in ['setup.py', 'pyproject.toml']:
-                    if os.path.exists(file_):
+                    if os.path.exists(self.project_path(setup_path, file_)):
                         is_python_package = True
                         break
 
@@ -943,47 +1149,247 @@ set CONANROOT=%CONAN_USER_HOME%\.conan\data
                     paths_.append(path_)
 
                 for file_ in ['requirements.txt']:
-                    if os.path.exists(file_):
+                    if os.path.exists(self.project_path(setup_path, file_)):
                         paths_.append(fr' -r {setup_path}\{file_}')
+                        reqs_files.append(os.path.join(setup_path, file_))
                         break
             ...            
 
-        os.chdir(self.curdir)
         setup_paths = " ".join(paths_)
 
         need_pips_str = " ".join(self.need_pips)
 
-        scmd = fr"{self.spec.python_dir}\python -E -m pipenv run pip download {need_pips_str} {setup_paths} --dest {wheel_dir} --find-links {ourwheel_dir} "
-        lines.append(fix_win_command(scmd))
+        lines.append(self.self_command('--update-wheel-index'))
+        # Missing in local index — full resolution online, our wheels are only local.
+        scmd = fr"{self.venv_python} -m pip download {need_pips_str} {setup_paths} --dest {stage_dir}"
+        lines.append(self.pip_local_first(fix_win_command(scmd), f'--extra-index-url {self.simple_index_url()}'))
 
         if 'remove_python_packages_from_download' in self.spec:
             for package_ in self.spec.remove_python_packages_from_download:
-                scmd = fr'''del /Q {wheel_dir}\{package_}-*  | VER>NUL '''        
+                scmd = fr'''del /Q {stage_dir}\{package_}-*  | VER>NUL '''        
                 lines.append(scmd)                
 
+        scmd = fr"{self.venv_python} -m pip wheel --no-deps %%D -w {stage_dir}"
         scmd = fr"""
-for %%D in ({wheel_dir}\*.tar.*) do {self.spec.python_dir}\python.exe  -E  -m pipenv run pip wheel --no-deps %%D -w {wheel_dir}
-del {wheel_dir}\*.tar.*
+for %%D in ({stage_dir}\*.tar.*) do ({self.pip_local_first(scmd)})
+del {stage_dir}\*.tar.*
 """
         lines.append(scmd)
+        lines.append(self.self_command('--store-wheels'))
+        lines.append(self.self_command('--lock-wheels'))
+        self.lines2bat(RESOLVE_WHEELS_SCRIPT, lines, inputs=[self.simple_index_dir] + reqs_files,
+                       outputs=[self.spec.depswheel_dir, self.wheel_store_dir, self.wheels_lock_path])
 
+        # Lockfile is checked when the stage runs: wheels of stage_08 may be rebuilt after generation.
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, [self.self_command('--fetch-locked-wheels')], mn_, depends=[RESOLVE_WHEELS_SCRIPT],
+                       inputs=[self.wheels_lock_path] + self.lock_wheel_dirs(),
+                       outputs=[self.spec.depswheel_dir, self.wheel_store_dir])
+        pass
+
+
+    def lock_wheel_dirs(self):
+        '''
+        Wheel directories for offline resolution, in priority order.
+        '''
+        dirs_ = [self.spec.ourwheel_dir, self.spec.extwheel_dir, self.spec.depswheel_dir]
+        if 'wheelcache_dir' in self.spec:
+            dirs_.append(self.spec.wheelcache_dir)
+        return dirs_
+
+    def wheel_lock_inputs(self):
+        '''
+        All requirements, that «stage_09_download_wheels» gives to pip download,
+        and digest of them.
+        Returns None, if something cannot be resolved offline.
+        '''
+        from .wheellock import read_requirements_file, inputs_digest, ResolutionError
+
+        reqs = list(self.spec.python_packages) + list(self.need_pips)
+        try:
+            for git_url, td_ in self.spec.projects.items():
+                if 'pybuild' not in td_:
+                    continue
+                git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
+                reqs_path = self.project_path(path_to_dir_, 'requirements.txt')
+                if os.path.exists(reqs_path):
+                    reqs += read_requirements_file(reqs_path)
+        except ResolutionError as ex_:
+            print(ex_)
+            return None
+
+        # Our python projects come as wheels, built on stage_08.
+        cache = self.wheel_cache()
+        our_dir = self.project_path(self.spec.ourwheel_dir)
+        if os.path.isdir(our_dir):
+            for file_ in sorted(os.listdir(our_dir)):
+                if file_.endswith('.whl'):
+                    meta_ = cache.get(os.path.join(our_dir, file_))
+                    reqs.append(f"{meta_['name']}=={meta_['version']}")
+        cache.save()
+
+        extra_ = {
+            'remove': ','.join(self.spec.get('remove_python_packages_from_download', None) or []),
+            'python_version': self.spec.get('python_version', ''),
+        }
+        return reqs, inputs_digest(reqs, extra_)
+
+    def lock_wheels(self):
+        '''
+        Resolve python requirements offline and write lockfile.
+        If resolution is impossible, just drop stale lockfile.
+        '''
+        from .wheellock import collect_catalog, resolve, write_lockfile, ResolutionError
+        from packaging.utils import canonicalize_name
+
+        inputs_ = self.wheel_lock_inputs()
+        try:
+            if inputs_ is None:
+                raise ResolutionError('Requirements cannot be resolved offline')
+            reqs, digest = inputs_
+            catalog = collect_catalog([self.project_path(d_) for d_ in self.lock_wheel_dirs()],
+                                      self.wheel_cache())
+            env_overrides = None
+            if 'python_version' in self.spec:
+                env_overrides = {'python_version': str(self.spec.python_version)}
+            chosen = resolve(reqs, catalog, env_overrides=env_overrides,
+                             ignore=self.spec.get('remove_python_packages_from_download', None))
+        except ResolutionError as ex_:
+            print(ex_)
+            print(f'Lockfile {self.wheels_lock_path} is not updated')
+            if os.path.exists(self.project_path(self.wheels_lock_path)):
+                os.unlink(self.project_path(self.wheels_lock_path))
+            return
+
+        our_names = set(name_ for name_, metas_ in catalog.items()
+                            if any(m_['priority'] == 0 for m_ in metas_))
+        write_lockfile(self.project_path(self.wheels_lock_path), chosen, digest, our_names)
+        print(f'Lockfile {self.wheels_lock_path} written: {len(chosen)} packages')
+        pass
+
+    def locked_wheels(self):
+        '''
+        Pins of lockfile, located in wheel dirs: ({sha256: metadata}, [missing (name, version, sha256)]).
+        Returns None if lockfile is absent or stale.
+        '''
+        from .wheellock import read_lockfile, collect_catalog, locate_pins
+
+        digest, pins = read_lockfile(self.project_path(self.wheels_lock_path))
+        if not digest:
+            return None
+        inputs_ = self.wheel_lock_inputs()
+        if not inputs_ or inputs_[1] != digest:
+            print(f'Lockfile {self.wheels_lock_path} is stale')
+            return None
+
+        catalog = collect_catalog([self.project_path(d_) for d_ in self.lock_wheel_dirs()],
+                                  self.wheel_cache())
+        return locate_pins(pins, catalog)
+
+    def fetch_locked_wheels(self):
+        '''
+        Action of stage_09 for «--fetch-locked-wheels»: if lockfile is up to date,
+        download only missing pinned wheels, without resolution and index traffic for the rest,
+        else do full resolution (script RESOLVE_WHEELS_SCRIPT).
+        Decided when the stage runs, not when scripts are generated.
+
+        With lockfile, depswheel_dir becomes exactly pinned wheels, not in our/ext dirs
+        (stage_15 installs whole dirs): stale wheels of previous resolutions are dropped,
+        pinned ones from other dirs (wheel cache) are added.
+        '''
+        from .wheelstore import link_or_copy
+
+        located = self.locked_wheels()
+        if located is None:
+            script_ = self.project_path(fname2shname(RESOLVE_WHEELS_SCRIPT))
+            rc_ = self.cmd(f'"{script_}"')
+            assert rc_ == 0, f'Resolution of wheels failed ({rc_})'
+            return
+        found, missing = located
+
+        # Staging dir, «store_wheels» will update wheel_dir from it.
+        wheel_dir = self.spec.depswheel_dir.replace("/", "\\") + '.new'
+        stage_dir = self.project_path(self.spec.depswheel_dir) + '.new'
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        mkdir_p(stage_dir)
+        installed_dirs = set(os.path.normcase(os.path.abspath(self.project_path(d_)))
+                             for d_ in [self.spec.ourwheel_dir, self.spec.extwheel_dir])
+        for meta_ in found.values():
+            if os.path.normcase(os.path.dirname(os.path.abspath(meta_['path']))) not in installed_dirs:
+                link_or_copy(meta_['path'], os.path.join(stage_dir, os.path.basename(meta_['path'])))
+
+        if missing:
+            mlines_ = []
+            for name_, version_, sha_ in missing:
+                mlines_.append(f'{name_}=={version_} --hash=sha256:{sha_}')
+            Path(self.project_path(self.wheels_missing_lock_path)).parent.mkdir(exist_ok=True, parents=True)
+            Path(self.project_path(self.wheels_missing_lock_path)).write_text('\n'.join(mlines_) + '\n')
+            # Pins are missing locally by definition, so only online index can have them.
+            scmd = fr"{self.venv_python} -m pip download --no-deps --require-hashes -r {self.wheels_missing_lock_path} --dest {wheel_dir} "
+            rc_ = self.cmd(fix_win_command(scmd))
+            assert rc_ == 0, f'Download of {len(missing)} locked wheels failed ({rc_})'
+        else:
+            print(f'All wheels from {self.wheels_lock_path} are present')
+        self.store_wheels()
         pass
 
+    def index_wheel_dirs(self):
+        return [self.spec.ourwheel_dir, self.spec.extwheel_dir, self.spec.depswheel_dir, self.spec.basewheel_dir]
+
+    def simple_index_url(self):
+        from .simpleindex import index_url
+        return index_url(self.project_path(self.simple_index_dir))
+
+    def pip_local_first(self, scmd, online_options=''):
+        '''
+        pip command (download/wheel) with local wheel index only,
+        and only if it cannot be satisfied locally — the same with online index.
+        '''
+        local_ = f'{scmd} --index-url {self.simple_index_url()}'
+        online_ = f'{scmd} {online_options}'.rstrip()
+        return f'{local_} || {online_}'
+
+    def store_wheels(self):
+        '''
+        Put all wheels into content-addressed store.
+        Wheel dir with staging «.new» dir is updated from it, touching only changed files.
+        '''
+        from .wheelstore import WheelStore
+        store = WheelStore(self.project_path(self.wheel_store_dir), self.wheel_cache())
+        for dir_ in self.index_wheel_dirs():
+            role_dir = self.project_path(dir_)
+            staging_dir = role_dir + '.new'
+            if os.path.isdir(staging_dir):
+                store.refresh(role_dir, staging_dir)
+            else:
+                store.absorb(role_dir)
+        store.gc()
+        store.cache.save()
+        print(f'Wheel store {self.wheel_store_dir}: {store.stats}')
+        pass
+
+    def update_wheel_index(self):
+        '''
+        Refresh local PEP 503 index over all wheel directories.
+        '''
+        from .simpleindex import update_simple_index
+        changed = update_simple_index(self.project_path(self.simple_index_dir),
+                                      [self.project_path(d_) for d_ in self.index_wheel_dirs()],
+                                      self.wheel_cache())
+        print(f'Wheel index {self.simple_index_dir}: {len(changed)} project pages updated')
+        pass
 
     def stage_07_audit_extra_build_conanlibs(self):
         '''
         Compile conan libraries
         '''
-        os.chdir(self.curdir)
         lines = []
 
         python_dir = self.spec.python_dir.replace("/", "\\")
         wheel_dir = self.spec.ourwheel_dir.replace("/", "\\")
         wheelpath = wheel_dir
 
-        relwheelpath = os.path.relpath(wheelpath, start=self.curdir)
+        relwheelpath = self.project_relpath(wheelpath)
         lines.append(fr"""
 set PIPENV_PIPFILE=%~dp0Pipfile
 set CONAN_USER_HOME=%~dp0{self.spec.libscon_dir}
@@ -993,14 +1399,16 @@ set PATH=%PYTHONHOME%;%PYTHONHOME%\scripts;C:\Program Files\CMake\bin;%PATH%;
 call "C:\Program Files (x86)\Microsoft Visual Studio\2019\BuildTools\Common7\Tools\VsDevCmd.bat"
 conan remove  --locks
 """)
+        inputs = []
         for git_url, td_ in self.spec.projects.items():
             if 'conanbuild' not in td_:
                 continue
 
             git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
             probably_package_name = os.path.split(path_to_dir_)[-1]
-            path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
-            relwheelpath = os.path.relpath(wheelpath, start=path_to_dir_)
+            path_to_dir = self.project_relpath(path_to_dir_)
+            inputs.append(path_to_dir_)
+            relwheelpath = self.project_relpath(wheelpath, path_to_dir_)
 
             setup_path = path_to_dir
             scmd = fr'echo "** Building lib for {setup_path} **"'
@@ -1009,14 +1417,14 @@ conan remove  --locks
             setup_path = path_to_dir
             scmd = "pushd %s" % (path_to_dir)
             lines.append(scmd)
-            relwheelpath = os.path.relpath(wheelpath, start=path_to_dir)
+            relwheelpath = self.project_relpath(wheelpath, path_to_dir)
             scmd = fr"conan create . stable/dm -pr:b profile_build -pr:h profile_host -b missing"
             lines.append(fix_win_command(scmd))
             lines.append('popd')
             pass
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, inputs=inputs, outputs=[self.spec.libscon_dir])
         pass
 
 
@@ -1024,14 +1432,13 @@ conan remove  --locks
         '''
         Сompile wheels for our python sources
         '''
-        os.chdir(self.curdir)
         lines = []
 
         python_dir = self.spec.python_dir.replace("/", "\\")
         wheel_dir = self.spec.ourwheel_dir.replace("/", "\\")
         wheelpath = wheel_dir
 
-        relwheelpath = os.path.relpath(wheelpath, start=self.curdir)
+        relwheelpath = self.project_relpath(wheelpath)
         lines.append(fr"""
 set PIPENV_PIPFILE=%~dp0Pipfile
 set CONAN_USER_HOME=%~dp0{self.spec.libscon_dir}
@@ -1039,6 +1446,7 @@ set CONANROOT=%CONAN_USER_HOME%\.conan\data
 call "C:\Program Files (x86)\Microsoft Visual Studio\2019\BuildTools\Common7\Tools\VsDevCmd.bat"
 rmdir /S /Q  {relwheelpath}
 """)
+        inputs = []
         for git_url, td_ in self.spec.projects.items():
             if 'pybuild' not in td_:
                 continue
@@ -1048,33 +1456,76 @@ rmdir /S /Q  {relwheelpath}
 
             git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
             probably_package_name = os.path.split(path_to_dir_)[-1]
-            path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
-            relwheelpath = os.path.relpath(wheelpath, start=path_to_dir_)
+            path_to_dir = self.project_relpath(path_to_dir_)
+            relwheelpath = self.project_relpath(wheelpath, path_to_dir_)
 
             setup_path = path_to_dir
             scmd = fr'echo "** Building wheel for {setup_path} **"'
             lines.append(scmd)
 
             setup_path = path_to_dir
-            path_ = os.path.relpath(setup_path, start=self.curdir)
-            if os.path.exists(setup_path):
+            path_ = self.project_relpath(setup_path)
+            if os.path.exists(self.project_path(setup_path)):
+                inputs.append(path_to_dir_)
                 scmd = "pushd %s" % (path_to_dir)
                 lines.append(scmd)
-                relwheelpath = os.path.relpath(wheelpath, start=path_to_dir)
-                scmd = fr"{python_dir}\python -E -m pipenv run python setup.py bdist_wheel -d {relwheelpath}"
+                relwheelpath = self.project_relpath(wheelpath, path_to_dir)
+                scmd = fr"{self.venv_python} setup.py bdist_wheel -d {relwheelpath}"
                 lines.append(fix_win_command(scmd))
                 lines.append('popd')
             pass
+        lines.append(self.self_command('--store-wheels'))
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_, inputs=inputs, outputs=[self.spec.ourwheel_dir, self.wheel_store_dir])
+        pass
+
+    def stage_14_check_wheels(self):
+        '''
+        Offline check of dependency closure for selected wheels
+        '''
+        mn_ = get_method_name()
+        self.lines2bat(mn_, [self.self_command('--stage-check-wheels')], mn_,
+                       action='check_wheels',
+                       inputs=self.index_wheel_dirs())
+        pass
+
+    def target_python_version(self):
+        '''
+        Python version of distribution: «python_version» of spec,
+        else version of venv python (if venv is already created), else None.
+        '''
+        if 'python_version' in self.spec:
+            return str(self.spec.python_version)
+        venv_python = os.path.join(self.pipenv_dir, 'Scripts', 'python.exe')
+        if os.path.exists(venv_python):
+            try:
+                return subprocess.check_output([venv_python, '-c', 'import platform; print(platform.python_version())'],
+                                               cwd=self.curdir).decode('utf-8').strip()
+            except (OSError, subprocess.CalledProcessError) as ex_:
+                print(f'Cannot get version of {venv_python}: {ex_}')
+        return None
+
+    def check_wheels(self):
+        '''
+        Check dependency closure of wheels to install (action of stage_14).
+        '''
+        from .wheelhouse import check_closure, print_closure_report
+        env_overrides = None
+        python_version = self.target_python_version()
+        if python_version:
+            env_overrides = {'python_version': python_version}
+
+        missing, conflicts, unchecked = check_closure([self.project_path(w_) for w_ in self.get_wheel_list_to_install()],
+                                                      cache=self.wheel_cache(),
+                                                      env_overrides=env_overrides)
+        print_closure_report(missing, conflicts, unchecked)
+        assert not missing and not conflicts, 'Wheel dependency closure is broken!'
         pass
 
     def stage_15_install_wheels(self):
         '''
         Install our and external Python wheels
         '''
-        os.chdir(self.curdir)
-
         lines = []
 
         lines.append(fr'''
@@ -1084,10 +1535,10 @@ rmdir /Q /S .venv | VER>NUL
 {self.spec.python_dir}\python -E -m pipenv --python {self.spec.python_dir}\python.exe
         ''')
 
-        scmd = fr'{self.spec.python_dir}/python -m pipenv run python {INSTALL_ALL_WHEELS_SCRIPT} {self.spec.extwheel_dir} {self.spec.depswheel_dir} {self.spec.ourwheel_dir} '
+        scmd = fr'{self.venv_python} {INSTALL_ALL_WHEELS_SCRIPT} {self.spec.extwheel_dir} {self.spec.depswheel_dir} {self.spec.ourwheel_dir} '
         lines.append(fix_win_command(scmd))
 
-        scmd = fr'{self.spec.python_dir}/python -m pipenv run pip list --format json > {self.pip_list_json}'
+        scmd = fr'{self.venv_python} -m pip list --format json > {self.pip_list_json}'
         lines.append(fix_win_command(scmd))
 
         if 'pipenv_shell_commands' in self.spec:
@@ -1095,7 +1546,9 @@ rmdir /Q /S .venv | VER>NUL
                 lines.append(fix_win_command(scmd))
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines, mn_)
+        self.lines2bat(mn_, lines, mn_,
+                       inputs=[INSTALL_ALL_WHEELS_SCRIPT, self.spec.extwheel_dir, self.spec.depswheel_dir, self.spec.ourwheel_dir],
+                       outputs=['.venv', self.pip_list_json])
         pass
 
 
@@ -1111,8 +1564,6 @@ rmdir /Q /S .venv | VER>NUL
         '''
         from packaging import version
 
-        os.chdir(self.curdir)
-
         from enum import Enum, auto
 
         class WheelVersionPolicy(Enum):
@@ -1124,9 +1575,9 @@ rmdir /Q /S .venv | VER>NUL
                               WheelVersionPolicy.OLDEST]
             wheels_dict = {}
 
-            if os.path.exists(wheels_dir):
+            if os.path.exists(self.project_path(wheels_dir)):
                 for whl in [os.path.join(wheels_dir, whl)
-                                for whl in os.listdir(wheels_dir)
+                                for whl in os.listdir(self.project_path(wheels_dir))
                                     if whl.endswith('.whl') or whl.endswith('.tar.gz') or whl.endswith('.tar.bz2')]:
                     pw_ = parse_wheel_filename(whl)
                     name_ = pw_.project
@@ -1160,7 +1611,7 @@ rmdir /Q /S .venv | VER>NUL
         if "projects" not in self.spec:
             return
 
-        in_src = os.path.relpath(self.spec.src_dir, start=self.curdir)
+        in_src = self.project_relpath(self.spec.src_dir)
         already_checkouted = set()
 
         print(f'Running command «{self.args.folder_command}» on all project paths')
@@ -1169,13 +1620,11 @@ rmdir /Q /S .venv | VER>NUL
             if path_to_dir_ not in already_checkouted:
                 probably_package_name = os.path.split(path_to_dir_)[-1]
                 already_checkouted.add(path_to_dir_)
-                path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
+                path_to_dir = self.project_relpath(path_to_dir_)
 
-                if os.path.exists(path_to_dir):
+                if os.path.exists(self.project_path(path_to_dir)):
                     print(f'Running command on path «{path_to_dir}»')
-                    os.chdir(path_to_dir)
-                    os.system(self.args.folder_command)
-                    os.chdir(self.curdir)
+                    self.cmd(self.args.folder_command, cwd=self.project_path(path_to_dir))
                 else:
                     print(f'Cannot find path {path_to_dir}')
 
@@ -1191,7 +1640,7 @@ rmdir /Q /S .venv | VER>NUL
         if "projects" not in self.spec:
             return
 
-        in_src = os.path.relpath(self.spec.src_dir, start=self.curdir)
+        in_src = self.project_relpath(self.spec.src_dir)
         already_checkouted = set()
 
         for git_url, td_ in self.spec.projects.items():
@@ -1199,100 +1648,445 @@ rmdir /Q /S .venv | VER>NUL
             if path_to_dir_ not in already_checkouted:
                 probably_package_name = os.path.split(path_to_dir_)[-1]
                 already_checkouted.add(path_to_dir_)
-                path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
+                path_to_dir = self.project_relpath(path_to_dir_)
 
-                os.chdir(path_to_dir)
+                project_dir = self.project_path(path_to_dir)
                 print(f'''\nSyncing project "{path_to_dir}"''')
-                last_commit_message = subprocess.check_output("git log -1 --pretty=%B", shell=True).decode("utf-8")
+                last_commit_message = subprocess.check_output("git log -1 --pretty=%B", shell=True, cwd=project_dir).decode("utf-8")
                 last_commit_message = last_commit_message.strip('"')
                 last_commit_message = last_commit_message.strip("'")
                 if not last_commit_message.startswith("Merge branch"):
-                    os.system(f'''git commit -am "{last_commit_message}" ''')
-                os.system(f'''git pull --rebase=false ''')
+                    subprocess.call(f'''git commit -am "{last_commit_message}" ''', shell=True, cwd=project_dir)
+                subprocess.call(f'''git pull --rebase=false ''', shell=True, cwd=project_dir)
                 if 'out' in self.args.git_sync:
-                    os.system(f'''git push origin ''')
-                os.chdir(self.curdir)
+                    subprocess.call(f'''git push origin ''', shell=True, cwd=project_dir)
 
     def stage_50_output(self):
         '''
         Generate «output folders» for ditribution
         '''
         lines_all = []
+        depends = []
         for output_key, output_ in self.spec.outputs.items():
             build_output_name = f'generate-output-folder-for-{output_key}'
-            lines = []
-            out_dir = output_key.replace('/', '\\') + '\\iso'
-            lines.append(fR'rmdir /S /Q "{out_dir}" ')
-            lines.append(fR'if not exist "{out_dir}" mkdir "{out_dir}" ')
-
-            buildroot = self.spec.buildroot_dir
-            srcdir  = self.spec.src_dir
-            bindir  = self.spec.bin_dir
-            folders = output_.folders
-            for folder, sources_ in folders.items():
-                if isinstance(sources_, str):
-                    folders[folder] = [sources_]
-                    
-            if 'inherit' in output_:
-                for k, v in self.spec.outputs[output_.inherit].folders.items():
-                    if 'dm-embed-pipeline' in k:
-                        wtf = 1
-                    if k not in folders:
-                        folders[k] = v
-                    else:    
-                        if isinstance(v, str):
-                            v = [v]
-                        folders[k] = sorted( set(folders[k]) | set(v) ) 
-            # folders = dict(**self.spec.outputs[output_.inherit].folders)
-            # folders = {**folders, **output_.folders} 
-            
-            for folder, sources_ in folders.items():
-                # if isinstance(sources_, str):
-                #     sources_ = [s.strip() for s in sources_.strip().split("\n")]
-                dst_folder = (out_dir + os.path.sep + folder).replace('/', os.path.sep)
-                lines.append(fR"""
-    if not exist "{dst_folder}" mkdir "{dst_folder}"
-        """)
-                for from_ in sources_:
-                    from__ = from_
-                    from__ = eval(f"fR'{from_}'")
-                    if not os.path.splitext(from__)[1]:
-                        from__ += R'\*'
-                    lines.append(fR"""
-    echo n | xcopy /I /S /Y  "{from__}" {dst_folder}\
-        """)
-                    
-            self.lines2bat(build_output_name, lines)
+            lines = [self.self_command(f'--assemble-output "{output_key}"')]
+            sources_ = sorted(set(sum(self.resolve_output_folders(output_key).values(), [])))
+            self.lines2bat(build_output_name, lines, inputs=sources_, outputs=[self.output_folder(output_key)])
             lines_all.append(f'call ta-{build_output_name}.bat')
+            depends.append(build_output_name)
 
         mn_ = get_method_name()
-        self.lines2bat(mn_, lines_all, mn_)
+        self.lines2bat(mn_, lines_all, mn_, action='assemble_outputs', depends=depends)
+        pass
+
+    def output_folder(self, output_key):
+        return os.path.join(output_key.replace('/', os.path.sep), 'iso')
+
+    def output_manifest_path(self, output_key):
+        return self.project_path('tmp', 'outputs', output_key.replace('/', '-') + '.manifest.json')
+
+    def resolve_output_folders(self, output_key):
+        '''
+        Folders of the output with inherited ones, sources are evaluated.
+        '''
+        from .assembly import resolve_output_folders
+        namespace = {
+            'buildroot': self.spec.buildroot_dir,
+            'srcdir': self.spec.src_dir,
+            'bindir': self.spec.bin_dir,
+        }
+        return resolve_output_folders(self.spec.outputs, output_key, namespace)
+
+    def assemble_output(self, output_key=None):
+        '''
+        Assemble output folder for «--assemble-output».
+        '''
+        output_key = output_key or self.args.assemble_output
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        self.assemble_outputs([output_key])
+        pass
+
+    def assemble_outputs(self, output_keys=None):
+        '''
+        Synchronize output folders with their manifests (action of stage_50):
+        only new or changed files are placed (by hardlinks, reflink/copy across volumes),
+        stale ones are deleted.
+        All outputs are planned together: content, used by several outputs and
+        not linkable from builds, is staged once into shared pool and linked from it.
+        '''
+        from .assembly import build_manifest, sync_output, save_manifest, plan_shared_content, stage_pool
+        from .integrity import FileHashCache, hash_files, HASH_CACHE
+        output_keys = output_keys or list(self.spec.outputs)
+        started_ = time.perf_counter()
+        rules = {key_: {} for key_ in self.spec.outputs}
+        manifests = {key_: build_manifest(self.resolve_output_folders(key_), self.curdir, rules[key_])
+                     for key_ in self.spec.outputs}
+
+        pool_dir = self.project_path(self.output_pool_dir)
+        shared = plan_shared_content(manifests, self.project_path(self.output_folder(output_keys[0])),
+                                     pool_dir, self.spec.get('output_pool', 'auto'))
+        if shared or os.path.exists(pool_dir):
+            pool_stats = stage_pool(shared, pool_dir)
+            print(f'Shared content pool: {len(shared)} files, {pool_stats["bytes"]/2**20:.1f} MiB, '
+                  f'kept {pool_stats["kept"]}, placed {pool_stats["link"] + pool_stats["reflink"] + pool_stats["copy"]}, '
+                  f'deleted {pool_stats["deleted"]}')
+
+        hash_started_ = time.perf_counter()
+        hash_cache = FileHashCache(self.project_path(HASH_CACHE))
+        sources_ = set(src_ for key_ in output_keys for src_ in manifests[key_].values())
+        hashes, hashed_ = hash_files(sources_, self.args.hash_jobs, hash_cache)
+        hash_cache.save(keep=set(src_ for manifest_ in manifests.values() for src_ in manifest_.values()))
+        print(f'Hashed {hashed_} of {len(sources_)} sources (others unchanged) in '
+              f'{time.perf_counter() - hash_started_:.2f}s with {self.args.hash_jobs} threads')
+
+        mib_ = lambda bytes_: f'{bytes_/2**20:.1f} MiB'
+        for output_key in output_keys:
+            manifest = manifests[output_key]
+            linked_manifest = {rel_: shared.get(src_, src_) for rel_, src_ in manifest.items()}
+            stats = sync_output(linked_manifest, self.project_path(self.output_folder(output_key)))
+            save_manifest(self.output_manifest_path(output_key), manifest, hashes, rules[output_key])
+            print(f'Output {output_key}: {len(manifest)} files, '
+                  f'kept {stats["kept"]} ({mib_(stats["bytes_skipped"])} skipped), '
+                  f'linked {stats["link"]} ({mib_(stats["bytes_linked"])}), '
+                  f'reflinked/copied {stats["reflink"]}/{stats["copy"]} ({mib_(stats["bytes_copied"])}), '
+                  f'deleted {stats["deleted"]}')
+            self.size_report(output_key, build=True)
+
+        total_ = sum(os.path.getsize(src_) for key_ in output_keys for src_ in manifests[key_].values())
+        unique_ = sum(os.path.getsize(src_) for src_ in set(src_ for key_ in output_keys for src_ in manifests[key_].values()))
+        print(f'Outputs {", ".join(output_keys)}: {mib_(total_)} in total, {mib_(unique_)} unique content, '
+              f'{time.perf_counter() - started_:.2f}s')
+        pass
+
+    def size_report(self, output_key=None, build=False):
+        '''
+        Size report of output folder (by source rules, executables, folders, largest files)
+        with changes since previous build, to «reports/sizes-<output key>.txt»,
+        for «--size-report» and after assembly (build=True: the snapshot of sizes is updated).
+        Growth above «size_growth_warn» percent of spec (5 by default) is warned.
+        '''
+        from .assembly import load_manifest
+        from .sizereport import size_breakdown, report_lines, signed_mib
+        output_key = output_key or self.args.size_report
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        files_ = load_manifest(self.output_manifest_path(output_key))
+        assert files_, f'No manifest of {output_key}, assemble output first (--stage-output)'
+
+        name_ = output_key.replace('/', '-')
+        cache_path = self.project_path('tmp', 'outputs', name_ + '.dirs.json')
+        snapshot_path = self.project_path('tmp', 'outputs', name_ + '.sizes.json')
+        previous_path = self.project_path('tmp', 'outputs', name_ + '.sizes.prev.json')
+
+        def load_json(path_):
+            if not os.path.exists(path_):
+                return None
+            with open(path_, 'r', encoding='utf-8') as lf:
+                return json.load(lf)
+
+        def save_json(path_, data_):
+            with open(path_ + '.tmp', 'w', encoding='utf-8') as lf:
+                json.dump(data_, lf, ensure_ascii=False)
+            os.replace(path_ + '.tmp', path_)
+
+        started_ = time.perf_counter()
+        out_dir = self.project_path(self.output_folder(output_key))
+        cache_ = load_json(cache_path) or {}
+        sizes_ = folder_sizes(out_dir, cache=cache_)
+        save_json(cache_path, {dir_: cache_[dir_] for dir_ in sizes_ if dir_ in cache_})
+        current_ = size_breakdown(files_, sizes_, out_dir, self.spec.get('size_report_top', 20))
+
+        if build:
+            last_ = load_json(snapshot_path)
+            if last_ is not None and last_['sizes'] != current_['sizes']:
+                os.replace(snapshot_path, previous_path)
+            save_json(snapshot_path, current_)
+        previous_ = load_json(previous_path)
+
+        lines_ = report_lines(output_key, current_, previous_, self.spec.get('size_report_top', 20))
+        mkdir_p(self.project_path('reports'))
+        report_path = self.project_path('reports', f'sizes-{name_}.txt')
+        with open(report_path, 'w', encoding='utf-8') as lf:
+            lf.write('\n'.join(lines_) + '\n')
+        print(f'{lines_[0]}, report {report_path}, {time.perf_counter() - started_:.2f}s')
+        if previous_:
+            growth_ = current_['total'] - previous_['total']
+            print(f'  {lines_[1]}')
+            if growth_ > previous_['total'] * self.spec.get('size_growth_warn', 5) / 100:
+                print(f'WARNING: {output_key} grew by {signed_mib(growth_)} since previous build, see {report_path}')
+        pass
+
+    def make_iso(self, output_key=None, iso_name=None):
+        '''
+        Write ISO image of output folder for «--make-iso» (scripts of stage_51),
+        checksums computed while writing are appended to changelog of the image,
+        release manifest (for delta packages) is saved near it.
+        '''
+        from .assembly import existing_files
+        from .isowriter import write_iso
+        from .delta import save_release_manifest
+        output_key = output_key or self.args.make_iso
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        iso_name = iso_name or self.args.iso_name or time.strftime('%Y-%m-%d-%H-%M-%S') + '-dm-win-distr.iso'
+
+        started_ = time.perf_counter()
+        iso_dir = self.project_path(self.output_folder(output_key))
+        iso_filename = os.path.join(os.path.dirname(iso_dir), iso_name)
+        stats = write_iso(existing_files(iso_dir), iso_filename)
+        save_release_manifest(iso_filename, stats['contents'])
+
+        changelog_filename = os.path.splitext(iso_filename)[0] + '.changelog.txt'
+        with open(changelog_filename, 'a', encoding='utf-8') as lf:
+            lf.write(f';MD5:\n{stats["md5"]} *{iso_name}\n')
+            lf.write(f';SHA256:\n{stats["sha256"]} *{iso_name}\n')
+
+        mib_ = lambda bytes_: f'{bytes_/2**20:.1f} MiB'
+        print(f'ISO {iso_name}: {stats["files"]} files, {mib_(stats["bytes"])}, '
+              f'{stats["linked"]} duplicates stored once ({mib_(stats["bytes_deduped"])} saved), '
+              f'{mib_(os.path.getsize(iso_filename))} image ({mib_(stats["bytes_reread"])} reread for checksums), '
+              f'{time.perf_counter() - started_:.2f}s')
+        print(f'MD5 {stats["md5"]}')
+        pass
+
+    def make_wix_fragments(self, output_key=None):
+        '''
+        WiX fragments of output folder (group «CMPG_AllOfTheFiles») from its manifest
+        for «--wix-fragments» (scripts of stage_52), instead of harvesting by heat.
+        '''
+        from .assembly import load_manifest
+        from .wix import write_fragments, guid_namespace
+        output_key = output_key or self.args.wix_fragments
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        manifest_path = self.output_manifest_path(output_key)
+        assert os.path.exists(manifest_path), f'No manifest {manifest_path}, assemble output first (--stage-output)'
+
+        files_ = list(load_manifest(manifest_path))
+        for marker_ in OUTPUT_MARKER_FILES:
+            if marker_ not in files_ and os.path.exists(self.project_path(self.output_folder(output_key), marker_)):
+                files_.append(marker_)
+
+        started_ = time.perf_counter()
+        fragments_dir = self.project_path('tmp', 'msi', output_key, 'fragments')
+        stats = write_fragments(files_, fragments_dir, 'env.TA_DISTR_ISO',
+                                guid_namespace(self.spec.get('vendor', 'NoName')))
+        print(f'WiX fragments of {output_key}: {stats["files"]} files in {stats["dirs"]} dirs, '
+              f'written {stats["written"]}, kept {stats["kept"]}, removed {stats["removed"]}, '
+              f'{time.perf_counter() - started_:.2f}s')
+        pass
+
+    def make_delta(self, output_key=None):
+        '''
+        Delta package from previous (or «--delta-base») release of output to the last one
+        for «--make-delta» (scripts of stage_53). Image of the last release is restored
+        from release store if needed; if it is not there, the newest release with image is used.
+        '''
+        from .assembly import load_manifest
+        from .delta import releases, release_manifest_path, write_delta
+        output_key = output_key or self.args.make_delta
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        output_dir = self.project_path(output_key.replace('/', os.path.sep))
+        releases_ = releases(output_dir)
+        if len(releases_) < 2:
+            print(f'Output {output_key} has {len(releases_)} releases with manifests, no delta package')
+            return
+
+        # Image of the last release may be already moved to release store (stage_55).
+        store_ = self.release_store()
+        target_ = releases_[-1]
+        if not os.path.exists(os.path.join(output_dir, target_ + '.iso')) and store_.has_release(output_key, target_):
+            print(f'Restoring image of {target_} from release store')
+            store_.restore(output_key, target_, output_dir)
+        with_iso_ = [r_ for r_ in releases_ if os.path.exists(os.path.join(output_dir, r_ + '.iso'))]
+        if not with_iso_ or with_iso_[-1] == releases_[0]:
+            print(f'Output {output_key} has no release with image and previous release, no delta package')
+            return
+        if with_iso_[-1] != target_:
+            print(f'No image of {target_}, delta package is made for {with_iso_[-1]}')
+        target_ = with_iso_[-1]
+        previous_ = releases_[:releases_.index(target_)]
+        base_ = previous_[-1]
+        if self.args.delta_base:
+            bases_ = [r_ for r_ in previous_ if r_.startswith(os.path.splitext(self.args.delta_base)[0])]
+            assert bases_, f'No release «{self.args.delta_base}» of {output_key} before {target_} (there are {", ".join(previous_)})'
+            base_ = bases_[-1]
+
+        started_ = time.perf_counter()
+        iso_filename = os.path.join(output_dir, target_ + '.iso')
+        delta_filename = os.path.join(output_dir, f'{target_}.delta-from-{base_}.zip')
+        stats = write_delta(iso_filename,
+                            base_, load_manifest(release_manifest_path(os.path.join(output_dir, base_ + '.iso'))),
+                            target_, load_manifest(release_manifest_path(iso_filename)),
+                            delta_filename)
+        mib_ = lambda bytes_: f'{bytes_/2**20:.1f} MiB'
+        print(f'Delta {base_} -> {target_}: added {stats["added"]}, changed {stats["changed"]}, '
+              f'deleted {stats["deleted"]}, {mib_(stats["bytes"])} of {mib_(stats["bytes_release"])} release, '
+              f'{mib_(os.path.getsize(delta_filename))} package, {time.perf_counter() - started_:.2f}s')
+        pass
+
+    def make_archive(self, output_key=None):
+        '''
+        Compressed portable archive of output folder for «--make-archive» (scripts of stage_54).
+        Named as the release, if ISO was made (isodistr.txt in output folder).
+        '''
+        from .assembly import existing_files
+        from .archive import write_zip
+        from .delta import RELEASE_MARKER
+        output_key = output_key or self.args.make_archive
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+
+        iso_dir = self.project_path(self.output_folder(output_key))
+        release_ = time.strftime('%Y-%m-%d-%H-%M-%S') + '-dm-win-distr'
+        marker_ = os.path.join(iso_dir, RELEASE_MARKER)
+        if os.path.exists(marker_):
+            with open(marker_, 'r', encoding='utf-8') as lf:
+                release_ = os.path.splitext(lf.read().strip())[0] or release_
+        zip_filename = os.path.join(os.path.dirname(iso_dir), release_ + '.zip')
+
+        started_ = time.perf_counter()
+        stats = write_zip(existing_files(iso_dir), zip_filename, self.args.archive_jobs,
+                          self.spec.get('archive_level', 6))
+        elapsed_ = time.perf_counter() - started_
+        mib_ = lambda bytes_: f'{bytes_/2**20:.1f} MiB'
+        print(f'Archive {os.path.basename(zip_filename)}: {stats["files"]} files, '
+              f'{mib_(stats["bytes"])} -> {mib_(stats["bytes_compressed"])} '
+              f'({100 * stats["bytes_compressed"] / max(stats["bytes"], 1):.1f}%), '
+              f'{elapsed_:.2f}s, {stats["bytes"] / 2**20 / max(elapsed_, 1e-6):.1f} MiB/s '
+              f'with {self.args.archive_jobs} threads')
+        pass
+
+    def verify_output(self, output_key=None, verify_dir=None):
+        '''
+        Check folder (output, or installed/mounted distribution) against manifest with sha256
+        for «--verify-output»: output manifest of the key, or manifest file (e.g. of release).
+        '''
+        from .assembly import load_manifest
+        from .integrity import verify_tree
+        output_key = output_key or self.args.verify_output
+        verify_dir = verify_dir or self.args.verify_dir
+        if output_key in self.spec.outputs:
+            manifest_path = self.output_manifest_path(output_key)
+            verify_dir = verify_dir or self.project_path(self.output_folder(output_key))
+        else:
+            manifest_path = expandpath(output_key, start=self.curdir)
+            assert verify_dir, f'«{output_key}» is not output of spec, folder for manifest file is needed (--verify-dir)'
+        verify_dir = expandpath(verify_dir, start=self.curdir)
+
+        files_ = load_manifest(manifest_path)
+        assert files_, f'No manifest {manifest_path}'
+        assert all('sha256' in f_ for f_ in files_.values()), f'Manifest {manifest_path} has no hashes, reassemble output (--stage-output)'
+
+        started_ = time.perf_counter()
+        result = verify_tree(files_, verify_dir, self.args.hash_jobs)
+        elapsed_ = time.perf_counter() - started_
+        for kind_ in ['missing', 'changed', 'extra']:
+            for rel_ in result[kind_]:
+                print(f'{kind_.upper():8} {rel_}')
+        print(f'Verified {verify_dir}: {result["checked"]} files, {result["bytes"]/2**20:.1f} MiB in {elapsed_:.2f}s '
+              f'({result["bytes"]/2**20/max(elapsed_, 1e-6):.1f} MiB/s), missing {len(result["missing"])}, '
+              f'changed {len(result["changed"])}, extra {len(result["extra"])}')
+        assert not result['missing'] and not result['changed'], f'Verification of {verify_dir} failed!'
+        pass
+
+    def release_store(self):
+        from .releasestore import ReleaseStore
+        return ReleaseStore(self.project_path(self.spec.get('release_store', 'releases')))
+
+    def store_releases(self, output_key=None):
+        '''
+        Put ISOs of output to release store for «--store-releases» (scripts of stage_55),
+        evict releases by «release_retention» of spec (keep_last, keep_days, pinned;
+        releases with ISO kept in output folder are never evicted),
+        remove unused chunks and stored ISOs from output folder, except keep_isos last ones.
+        '''
+        import glob
+        output_key = output_key or self.args.store_releases
+        assert output_key in self.spec.outputs, f'No output «{output_key}» in spec'
+        retention_ = self.spec.get('release_retention', None) or {}
+        keep_isos = max(int(retention_.get('keep_isos', 1)), 1)
+        store_ = self.release_store()
+        output_dir = self.project_path(output_key.replace('/', os.path.sep))
+        isos_ = sorted(f_ for f_ in glob.glob(os.path.join(output_dir, '*.iso'))
+                       if os.path.basename(f_) != 'last.iso')
+
+        mib_ = lambda bytes_: f'{bytes_/2**20:.1f} MiB'
+        for iso_filename in isos_:
+            name_ = os.path.splitext(os.path.basename(iso_filename))[0]
+            if store_.has_release(output_key, name_):
+                continue
+            started_ = time.perf_counter()
+            stats = store_.put(output_key, iso_filename)
+            print(f'Stored {name_}: {stats["chunks"]} chunks, {stats["new_chunks"]} new, '
+                  f'{mib_(stats["size"])} -> {mib_(stats["bytes_stored"])}, {time.perf_counter() - started_:.2f}s')
+
+        # Releases, which ISOs stay in output folder, are never evicted (else they are stored again next run).
+        kept_isos = [os.path.splitext(os.path.basename(f_))[0] for f_ in isos_[-keep_isos:]]
+        removed_ = store_.evict(output_key, retention_.get('keep_last', 10), retention_.get('keep_days', None),
+                                list(retention_.get('pinned', None) or []) + kept_isos)
+        for name_ in removed_:
+            print(f'Evicted {name_}')
+        chunks_, bytes_ = store_.gc()
+
+        for iso_filename in isos_[:-keep_isos]:
+            name_ = os.path.splitext(os.path.basename(iso_filename))[0]
+            if store_.has_release(output_key, name_):
+                os.unlink(iso_filename)
+                print(f'Removed {os.path.basename(iso_filename)} (in store)')
+
+        releases_ = store_.releases(output_key)
+        total_ = sum(r_['size'] for r_ in releases_)
+        stored_ = store_.stored_bytes()
+        print(f'Release store {store_.root}: {len(releases_)} releases of {output_key}, {mib_(total_)} of images, '
+              f'{mib_(stored_)} of chunks (all outputs), removed {chunks_} chunks ({mib_(bytes_)})')
+        pass
+
+    def restore_release(self):
+        '''
+        Reproduce release «OUTPUT_KEY/NAME» from store for «--restore-release»
+        (to «--restore-to» or output folder).
+        '''
+        output_key, name_ = self.args.restore_release.rsplit('/', 1)
+        name_ = os.path.splitext(name_)[0] if name_.endswith('.iso') else name_
+        store_ = self.release_store()
+        if not store_.has_release(output_key, name_):
+            names_ = [r_['name'] for r_ in store_.releases(output_key)]
+            print(f'No release «{name_}» of {output_key} in store, there are:\n  ' + '\n  '.join(names_))
+            return
+        dest_ = self.args.restore_to or self.project_path(output_key.replace('/', os.path.sep))
+        dest_ = expandpath(dest_, start=self.curdir)
+        started_ = time.perf_counter()
+        iso_filename = store_.restore(output_key, name_, dest_)
+        print(f'Restored {iso_filename} (sha256 checked), {time.perf_counter() - started_:.2f}s')
         pass
 
     def stage_90_audit_analyse(self):
         '''
         Generate some documentantion about distro
         '''
-        if not self.build_mode:
-            mn_ = get_method_name()
-            lines = [
-                f'''
-{sys.executable} {sys.argv[0]}-script.py "{self.args.specfile}" --stage-audit-analyse
+        mn_ = get_method_name()
+        lines = [
+            f'''
+{self.self_command('--stage-audit-analyse')}
                 ''']
-            self.lines2bat(mn_, lines, mn_)
-            return
+        self.lines2bat(mn_, lines, mn_, action='audit_analyse',
+                       inputs=['.venv', self.pip_list_json], outputs=['reports'])
+        pass
 
-        if not self.args.stage_audit_analyse:
-            return
+    def audit_analyse(self):
+        '''
+        Collect audit documentation in-process (action of stage_90).
+        All files are of project dir (commands run there too), not of current dir.
+        '''
+        import yaml
+        import requirements
         
         wiki_defines_lines = []
         for k, v in  [(path_var, getattr(self.spec, path_var)) for path_var in vars(self.spec) if '_path' in path_var or '_dir' in path_var]:
             wiki_defines_lines.append(f'''{{{{#vardefine:{k}|{v}}}}}''')
 
-        Path('reports/wiki-defines.wiki').write_text(' '.join([''] + sorted(list(wiki_defines_lines))))
+        mkdir_p(self.project_path('reports'))
+        Path(self.project_path('reports', 'wiki-defines.wiki')).write_text(' '.join([''] + sorted(list(wiki_defines_lines))))
 
         def analyze_venv():
-            cyclone_json = 'tmp/cyclonedx-bom.json'
+            cyclone_json = self.project_path('tmp', 'cyclonedx-bom.json')
             if Path(cyclone_json).exists():
                 Path(cyclone_json).unlink()
             for scmd in f'''
@@ -1312,7 +2106,8 @@ rmdir /Q /S .venv | VER>NUL
                 node[shape=box3d, fontsize=8, fontname=Calibry, style=filled fillcolor=aliceblue];
                 edge[color=blue, fontsize=6, fontname=Calibry, style=dashed, dir=back];
             ''']
-            json_ = json.loads(open('tmp/pipdeptree.json').read())
+            with open(self.project_path('tmp', 'pipdeptree.json')) as lf:
+                json_ = json.loads(lf.read())
             # temporary hack.
             # todo: later we need to rewrite the code, deleting autoorphaned deps from auxiliary packages such as Nuitka
             ignore_packages = set('''pipdeptree
@@ -1327,7 +2122,7 @@ Nuitka zstandard
 #     rich Pygments markdown-it-py mdurl Jinja2 MarkupSafe
 
             our_packages = set()
-            for whl in Path(self.spec.ourwheel_dir).rglob('*.whl'):
+            for whl in Path(self.project_path(self.spec.ourwheel_dir)).rglob('*.whl'):
                 package_name = whl.stem.lower().split('-')[0].replace('_', '-')
                 our_packages.add(package_name)
 
@@ -1361,7 +2156,7 @@ Nuitka zstandard
                         fillcolormod = 'fillcolor=cornsilk '
                     lines.append(f''' "{key_}" [label="{name_}" {fillcolormod}]; ''')
 
-            with open(self.not_linked_python_packages_path, 'w') as lf:
+            with open(self.project_path(self.not_linked_python_packages_path), 'w') as lf:
                 lf.write(yaml.dump(not_linked_packages))
 
             for v1_ in json_:
@@ -1383,7 +2178,7 @@ Nuitka zstandard
             for git_url, td_ in self.spec.projects.items():
                 git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
                 projname_ = os.path.split(path_to_dir_)[-1]
-                path_to_dir = os.path.relpath(path_to_dir_, start=self.curdir)
+                path_to_dir = self.project_relpath(path_to_dir_)
                 if 'nuitkabuild' in td_:
                     nb_ = td_.nuitkabuild
                     srcname = nb_.input_py
@@ -1398,10 +2193,10 @@ Nuitka zstandard
                     lines.append(f''' "{utility_}-tool" [label="{utility_}" shape=note fillcolor=darkseagreen2] ;''')
                     # folderfullpath_ = Path(self.src_dir) / folder_
 
-                    if not Path(src).exists():
+                    if not Path(self.project_path(src)).exists():
                         continue
 
-                    code_ = open(src, 'r', encoding='utf-8').read()
+                    code_ = open(self.project_path(src), 'r', encoding='utf-8').read()
 
                     imported_modules = set()
                     for module_ in generate_imports_from_python_file(code_, path_to_dir):
@@ -1414,7 +2209,7 @@ Nuitka zstandard
                     for module_ in sorted(list(imported_modules)):
                         lines.append(f''' "{utility_}-tool" -> "{module_}" [style=dotted] ;''')
 
-                    reqs = Path(path_to_dir) / 'requirements.txt'
+                    reqs = Path(self.project_path(path_to_dir)) / 'requirements.txt'
                     if reqs.exists():
                         with open(reqs, 'r', encoding='utf-8') as fd:
                             try:
@@ -1427,7 +2222,7 @@ Nuitka zstandard
 
             lines.append('}')
 
-            with open('reports/pipdeptree.dot', 'w') as lf:
+            with open(self.project_path('reports', 'pipdeptree.dot'), 'w') as lf:
                 lf.write('\n'.join(lines))
 
             self.cmd(f'''
@@ -1447,38 +2242,41 @@ dot -Tsvg reports/pipdeptree.dot > reports/pipdeptree.svg
 
         try:
         # if 1:
-            json_ = json.loads(open('tmp/pip-audit-report.json').read())
+            with open(self.project_path('tmp', 'pip-audit-report.json')) as lf:
+                json_ = json.loads(lf.read())
             rows_ = []
             for r_ in json_['dependencies']:
                 if 'vulns' in r_:
                     for v_ in r_['vulns']:
                         rows_.append([r_['name'], r_['version'], v_['id'], ','.join(v_['fix_versions']), v_['description']])
 
-            write_doc_table('reports/pip-audit-report.htm', ['Пакет', 'Версия', 'Возможная уязвимость', 'Исправлено в версиях', 'Описание'], sorted(rows_))
+            write_doc_table(self.project_path('reports', 'pip-audit-report.htm'), ['Пакет', 'Версия', 'Возможная уязвимость', 'Исправлено в версиях', 'Описание'], sorted(rows_))
         except Exception as ex_:
             print(ex_)
             pass
 
         try:
-            json_ = json.loads(open(self.pip_list_json).read())
+            with open(self.project_path(self.pip_list_json)) as lf:
+                json_ = json.loads(lf.read())
             rows_ = []
             for r_ in json_:
                 rows_.append([r_['name'], r_['version']])
 
-            write_doc_table('reports/doc-python-packages.htm', ['Package', 'Version'], sorted(rows_))
+            write_doc_table(self.project_path('reports', 'doc-python-packages.htm'), ['Package', 'Version'], sorted(rows_))
         except Exception as ex_:
             print(ex_)
             pass
 
         spec = self.spec
         #!!! need to fix !!!
-        abs_path_to_out_dir = os.path.abspath(self.out_dir)
+        abs_path_to_out_dir = self.project_path(self.out_dir)
 
         def cloc_for_files(clocname, filetemplate):
-            cloc_csv = f'tmp/{clocname}.csv'
+            import csv
+            cloc_csv = self.project_path('tmp', f'{clocname}.csv')
             if not os.path.exists(cloc_csv):
                 if shutil.which('cloc'):
-                    os.system(f'cloc {filetemplate} --csv  --timeout 3600  --report-file={cloc_csv} --3')
+                    self.cmd(f'cloc {filetemplate} --csv  --timeout 3600  --report-file={cloc_csv} --3')
             if os.path.exists(cloc_csv):
                 table_csv = []
                 with open(cloc_csv, newline='') as csvfile:
@@ -1489,21 +2287,25 @@ dot -Tsvg reports/pipdeptree.dot > reports/pipdeptree.svg
                             table_csv.append(row)
 
                 table_csv[-1][-2], table_csv[-1][-1] = table_csv[-1][-1], table_csv[-1][-2]
-                write_doc_table(f'tmp/{clocname}.htm', ['Файлов', 'Язык', 'Пустых', 'Комментариев', 'Строчек кода', 'Мощность языка', 'COCOMO строк'],
+                write_doc_table(self.project_path('tmp', f'{clocname}.htm'), ['Файлов', 'Язык', 'Пустых', 'Комментариев', 'Строчек кода', 'Мощность языка', 'COCOMO строк'],
                                 table_csv)
 
-        cloc_for_files('our-cloc', f'./in/src/')
-        cloc_for_files('libs-cloc', f'./{self.spec.libscon_dir}')
+        cloc_for_files('our-cloc', self.project_path('in', 'src'))
+        cloc_for_files('libs-cloc', self.project_path(self.spec.libscon_dir))
         
         ...        
 
-    def clear_shell_files(self):
-        os.chdir(self.curdir)
+    def remove_orphan_scripts(self, keep=()):
+        '''
+        Remove generated command files, that are not in the plan anymore.
+        '''
         re_ = re.compile(r'(\d\d-|ta-).*\.(bat)')
+        removed = []
         for sh_ in Path(self.curdir).glob('*.*'):
-            if re_.match(sh_.name):
+            if re_.match(sh_.name) and sh_.name not in keep:
                 sh_.unlink()
-        pass
+                removed.append(sh_.name)
+        return sorted(removed)
 
 
     def process(self):
@@ -1520,18 +2322,192 @@ dot -Tsvg reports/pipdeptree.dot > reports/pipdeptree.svg
             self.git_sync()
             return
 
-        self.build_mode = False
-        self.clear_shell_files()
+        if self.args.lock_wheels:
+            self.lock_wheels()
+            return
+
+        if self.args.fetch_locked_wheels:
+            self.fetch_locked_wheels()
+            return
+
+        if self.args.update_wheel_index:
+            self.update_wheel_index()
+            return
+
+        if self.args.store_wheels:
+            self.store_wheels()
+            return
+
+        if self.args.assemble_output:
+            self.assemble_output()
+            return
+
+        if self.args.make_iso:
+            self.make_iso()
+            return
+
+        if self.args.wix_fragments:
+            self.make_wix_fragments()
+            return
+
+        if self.args.make_delta:
+            self.make_delta()
+            return
+
+        if self.args.make_archive:
+            self.make_archive()
+            return
+
+        if self.args.verify_output:
+            self.verify_output()
+            return
+
+        if self.args.store_releases:
+            self.store_releases()
+            return
+
+        if self.args.size_report:
+            self.size_report()
+            return
+
+        if self.args.restore_release:
+            self.restore_release()
+            return
+
+        # Stages are called once: they only fill the plan,
+        # scripts are written and (selected) steps executed from it.
+        self.make_plan()
+
+        self.write_scripts()
+        if self.args.dump_plan:
+            self.plan.dump(self.project_path(self.args.dump_plan))
+
+        self.execute_plan()
+        self.report_stage_timings()
+
+        if self.args.watch:
+            self.watch()
+        ...
 
+    def plan_util_commands(self):
         if 'util_commands' in self.spec:
             for util_name, command in self.spec['util_commands'].items():
                 self.lines2bat(util_name, [command])
+        pass
 
-        for stage_ in self.stage_methods:
-            stage_()
+    def make_plan(self, stage_names=None):
+        '''
+        Plan all stages, or only given ones (steps of other stages are kept from previous planning).
+        '''
+        methods_ = [self.plan_util_commands] + self.stage_methods
+        if stage_names is not None:
+            methods_ = [m_ for m_ in methods_ if m_.__name__ in stage_names]
+
+        # Stages do not depend on each other and on current dir,
+        # so they are planned in threads; steps are merged in order of stages.
+        if self.args.plan_jobs > 1 and len(methods_) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(self.args.plan_jobs) as pool:
+                stage_steps = list(pool.map(self.plan_stage, methods_))
+        else:
+            stage_steps = [self.plan_stage(stage_) for stage_ in methods_]
+        for m_, steps_ in zip(methods_, stage_steps):
+            self.stage_plan[m_.__name__] = steps_
+
+        self.plan = BuildPlan(env={k: v for k, v in self.tvars.items() if type(v) in (str, int)})
+        for name_ in ['plan_util_commands'] + self.stages_names:
+            for step in self.stage_plan.get(name_, []):
+                self.plan.add(step)
+        pass
 
-        self.build_mode = True
-        for stage_ in self.stage_methods:
-            stage_()
+    def nuitka_package_dirs(self):
+        '''
+        Where modules of «module» nuitka targets are searched: project dir,
+        sources of projects and site-packages of project venv.
+        '''
+        dirs_ = [self.curdir]
+        if 'projects' in self.spec:
+            for git_url, td_ in self.spec.projects.items():
+                git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
+                dirs_.append(self.project_path(path_to_dir_))
+        dirs_.append(os.path.join(self.pipenv_dir, 'Lib', 'site-packages'))
+        return dirs_
 
-        ...
+    def watched_paths(self):
+        '''
+        {kind: [paths]} to watch: spec with its includes, sources of projects, wheel dirs.
+        '''
+        from .utils import jinja_env
+        spec_files = set(jinja_env(self.root_dir).loader.loaded_files) | {self.specfile}
+        sources = []
+        if 'projects' in self.spec:
+            for git_url, td_ in self.spec.projects.items():
+                git_url, git_branch, path_to_dir_, _ = self.explode_pp_node(git_url, td_)
+                sources.append(self.project_path(path_to_dir_))
+        wheels = [self.project_path(d_) for d_ in self.index_wheel_dirs() if d_]
+        return {'spec': sorted(spec_files), 'sources': sorted(set(sources)), 'wheels': wheels}
+
+    def watch(self):
+        '''
+        Keep spec, module index and wheel catalog in memory
+        and regenerate scripts of affected stages on changes.
+        '''
+        from .watch import make_watcher, is_under
+        from .nuitkaflags import clear_module_caches
+
+        # Spec includes are known only after real templating.
+        self.load_spec(use_cache=False)
+        self.make_plan()
+        self.write_scripts()
+        self.shared_wheel_cache = self.wheel_cache()
+
+        while True:
+            paths_ = self.watched_paths()
+            watcher = make_watcher(sum(paths_.values(), []), interval=self.args.watch_interval)
+            print(f'Watching {len(paths_["spec"])} spec files, {len(paths_["sources"])} source trees, '
+                  f'{len(paths_["wheels"])} wheel dirs (Ctrl+C to stop)')
+            try:
+                while True:
+                    changed = watcher.wait()
+                    started_ = time.perf_counter()
+                    if any(p_ in paths_['spec'] for p_ in changed):
+                        print('Spec changed, replanning all stages')
+                        self.load_spec(use_cache=False)
+                        clear_module_caches()
+                        self.make_plan()
+                        self.write_scripts()
+                        print(f'Regenerated in {(time.perf_counter() - started_)*1000:.0f} ms')
+                        break
+
+                    stages_ = set()
+                    changed_sources = [d_ for d_ in paths_['sources'] if any(is_under(p_, d_) for p_ in changed)]
+                    if changed_sources:
+                        clear_module_caches(changed_sources)
+                        stages_ |= set(WATCH_SOURCE_STAGES)
+                    if any(is_under(p_, d_) for d_ in paths_['wheels'] for p_ in changed):
+                        stages_ |= set(WATCH_WHEEL_STAGES)
+                    if not stages_:
+                        continue
+                    self.make_plan(stages_)
+                    self.write_scripts()
+                    print(f'Replanned {", ".join(sorted(stages_))} in {(time.perf_counter() - started_)*1000:.0f} ms')
+            except KeyboardInterrupt:
+                return
+            finally:
+                watcher.stop()
+        pass
+
+    def report_stage_timings(self):
+        '''
+        Print wall time of executed stages and save it for comparison between runs.
+        '''
+        if not self.stage_timings:
+            return
+        print("*"*20)
+        for fname, secs_ in self.stage_timings.items():
+            print(f'{secs_:10.1f}s  {fname}')
+        print(f'{sum(self.stage_timings.values()):10.1f}s  total')
+        timings_path = Path(self.project_path(self.stage_timings_path))
+        timings_path.parent.mkdir(exist_ok=True, parents=True)
+        timings_path.write_text(json.dumps(self.stage_timings, indent=1))
+        pass
@@ -7,8 +7,6 @@ import shutil
 import stat
 import pathlib
 from easydict import EasyDict as edict
-# from jinja2 import Template, Undefined
-from jinja2 import Environment, FileSystemLoader, Template, Undefined, DebugUndefined
 # from elevate import elevate
 import inspect
 import re
@@ -41,19 +39,70 @@ def mkdir_p(path):
     pass
 
 
-def folder_size(path, *, follow_symlinks=False):
+def folder_sizes(path, *, follow_symlinks=False, cache=None):
     '''
-    Counting size of a folder. 
+    Sizes of folder and all its subfolders {dir: size with subfolders}, scanned iteratively.
+    cache {dir: [mtime_ns, size of own files, [subdirs]]} (kept by caller between scans)
+    lets skip listing of dirs with unchanged mtime — so files, rewritten in place
+    (not replaced, as outputs are updated), are not noticed with it.
     '''
-    try:
-        if not os.path.exists(path):
-            # Nonexistant folder has zero size.
-            return 0
-        it = list(os.scandir(path))
-        # with os.scandir(path) as it:
-        return sum(folder_size(entry, follow_symlinks=follow_symlinks) for entry in it)
-    except NotADirectoryError:
+    path = os.fspath(path)
+    own_ = {}
+    children_ = {}
+    seen_ = set()
+    stack = [path]
+    while stack:
+        dir_ = stack.pop()
+        try:
+            st_ = os.stat(dir_, follow_symlinks=follow_symlinks)
+        except OSError:
+            continue
+        if follow_symlinks:
+            # Links may make loops.
+            if (st_.st_dev, st_.st_ino) in seen_:
+                continue
+            seen_.add((st_.st_dev, st_.st_ino))
+        known_ = cache.get(dir_) if cache is not None else None
+        if known_ and known_[0] == st_.st_mtime_ns:
+            own_[dir_], subdirs_ = known_[1], known_[2]
+        else:
+            size_, subdirs_ = 0, []
+            try:
+                with os.scandir(dir_) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=follow_symlinks):
+                                subdirs_.append(entry.name)
+                            else:
+                                size_ += entry.stat(follow_symlinks=follow_symlinks).st_size
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+            own_[dir_] = size_
+            if cache is not None:
+                cache[dir_] = [st_.st_mtime_ns, size_, subdirs_]
+        children_[dir_] = [os.path.join(dir_, s_) for s_ in subdirs_]
+        stack.extend(children_[dir_])
+
+    # Subfolders are found after their parents, so reversed order sums them first.
+    totals = {}
+    for dir_ in reversed(list(own_)):
+        totals[dir_] = own_[dir_] + sum(totals.get(c_, 0) for c_ in children_[dir_])
+    return totals
+
+
+def folder_size(path, *, follow_symlinks=False, cache=None):
+    '''
+    Counting size of a folder (see folder_sizes).
+    '''
+    path = os.fspath(path)
+    if not os.path.exists(path):
+        # Nonexistant folder has zero size.
+        return 0
+    if not os.path.isdir(path):
         return os.stat(path, follow_symlinks=follow_symlinks).st_size
+    return folder_sizes(path, follow_symlinks=follow_symlinks, cache=cache).get(path, 0)
 
 def wtf(f):
     '''
@@ -63,20 +112,46 @@ def wtf(f):
         if wtf_ in f:
             return True
         
-class NullUndefined(Undefined):
-  def __getattr__(self, key):
-    return ''        
+def __getattr__(name):
+    # jinja2 is imported only when really needed.
+    if name == 'NullUndefined':
+        from jinja2 import Undefined
 
-def yaml_load(filename, vars_=None):
-    '''
-    Load yaml file into edict. Hide edict deps.
-    ''' 
-    import yaml
+        class NullUndefined(Undefined):
+          def __getattr__(self, key):
+            return ''        
 
-    fc = None
-    # with open(filename, 'r') as f:
-    dir_, filename_ = os.path.split(os.path.abspath(filename))
-    file_loader = FileSystemLoader(dir_)
+        globals()['NullUndefined'] = NullUndefined
+        return NullUndefined
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Jinja environments per spec directory, reused by all yaml_load calls of the process
+# (compiled templates are cached inside and reloaded if file changed).
+_JINJA_ENVS = {}
+
+YAML_LOAD_MAX_PASSES = 5
+
+
+def jinja_env(dir_):
+    from jinja2 import Environment, FileSystemLoader, DebugUndefined
+
+    if dir_ in _JINJA_ENVS:
+        return _JINJA_ENVS[dir_]
+
+    class RecordingLoader(FileSystemLoader):
+        '''
+        Remembers all loaded template files (spec and its includes).
+        '''
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.loaded_files = set()
+
+        def get_source(self, environment, template):
+            source, filename, uptodate = super().get_source(environment, template)
+            self.loaded_files.add(filename)
+            return source, filename, uptodate
+
+    file_loader = RecordingLoader(dir_)
     env = Environment(loader=file_loader, undefined=DebugUndefined)
     env.trim_blocks = True
     env.lstrip_blocks = True
@@ -90,31 +165,145 @@ def yaml_load(filename, vars_=None):
 
     env.filters['basename'] = basename
     env.filters['dirname']  = dirname        
+    _JINJA_ENVS[dir_] = env
+    return env
+
 
-    template = env.get_template(filename_)
+def yaml_load(filename, vars_=None):
+    '''
+    Load yaml file into edict. Hide edict deps.
+
+    Template is rendered with variables from the previous pass
+    until variables stop changing (fixed point).
+    ''' 
+    import time
+    import yaml
+
+    started_ = time.perf_counter()
+    fc = None
+    vars_ = dict(vars_ or {})
+    # with open(filename, 'r') as f:
+    dir_, filename_ = os.path.split(os.path.abspath(filename))
+    template = jinja_env(dir_).get_template(filename_)
 
     real_yaml = ''
     try:
-        for try_ in range(5):
+        converged = False
+        changed_keys = []
+        for pass_ in range(1, YAML_LOAD_MAX_PASSES + 1):
             real_yaml = template.render(vars_)
-            #print(real_yaml[:200])
-            ld = yaml.safe_load(real_yaml)
-            vars_ = {**vars_, **ld}
-
-        # for key in vars_:
-        #     if key.endswith('_dir'):
-        #         vars_[key] = vars_[key].replace('/', '@')
-
-        real_yaml = template.render(vars_)
-        fc = edict(yaml.safe_load(real_yaml))
+            ld = yaml.safe_load(real_yaml) or {}
+            new_vars = {**vars_, **ld}
+            changed_keys = [k for k in new_vars if k not in vars_ or vars_[k] != new_vars[k]]
+            vars_ = new_vars
+            if not changed_keys:
+                converged = True
+                break
+
+        if converged:
+            # Rendering with same variables gives the same yaml.
+            fc = edict(ld)
+        else:
+            print(f'Variables of {filename_} did not converge after {YAML_LOAD_MAX_PASSES} passes, '
+                  f'still changing: {", ".join(sorted(changed_keys))}')
+            real_yaml = template.render(vars_)
+            fc = edict(yaml.safe_load(real_yaml))
     except Exception as ex_:
-        print(f'Error parsing {filename_} see "troubles.yml" ')    
-        with open("troubles.yml", 'w', encoding='utf-8') as lf:
+        # Next to the spec, not to cwd: several projects may be loaded by one process.
+        troubles_ = os.path.join(dir_, os.path.splitext(filename_)[0] + '.troubles.yml')
+        print(f'Error parsing {filename_} see "{troubles_}" ')    
+        with open(troubles_, 'w', encoding='utf-8') as lf:
             lf.write(real_yaml)
         raise ex_    
+    print(f'Spec {filename_} loaded in {time.perf_counter() - started_:.3f}s ({pass_} passes)')
     return fc, vars_
 
 
+def file_sha256(path, bufsize=2**20):
+    '''
+    SHA256 of file content (hex).
+    '''
+    import hashlib
+    hash_ = hashlib.sha256()
+    with open(path, 'rb') as f:
+        # By chunks: files of distro may be large, and hashed in several threads.
+        for chunk_ in iter(lambda: f.read(bufsize), b''):
+            hash_.update(chunk_)
+    return hash_.hexdigest()
+
+
+def write_if_changed(path, text, encoding='utf-8'):
+    '''
+    Write text to file only if content differs (keeps mtime of unchanged files).
+    Newlines are translated as in text mode.
+    Returns True if file was written.
+    '''
+    import hashlib
+    data_ = text.replace('\n', os.linesep).encode(encoding)
+    if os.path.exists(path):
+        if os.path.getsize(path) == len(data_):
+            if file_sha256(path) == hashlib.sha256(data_).hexdigest():
+                return False
+    tmp_ = path + '.tmp'
+    with open(tmp_, 'wb') as lf:
+        lf.write(data_)
+    os.replace(tmp_, path)
+    return True
+
+
+def spec_cache_key(filename, vars_):
+    '''
+    Everything except files, that can change result of yaml_load.
+    '''
+    import hashlib
+    import json
+    import sys
+    from . import __version__
+    env_ = {k: v for k, v in os.environ.items() if k.startswith('TERRA_') or k.startswith('TA_')}
+    blob_ = json.dumps([os.path.abspath(filename), vars_ or {}, env_, __version__, sys.version],
+                       sort_keys=True, default=str)
+    return hashlib.sha256(blob_.encode('utf-8')).hexdigest()
+
+
+def yaml_load_cached(filename, vars_=None, cache_dir='tmp/spec-cache'):
+    '''
+    yaml_load with persistent cache of resolved spec and variables.
+    Cache is valid while spec, all included files and TERRA_*/TA_* environment are the same,
+    so warm runs skip templating and yaml parsing (and even importing jinja2 and yaml).
+    '''
+    import hashlib
+    import pickle
+
+    key_ = spec_cache_key(filename, vars_)
+    cache_path = os.path.join(cache_dir, hashlib.sha256(os.path.abspath(filename).encode('utf-8')).hexdigest()[:16] + '.pickle')
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as lf:
+                cached_ = pickle.load(lf)
+            if cached_['key'] == key_ and all(os.path.exists(f_) and file_sha256(f_) == sha_
+                                              for f_, sha_ in cached_['files'].items()):
+                print(f'Spec {os.path.basename(filename)} loaded from cache')
+                return cached_['spec'], cached_['tvars']
+        except Exception as ex_:
+            print(f'Ignoring broken spec cache {cache_path}: {ex_}')
+
+    spec_, tvars_ = yaml_load(filename, vars_)
+
+    dir_ = os.path.split(os.path.abspath(filename))[0]
+    files_ = set(jinja_env(dir_).loader.loaded_files) | {os.path.abspath(filename)}
+    mkdir_p(cache_dir)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as lf:
+        pickle.dump({
+            'key': key_,
+            'files': {f_: file_sha256(f_) for f_ in sorted(files_)},
+            'spec': spec_,
+            'tvars': tvars_,
+        }, lf)
+    os.replace(tmp_path, cache_path)
+    return spec_, tvars_
+
+
 
 def rmdir(oldpath):
     if os.path.exists(oldpath):
@@ -125,15 +314,20 @@ def rmdir(oldpath):
     #     shutil.rmtree(oldpath)
     pass
 
-def git2dir(git_url, git_branch, path_to_dir):
+def git2dir(git_url, git_branch, path_to_dir, start=None):
+    '''
+    Shallow clone of branch to path_to_dir (relative to start, if given).
+    '''
+    if start:
+        path_to_dir = os.path.join(start, path_to_dir)
+    path_to_dir = os.path.abspath(path_to_dir)
     oldpath = path_to_dir + '.old'
     newpath = path_to_dir + '.new'
     rmdir(oldpath)
     pdir = os.path.split(path_to_dir)[0]
-    os.chdir(pdir)
     scmd = 'git --git-dir=/dev/null clone --single-branch --branch %(git_branch)s  --depth=1 %(git_url)s %(newpath)s ' % vars()
     rmdir(newpath)
-    os.system(scmd)
+    subprocess.call(scmd, shell=True, cwd=pdir)
     if os.path.exists(newpath):
         if os.path.exists(path_to_dir):
             rmdir(oldpath)
@@ -142,19 +336,20 @@ def git2dir(git_url, git_branch, path_to_dir):
         shutil.move(newpath, path_to_dir)
     pass
 
-def make_setup_if_not_exists():
+def make_setup_if_not_exists(package_dir='.'):
     '''
     If python package without setup.py
     (for example Poetry)
     '''
-    if not os.path.exists('setup.py') and os.path.exists('setup.cfg'):
+    setup_py = os.path.join(package_dir, 'setup.py')
+    if not os.path.exists(setup_py) and os.path.exists(os.path.join(package_dir, 'setup.cfg')):
         from poetry.masonry.builders.sdist import SdistBuilder
         from poetry.factory import Factory
         factory = Factory()
-        poetry = factory.create_poetry('.')                
+        poetry = factory.create_poetry(package_dir)                
         sdist_builder = SdistBuilder(poetry, None, None)
         setuppy_blob = sdist_builder.build_setup()
-        with open('setup.py', 'wb') as unit:
+        with open(setup_py, 'wb') as unit:
             unit.write(setuppy_blob)
             unit.write(b'\n# This setup.py was autogenerated using poetry.\n')                
     pass
@@ -166,8 +361,14 @@ def giturl2folder(git_url):
     return fld_
 
 
-def expandpath(path):
-    return os.path.abspath(os.path.expanduser(os.path.expandvars(path)))
+def expandpath(path, start=None):
+    '''
+    Expand vars and «~», relative path is resolved against start (current dir by default).
+    '''
+    path = os.path.expanduser(os.path.expandvars(path))
+    if start:
+        path = os.path.join(start, path)
+    return os.path.abspath(path)
 
 
 import ast
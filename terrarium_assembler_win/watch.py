@@ -0,0 +1,149 @@
+"""
+    Watching of spec and source trees for «--watch» mode of TA.
+
+    Uses watchdog (ReadDirectoryChangesW on Windows, inotify on Linux),
+    if it is installed, otherwise polls mtimes of files.
+"""
+
+import os
+import time
+import threading
+
+IGNORED_DIRS = {'.git', '.hg', '.svn', '__pycache__', '.venv', 'node_modules', 'build', 'dist'}
+IGNORED_EXTS = ('.pyc', '.pyo', '.swp', '.tmp')
+
+# After first change wait a bit more: editors save files in several steps.
+DEBOUNCE_SECONDS = 0.1
+
+
+def is_under(path, dir_):
+    path, dir_ = os.path.abspath(path), os.path.abspath(dir_)
+    try:
+        return os.path.commonpath([path, dir_]) == dir_
+    except ValueError:
+        # Different drives.
+        return False
+
+
+def ignored(path):
+    if path.endswith(IGNORED_EXTS):
+        return True
+    for part_ in path.replace('\\', '/').split('/'):
+        if part_ in IGNORED_DIRS or part_.endswith('.egg-info'):
+            return True
+    return False
+
+
+def snapshot(paths):
+    '''
+    {file: (mtime_ns, size)} for files and (recursively) dirs.
+    '''
+    result = {}
+    stack = []
+    for path_ in paths:
+        if os.path.isdir(path_):
+            stack.append(path_)
+        elif os.path.exists(path_):
+            st_ = os.stat(path_)
+            result[os.path.abspath(path_)] = (st_.st_mtime_ns, st_.st_size)
+    while stack:
+        dir_ = stack.pop()
+        try:
+            with os.scandir(dir_) as it_:
+                for entry in it_:
+                    if ignored(entry.path):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st_ = entry.stat(follow_symlinks=False)
+                        result[os.path.abspath(entry.path)] = (st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            pass
+    return result
+
+
+class PollingWatcher:
+    '''
+    Compares snapshots of watched paths every «interval» seconds.
+    '''
+
+    def __init__(self, paths, interval=0.5):
+        self.paths = list(paths)
+        self.interval = interval
+        self.state = snapshot(self.paths)
+
+    def wait(self):
+        '''
+        Block until something changed, returns set of changed (abs) paths.
+        '''
+        while True:
+            time.sleep(self.interval)
+            new_state = snapshot(self.paths)
+            changed = {p_ for p_ in set(self.state) | set(new_state) if self.state.get(p_) != new_state.get(p_)}
+            self.state = new_state
+            if changed:
+                return changed
+
+    def stop(self):
+        pass
+
+
+class WatchdogWatcher:
+    '''
+    Collects filesystem events from watchdog observer.
+    '''
+
+    def __init__(self, paths, interval=None):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        self.changed = set()
+        self.cond = threading.Condition()
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory and event.event_type == 'modified':
+                    return
+                for path_ in [event.src_path, getattr(event, 'dest_path', None)]:
+                    if path_ and not ignored(path_):
+                        with watcher.cond:
+                            watcher.changed.add(os.path.abspath(path_))
+                            watcher.cond.notify()
+
+        self.observer = Observer()
+        handler_ = Handler()
+        watches_ = {}
+        for path_ in paths:
+            if os.path.isdir(path_):
+                watches_[os.path.abspath(path_)] = True
+            elif os.path.isdir(os.path.dirname(path_) or '.'):
+                # Single files (spec and includes) are watched via their dirs.
+                watches_.setdefault(os.path.abspath(os.path.dirname(path_) or '.'), False)
+        for dir_, recursive_ in sorted(watches_.items()):
+            self.observer.schedule(handler_, dir_, recursive=recursive_)
+        self.observer.start()
+
+    def wait(self):
+        with self.cond:
+            while not self.changed:
+                self.cond.wait()
+        time.sleep(DEBOUNCE_SECONDS)
+        with self.cond:
+            changed, self.changed = self.changed, set()
+        return changed
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+        pass
+
+
+def make_watcher(paths, interval=0.5):
+    try:
+        import watchdog
+        return WatchdogWatcher(paths)
+    except ImportError:
+        print('watchdog is not installed, polling for changes')
+        return PollingWatcher(paths, interval)
@@ -0,0 +1,230 @@
+"""
+    Offline inspection of local wheelhouses for TA:
+    reading wheel METADATA without extraction and checking
+    the dependency closure of the selected wheels.
+"""
+
+import os
+import json
+import threading
+import zipfile
+from email.parser import HeaderParser
+
+from .utils import file_sha256
+
+WHEEL_METADATA_CACHE = 'tmp/wheel-metadata-cache.json'
+
+# We always assemble for Windows, even if spec is processed elsewhere.
+WINDOWS_MARKER_ENV = {
+    'os_name': 'nt',
+    'sys_platform': 'win32',
+    'platform_system': 'Windows',
+    'platform_machine': 'AMD64',
+}
+
+
+def read_wheel_metadata(path):
+    '''
+    Read «Name», «Version», «Requires-Dist» and «Requires-Python» of the wheel.
+    Only the zip central directory and the METADATA member are read,
+    nothing is extracted.
+    '''
+    with zipfile.ZipFile(path) as zf:
+        metadata_name = None
+        for name_ in zf.namelist():
+            parts_ = name_.split('/')
+            if len(parts_) == 2 and parts_[0].endswith('.dist-info') and parts_[1] == 'METADATA':
+                metadata_name = name_
+                break
+        if not metadata_name:
+            raise ValueError(f'No METADATA in {path}')
+        text_ = zf.read(metadata_name).decode('utf-8', errors='replace')
+
+    msg = HeaderParser().parsestr(text_)
+    return {
+        'name': msg.get('Name', ''),
+        'version': msg.get('Version', ''),
+        'requires': msg.get_all('Requires-Dist') or [],
+        'requires_python': msg.get('Requires-Python', None),
+    }
+
+
+class WheelMetadataCache:
+    '''
+    Parsed wheel METADATA, cached per wheel sha256.
+    To avoid rehashing, sha256 is remembered per (path, size, mtime).
+    '''
+
+    def __init__(self, cache_path=WHEEL_METADATA_CACHE):
+        self.cache_path = cache_path
+        self.paths = {}
+        self.wheels = {}
+        self.dirty = False
+        # Cache may be shared by assemblers of several specs (batch mode).
+        self.lock = threading.RLock()
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as lf:
+                    data_ = json.load(lf)
+                self.paths = data_.get('paths', {})
+                self.wheels = data_.get('wheels', {})
+            except Exception as ex_:
+                print(f'Ignoring broken cache {cache_path}: {ex_}')
+        pass
+
+    def sha256(self, path):
+        path = os.path.abspath(path)
+        st_ = os.stat(path)
+        key_ = [st_.st_size, st_.st_mtime_ns]
+        with self.lock:
+            known_ = self.paths.get(path)
+        if known_ and known_[:2] == key_:
+            return known_[2]
+        # Hashed without lock: other threads may hash other wheels meanwhile.
+        sha_ = file_sha256(path)
+        with self.lock:
+            self.paths[path] = key_ + [sha_]
+            self.dirty = True
+        return sha_
+
+    def get(self, path):
+        '''
+        Metadata of the wheel (with its sha256)
+        '''
+        sha_ = self.sha256(path)
+        with self.lock:
+            meta_ = self.wheels.get(sha_)
+        if meta_ is None:
+            meta_ = read_wheel_metadata(path)
+            with self.lock:
+                meta_ = self.wheels.setdefault(sha_, meta_)
+                self.dirty = True
+        return {**meta_, 'sha256': sha_, 'path': path}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            dir_ = os.path.dirname(self.cache_path)
+            if dir_:
+                os.makedirs(dir_, exist_ok=True)
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as lf:
+                json.dump({'paths': dict(self.paths), 'wheels': dict(self.wheels)}, lf)
+            os.replace(tmp_path, self.cache_path)
+            self.dirty = False
+        pass
+
+
+def marker_environment(overrides=None):
+    '''
+    Environment for markers and Requires-Python. Python version of spec
+    may be «3.8» or «3.8.10», it overrides both python_version and python_full_version.
+    '''
+    from packaging.markers import default_environment
+    env = default_environment()
+    env.update(WINDOWS_MARKER_ENV)
+    if overrides:
+        env.update(overrides)
+        if 'python_version' in overrides and 'python_full_version' not in overrides:
+            parts_ = str(overrides['python_version']).split('.')
+            env['python_version'] = '.'.join(parts_[:2])
+            env['python_full_version'] = '.'.join(parts_)
+    return env
+
+
+def check_closure(wheels, cache=None, env_overrides=None):
+    '''
+    Check that requirements of selected wheels are satisfied by the same wheels,
+    and Requires-Python of them — by python of the environment.
+
+    Returns (missing, conflicts, unchecked):
+    * missing — {requirement name: [who requires]}
+    * conflicts — [(who requires, requirement, found version)],
+      Requires-Python mismatches are here as («Python <specifier>», python version)
+    * unchecked — files without METADATA (sdists, broken wheels)
+    '''
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.specifiers import SpecifierSet, InvalidSpecifier
+    from packaging.utils import canonicalize_name
+    from packaging.version import Version, InvalidVersion
+
+    if cache is None:
+        cache = WheelMetadataCache()
+
+    env = marker_environment(env_overrides)
+    available = {}
+    unchecked = []
+    for whl in wheels:
+        if not whl.endswith('.whl'):
+            unchecked.append(whl)
+            continue
+        try:
+            meta_ = cache.get(whl)
+        except Exception as ex_:
+            print(f'Cannot read metadata of {whl}: {ex_}')
+            unchecked.append(whl)
+            continue
+        available[canonicalize_name(meta_['name'])] = meta_
+    cache.save()
+
+    missing = {}
+    conflicts = []
+    python_ = env['python_full_version']
+    for name_, meta_ in sorted(available.items()):
+        requires_python = meta_.get('requires_python', None)
+        if not requires_python:
+            continue
+        who_ = f"{meta_['name']}=={meta_['version']}"
+        try:
+            if not SpecifierSet(requires_python).contains(Version(python_), prereleases=True):
+                conflicts.append((who_, f'Python {requires_python}', python_))
+        except (InvalidSpecifier, InvalidVersion):
+            print(f'Cannot check Requires-Python «{requires_python}» of {who_} for Python {python_}')
+
+    seen = set()
+    queue = [(name_, '') for name_ in sorted(available)]
+    while queue:
+        name_, extra_ = queue.pop()
+        if (name_, extra_) in seen:
+            continue
+        seen.add((name_, extra_))
+        meta_ = available[name_]
+        who_ = f"{meta_['name']}=={meta_['version']}"
+        if extra_:
+            who_ = f"{meta_['name']}[{extra_}]=={meta_['version']}"
+        for req_str in meta_['requires']:
+            try:
+                req_ = Requirement(req_str)
+            except InvalidRequirement:
+                print(f'Cannot parse requirement «{req_str}» of {who_}')
+                continue
+            if req_.marker and not req_.marker.evaluate({**env, 'extra': extra_}):
+                continue
+            dep_name = canonicalize_name(req_.name)
+            if dep_name not in available:
+                missing.setdefault(req_.name, []).append(who_)
+                continue
+            dep_ = available[dep_name]
+            try:
+                dep_version = Version(dep_['version'])
+            except InvalidVersion:
+                dep_version = dep_['version']
+            if req_.specifier and not req_.specifier.contains(dep_version, prereleases=True):
+                conflicts.append((who_, str(req_), dep_['version']))
+            for x_ in req_.extras:
+                queue.append((dep_name, x_))
+
+    return missing, conflicts, unchecked
+
+
+def print_closure_report(missing, conflicts, unchecked):
+    for name_, whos_ in sorted(missing.items()):
+        print(f'Unsatisfied: {name_} (required by {", ".join(sorted(set(whos_)))})')
+    for who_, req_, found_ in sorted(set(conflicts)):
+        print(f'Conflict: {who_} requires «{req_}», found {found_}')
+    for file_ in unchecked:
+        print(f'Unchecked (no wheel metadata): {file_}')
+    if not missing and not conflicts:
+        print('Wheel dependency closure is OK')
+    pass
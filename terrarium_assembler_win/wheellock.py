@@ -0,0 +1,224 @@
+"""
+    Offline requirements resolver for TA.
+
+    Resolves spec requirements against local wheel directories
+    and writes pinned lockfile (pip requirements format with hashes).
+"""
+
+import os
+import hashlib
+
+from .wheelhouse import marker_environment
+
+LOCK_HEADER = '# Generated by terrarium_assembler, do not edit.'
+
+
+class ResolutionError(Exception):
+    pass
+
+
+def read_requirements_file(path):
+    '''
+    Requirement lines of requirements.txt.
+    Options (-r, -e, --hash…) and URL requirements are not supported offline.
+    '''
+    reqs = []
+    with open(path, 'r', encoding='utf-8') as lf:
+        for line_ in lf:
+            line_ = line_.split(' #', 1)[0].strip()
+            if not line_ or line_.startswith('#'):
+                continue
+            if line_.startswith('-'):
+                raise ResolutionError(f'Option «{line_}» in {path} cannot be resolved offline')
+            reqs.append(line_)
+    return reqs
+
+
+def collect_catalog(wheel_dirs, cache):
+    '''
+    Catalog of available wheels {canonical name: [metadata, …]}.
+    Order of wheel_dirs is priority order.
+    '''
+    from packaging.utils import canonicalize_name
+
+    catalog = {}
+    for prio_, dir_ in enumerate(wheel_dirs):
+        if not dir_ or not os.path.isdir(dir_):
+            continue
+        for file_ in sorted(os.listdir(dir_)):
+            if not file_.endswith('.whl'):
+                continue
+            try:
+                meta_ = cache.get(os.path.join(dir_, file_))
+            except Exception as ex_:
+                print(f'Cannot read metadata of {file_}: {ex_}')
+                continue
+            meta_['priority'] = prio_
+            catalog.setdefault(canonicalize_name(meta_['name']), []).append(meta_)
+    cache.save()
+    return catalog
+
+
+def inputs_digest(requirements, extra=None):
+    '''
+    Digest of resolution inputs, to know if lockfile is up to date.
+    '''
+    h_ = hashlib.sha256()
+    for r_ in sorted(requirements):
+        h_.update(r_.encode('utf-8') + b'\n')
+    for k_, v_ in sorted((extra or {}).items()):
+        h_.update(f'{k_}={v_}\n'.encode('utf-8'))
+    return h_.hexdigest()
+
+
+def resolve(requirements, catalog, env_overrides=None, ignore=None, max_passes=50):
+    '''
+    Resolve requirement strings against catalog.
+
+    Each pass picks the best (by priority of directory, then newest) candidate
+    for every name, satisfying constraints met so far in the pass and, if possible,
+    constraints of the previous pass. Constraints are collected anew on each pass,
+    only from requirements of currently selected candidates, so requirements
+    of dropped candidates do not stay. Passes repeat until the selection
+    satisfies all its requirements and is the same as on the previous pass.
+    Returns {canonical name: metadata}.
+    '''
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.specifiers import SpecifierSet
+    from packaging.utils import canonicalize_name
+    from packaging.version import Version, InvalidVersion
+
+    env = marker_environment(env_overrides)
+    ignore = set(canonicalize_name(n_) for n_ in (ignore or []))
+
+    def version_of(meta_):
+        try:
+            return Version(meta_['version'])
+        except InvalidVersion:
+            return None
+
+    roots = []
+    for r_ in requirements:
+        try:
+            roots.append(Requirement(r_))
+        except InvalidRequirement:
+            raise ResolutionError(f'Cannot resolve offline «{r_}»')
+
+    constraints = {}
+    previous_selection = None
+    for pass_ in range(max_passes):
+        previous_constraints, constraints = constraints, {}
+        chosen = {}
+        problems = []
+        stable = True
+        seen = set()
+        queue = [(req_, '<spec>') for req_ in roots]
+        while queue:
+            req_, who_ = queue.pop(0)
+            name_ = canonicalize_name(req_.name)
+            if name_ in ignore:
+                continue
+            spec_ = constraints[name_] = constraints.get(name_, SpecifierSet()) & req_.specifier
+            if name_ in chosen:
+                ver_ = version_of(chosen[name_])
+                if ver_ is not None and not spec_.contains(ver_, prereleases=True):
+                    # Constraint came too late for this pass.
+                    stable = False
+            else:
+                candidates = [m_ for m_ in catalog.get(name_, [])
+                              if version_of(m_) is not None and spec_.contains(version_of(m_), prereleases=True)]
+                hint_ = previous_constraints.get(name_, SpecifierSet())
+                hinted_ = [m_ for m_ in candidates if hint_.contains(version_of(m_), prereleases=True)]
+                candidates = hinted_ or candidates
+                if not candidates:
+                    if name_ in catalog:
+                        found_ = ', '.join(sorted(m_['version'] for m_ in catalog[name_]))
+                        problems.append(f'Conflict: {who_} requires «{req_}», found {found_}')
+                    else:
+                        problems.append(f'Unsatisfied: {req_} (required by {who_})')
+                    continue
+                candidates.sort(key=lambda m_: (-m_['priority'], version_of(m_)))
+                chosen[name_] = candidates[-1]
+            meta_ = chosen[name_]
+            for extra_ in [''] + sorted(req_.extras):
+                if (name_, extra_) in seen:
+                    continue
+                seen.add((name_, extra_))
+                who_dep = f"{meta_['name']}=={meta_['version']}"
+                for dep_str in meta_['requires']:
+                    try:
+                        dep_ = Requirement(dep_str)
+                    except InvalidRequirement:
+                        print(f'Cannot parse requirement «{dep_str}» of {who_dep}')
+                        continue
+                    if dep_.marker and not dep_.marker.evaluate({**env, 'extra': extra_}):
+                        continue
+                    queue.append((dep_, who_dep))
+        if problems:
+            raise ResolutionError('\n'.join(problems))
+        selection_ = {name_: meta_['sha256'] for name_, meta_ in chosen.items()}
+        if stable and selection_ == previous_selection:
+            return chosen
+        previous_selection = selection_
+    raise ResolutionError(f'Resolution is not stable after {max_passes} passes')
+
+
+def write_lockfile(path, chosen, digest, our_names=None):
+    '''
+    Pinned requirements with hashes.
+    Our wheels (rebuilt every time) are only listed in comments.
+    '''
+    our_names = set(our_names or [])
+    lines = [LOCK_HEADER, f'# inputs-sha256: {digest}']
+    for name_, meta_ in sorted(chosen.items()):
+        if name_ in our_names:
+            lines.append(f"# ours: {meta_['name']}=={meta_['version']}")
+    for name_, meta_ in sorted(chosen.items()):
+        if name_ in our_names:
+            continue
+        lines.append(f"{meta_['name']}=={meta_['version']} \\")
+        lines.append(f"    --hash=sha256:{meta_['sha256']}")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as lf:
+        lf.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+    pass
+
+
+def read_lockfile(path):
+    '''
+    Returns (digest, [(name, version, sha256)]) or (None, []) if no lockfile.
+    '''
+    if not os.path.exists(path):
+        return None, []
+    digest = None
+    pins = []
+    pending = None
+    with open(path, 'r', encoding='utf-8') as lf:
+        for line_ in lf:
+            line_ = line_.strip()
+            if line_.startswith('# inputs-sha256:'):
+                digest = line_.split(':', 1)[1].strip()
+            elif line_.startswith('#') or not line_:
+                continue
+            elif line_.startswith('--hash=sha256:') and pending:
+                pins.append((*pending, line_.split(':', 1)[1].strip()))
+                pending = None
+            else:
+                name_, version_ = line_.rstrip('\\').strip().split('==', 1)
+                pending = (name_, version_)
+    return digest, pins
+
+
+def locate_pins(pins, catalog):
+    '''
+    Wheels of lockfile pins, found (by hash) in the catalog:
+    ({sha256: metadata}, [pins not found]). Wheel from dir of higher priority wins.
+    '''
+    known = {}
+    for metas_ in catalog.values():
+        for m_ in sorted(metas_, key=lambda m_: m_['priority']):
+            known.setdefault(m_['sha256'], m_)
+    found = {pin_[2]: known[pin_[2]] for pin_ in pins if pin_[2] in known}
+    missing = [pin_ for pin_ in pins if pin_[2] not in known]
+    return found, missing
@@ -0,0 +1,147 @@
+"""
+    Content-addressed wheel store for TA.
+
+    Every wheel is stored once by sha256, and wheel directories
+    (basewheel_dir, depswheel_dir, …) are views of hardlinks to the store.
+"""
+
+import os
+import shutil
+
+from .wheelhouse import WheelMetadataCache
+
+WHEEL_STORE_EXTS = ('.whl', '.tar.gz', '.tar.bz2')
+
+
+def archive_ext(filename):
+    for ext_ in WHEEL_STORE_EXTS:
+        if filename.lower().endswith(ext_):
+            return ext_
+    return None
+
+
+def link_or_copy(src, dst):
+    '''
+    Atomically create (or replace) dst as hardlink to src.
+    Across volumes falls back to copy.
+    '''
+    tmp_ = dst + '.ta-tmp'
+    if os.path.exists(tmp_):
+        os.unlink(tmp_)
+    try:
+        os.link(src, tmp_)
+    except OSError:
+        shutil.copy2(src, tmp_)
+    os.replace(tmp_, dst)
+    pass
+
+
+def same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+class WheelStore:
+    '''
+    Store layout: <root>/<sha[:2]>/<sha><ext>
+    '''
+
+    def __init__(self, root, cache=None):
+        self.root = os.path.abspath(root)
+        self.cache = cache or WheelMetadataCache()
+        self.stats = {'stored': 0, 'linked': 0, 'removed': 0, 'kept': 0}
+
+    def blob_path(self, sha, ext):
+        return os.path.join(self.root, sha[:2], sha + ext)
+
+    def blob_sha(self, blob):
+        name_ = os.path.basename(blob)
+        return name_[:-len(archive_ext(name_))]
+
+    def put(self, path):
+        '''
+        Put file into the store (if not yet), returns its blob path.
+        '''
+        sha_ = self.cache.sha256(path)
+        blob_ = self.blob_path(sha_, archive_ext(path))
+        if not os.path.exists(blob_):
+            os.makedirs(os.path.dirname(blob_), exist_ok=True)
+            link_or_copy(path, blob_)
+            self.stats['stored'] += 1
+        return blob_
+
+    def absorb(self, role_dir):
+        '''
+        Put all files of wheel dir into the store and make them hardlinks.
+        '''
+        if not os.path.isdir(role_dir):
+            return
+        for file_ in sorted(os.listdir(role_dir)):
+            if not archive_ext(file_):
+                continue
+            path_ = os.path.join(role_dir, file_)
+            blob_ = self.put(path_)
+            if not same_file(path_, blob_):
+                link_or_copy(blob_, path_)
+                self.remember(path_, self.blob_sha(blob_))
+                self.stats['linked'] += 1
+        pass
+
+    def refresh(self, role_dir, staging_dir):
+        '''
+        Make role_dir the view of staging_dir content, touching only changed files.
+        Staging dir is removed afterwards.
+        '''
+        os.makedirs(role_dir, exist_ok=True)
+        wanted = set()
+        for file_ in sorted(os.listdir(staging_dir)):
+            if not archive_ext(file_):
+                continue
+            wanted.add(file_)
+            blob_ = self.put(os.path.join(staging_dir, file_))
+            path_ = os.path.join(role_dir, file_)
+            if same_file(path_, blob_):
+                self.stats['kept'] += 1
+                continue
+            link_or_copy(blob_, path_)
+            self.remember(path_, self.blob_sha(blob_))
+            self.stats['linked'] += 1
+
+        for file_ in sorted(os.listdir(role_dir)):
+            if file_ not in wanted and os.path.isfile(os.path.join(role_dir, file_)):
+                os.unlink(os.path.join(role_dir, file_))
+                self.stats['removed'] += 1
+
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        pass
+
+    def remember(self, path, sha):
+        '''
+        Hardlinks share stat with the blob, so hash of the view file
+        is known without reading it.
+        '''
+        path_ = os.path.abspath(path)
+        st_ = os.stat(path_)
+        with self.cache.lock:
+            self.cache.paths[path_] = [st_.st_size, st_.st_mtime_ns, sha]
+            self.cache.dirty = True
+        pass
+
+    def gc(self):
+        '''
+        Remove blobs, not referenced by any wheel dir (hardlink count is 1).
+        Blobs, copied across volumes, are always removed, store is only a cache for them.
+        '''
+        if not os.path.isdir(self.root):
+            return
+        for shard_ in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard_)
+            if not os.path.isdir(shard_dir):
+                continue
+            for blob_ in os.listdir(shard_dir):
+                path_ = os.path.join(shard_dir, blob_)
+                if os.stat(path_).st_nlink <= 1:
+                    os.unlink(path_)
+        pass
@@ -0,0 +1,149 @@
+"""
+    WiX sources of output folders for MSI (stage_52_make_msi) for TA.
+
+    Instead of harvesting output folder by «heat.exe» on every build,
+    fragments are generated from the output manifest: one fragment per directory,
+    ids and component GUIDs are derived from relative paths, so they are stable
+    between builds (upgrades keep components), and only fragments of changed
+    directories are rewritten (and recompiled by candle).
+"""
+
+import os
+import uuid
+import hashlib
+from xml.sax.saxutils import quoteattr
+
+from .utils import write_if_changed
+
+ALL_FILES_GROUP = 'CMPG_AllOfTheFiles'
+ROOT_DIRECTORY = 'TARGETDIR'
+ALL_FILES_FRAGMENT = 'all-files.wxs'
+
+WXS_HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<Wix xmlns="http://schemas.microsoft.com/wix/2006/wi">
+    <Fragment>
+'''
+WXS_FOOTER = '''    </Fragment>
+</Wix>
+'''
+
+
+def path_key(rel_path):
+    '''
+    Relative path as Windows sees it: «/»-separated, case-insensitive.
+    '''
+    return rel_path.replace('\\', '/').strip('/').lower()
+
+
+def wix_id(prefix, rel_path):
+    '''
+    Identifier of WiX element (≤72 chars, [A-Za-z0-9_.]), stable for the path.
+    '''
+    return prefix + hashlib.sha1(path_key(rel_path).encode('utf-8')).hexdigest().upper()
+
+
+def directory_id(rel_dir):
+    return wix_id('dir', rel_dir) if rel_dir else ROOT_DIRECTORY
+
+
+def guid_namespace(name):
+    return uuid.uuid5(uuid.NAMESPACE_URL, 'terrarium_assembler_win/wix/' + name)
+
+
+def component_guid(rel_path, namespace):
+    '''
+    GUID of component, deterministic for file path (as «heat -gg», but not random).
+    '''
+    return '{' + str(uuid.uuid5(namespace, path_key(rel_path))).upper() + '}'
+
+
+def fragment_name(rel_dir):
+    return directory_id(rel_dir).lower() + '.wxs'
+
+
+def group_by_directory(files):
+    '''
+    Relative paths of files → {relative dir: ([subdirs], [files])}, all parent dirs included.
+    '''
+    dirs_ = {'': (set(), [])}
+    for rel_ in files:
+        rel_ = rel_.replace('\\', '/')
+        dir_ = os.path.dirname(rel_).replace('\\', '/')
+        child_ = None
+        cur_ = dir_
+        while True:
+            if cur_ not in dirs_:
+                dirs_[cur_] = (set(), [])
+            if child_ is not None:
+                dirs_[cur_][0].add(child_)
+            if not cur_:
+                break
+            child_, cur_ = cur_, os.path.dirname(cur_)
+        dirs_[dir_][1].append(rel_)
+    return {d_: (sorted(subdirs_), sorted(files_)) for d_, (subdirs_, files_) in sorted(dirs_.items())}
+
+
+def directory_fragment(rel_dir, subdirs, files, source_var, namespace):
+    '''
+    Fragment with subdirectories and components of files of the directory,
+    and group «CMPG_<dir id>» of the components.
+    '''
+    dir_id = directory_id(rel_dir)
+    lines_ = [WXS_HEADER, f'        <DirectoryRef Id="{dir_id}">\n']
+    for subdir_ in subdirs:
+        lines_.append(f'            <Directory Id="{directory_id(subdir_)}" Name={quoteattr(os.path.basename(subdir_))} />\n')
+    for rel_ in files:
+        source_ = f'$({source_var})\\' + rel_.replace('/', '\\')
+        lines_.append(f'            <Component Id="{wix_id("cmp", rel_)}" Guid="{component_guid(rel_, namespace)}">\n')
+        lines_.append(f'                <File Id="{wix_id("fil", rel_)}" KeyPath="yes" Source={quoteattr(source_)} />\n')
+        lines_.append('            </Component>\n')
+    lines_.append('        </DirectoryRef>\n')
+    lines_.append(f'        <ComponentGroup Id="CMPG_{dir_id}">\n')
+    for rel_ in files:
+        lines_.append(f'            <ComponentRef Id="{wix_id("cmp", rel_)}" />\n')
+    lines_.append('        </ComponentGroup>\n')
+    lines_.append(WXS_FOOTER)
+    return ''.join(lines_)
+
+
+def all_files_fragment(dirs):
+    '''
+    Group «CMPG_AllOfTheFiles» (as harvested by heat) of groups of all directories.
+    '''
+    lines_ = [WXS_HEADER, f'        <ComponentGroup Id="{ALL_FILES_GROUP}">\n']
+    for rel_dir in dirs:
+        lines_.append(f'            <ComponentGroupRef Id="CMPG_{directory_id(rel_dir)}" />\n')
+    lines_.append('        </ComponentGroup>\n')
+    lines_.append(WXS_FOOTER)
+    return ''.join(lines_)
+
+
+def write_fragments(files, fragments_dir, source_var, namespace):
+    '''
+    Bring fragments for files (relative paths in output folder) up to date in fragments_dir.
+    Objects («.wixobj») of rewritten and stale fragments are removed, so only they are compiled again.
+    Returns stats: dirs, files, written, kept, removed (fragments).
+    '''
+    os.makedirs(fragments_dir, exist_ok=True)
+    dirs_ = group_by_directory(files)
+    fragments_ = {fragment_name(d_): directory_fragment(d_, subdirs_, files_, source_var, namespace)
+                  for d_, (subdirs_, files_) in dirs_.items()}
+    fragments_[ALL_FILES_FRAGMENT] = all_files_fragment(dirs_)
+
+    stats = {'dirs': len(dirs_), 'files': len(files), 'written': 0, 'kept': 0, 'removed': 0}
+    for name_, text_ in fragments_.items():
+        path_ = os.path.join(fragments_dir, name_)
+        obj_ = os.path.splitext(path_)[0] + '.wixobj'
+        if write_if_changed(path_, text_):
+            stats['written'] += 1
+            if os.path.exists(obj_):
+                os.unlink(obj_)
+        else:
+            stats['kept'] += 1
+
+    for entry_ in os.scandir(fragments_dir):
+        base_, ext_ = os.path.splitext(entry_.name)
+        if ext_ in ('.wxs', '.wixobj') and base_ + '.wxs' not in fragments_:
+            os.unlink(entry_.path)
+            stats['removed'] += ext_ == '.wxs'
+    return stats
@@ -0,0 +1,63 @@
+"""
+    Generation of several projects in threads of one process:
+    no process-global cwd is used, results are the same as of sequential runs.
+"""
+
+import os
+import shutil
+import threading
+
+from terrarium_assembler_win.ta import TerrariumAssembler
+
+SAMPLE_SPEC = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'sample-spec.yml')
+
+
+def generate(project_dir, extra_args=()):
+    '''
+    Generate scripts of project, returns {script: text} with project dir masked.
+    '''
+    os.makedirs(project_dir, exist_ok=True)
+    specfile_ = os.path.join(project_dir, 'spec.yml')
+    shutil.copy(SAMPLE_SPEC, specfile_)
+    ta = TerrariumAssembler(TerrariumAssembler.parse_config([specfile_, '--no-spec-cache', *extra_args]),
+                            curdir=project_dir)
+    ta.process()
+    scripts = {}
+    for name_ in sorted(os.listdir(project_dir)):
+        if name_.endswith('.bat'):
+            with open(os.path.join(project_dir, name_), 'r', encoding='utf-8') as lf:
+                scripts[name_] = lf.read().replace(project_dir, '<PROJECT>')
+    return scripts
+
+
+def test_concurrent_generation(tmp_path, monkeypatch):
+    elsewhere_ = tmp_path / 'elsewhere'
+    elsewhere_.mkdir()
+    monkeypatch.chdir(elsewhere_)
+
+    expected = generate(str(tmp_path / 'sequential'), ['--plan-jobs', '1'])
+    assert expected
+
+    results = {}
+    errors = []
+    start_ = threading.Barrier(4)
+
+    def run(i_):
+        try:
+            start_.wait()
+            results[i_] = generate(str(tmp_path / f'project{i_}'), ['--plan-jobs', '4'])
+        except Exception as ex_:
+            errors.append(ex_)
+
+    threads_ = [threading.Thread(target=run, args=(i_,)) for i_ in range(4)]
+    for t_ in threads_:
+        t_.start()
+    for t_ in threads_:
+        t_.join()
+
+    assert not errors
+    for i_ in range(4):
+        assert results[i_] == expected
+    # Nothing was written to (or resolved against) the current dir.
+    assert os.getcwd() == str(elsewhere_)
+    assert not os.listdir(elsewhere_)
@@ -0,0 +1,74 @@
+"""
+    Streaming ISO writer (stage_51_make_iso): checksums, contents and deduplication.
+"""
+
+import os
+import hashlib
+
+import pycdlib
+
+from terrarium_assembler_win.isowriter import COPY_BLOCKSIZE, plan_iso, write_iso
+
+
+def make_tree(root):
+    '''
+    Output folder with distinct files, hardlinked pair and pair of equal content.
+    '''
+    contents = {
+        'app.exe': os.urandom(COPY_BLOCKSIZE * 3 + 123),
+        'lib/Some_Long-Library.Name.dll': os.urandom(70000),
+        'lib/deep/er/data.bin': os.urandom(5000),
+        'empty.txt': b'',
+        'docs/readme.txt': b'readme\n' * 100,
+        'docs/copy-of-readme.txt': b'readme\n' * 100,
+    }
+    files = {}
+    for rel_, data_ in contents.items():
+        path_ = os.path.join(root, *rel_.split('/'))
+        os.makedirs(os.path.dirname(path_), exist_ok=True)
+        with open(path_, 'wb') as lf:
+            lf.write(data_)
+        files[rel_] = path_
+    linked_ = os.path.join(root, 'lib', 'linked.dll')
+    os.link(files['lib/Some_Long-Library.Name.dll'], linked_)
+    files['lib/linked.dll'] = linked_
+    contents['lib/linked.dll'] = contents['lib/Some_Long-Library.Name.dll']
+    return files, contents
+
+
+def test_plan_dedup(tmp_path):
+    files, _ = make_tree(str(tmp_path / 'out'))
+    _, entries = plan_iso(files)
+    same_as = {rel_: same_ for rel_, _, _, same_ in entries if same_}
+    assert same_as == {
+        'lib/linked.dll': 'lib/Some_Long-Library.Name.dll',
+        'docs/readme.txt': 'docs/copy-of-readme.txt',
+    }
+
+
+def test_write_iso(tmp_path):
+    files, contents = make_tree(str(tmp_path / 'out'))
+    iso_filename = str(tmp_path / 'test.iso')
+    stats = write_iso(files, iso_filename)
+
+    with open(iso_filename, 'rb') as lf:
+        data_ = lf.read()
+    assert stats['md5'] == hashlib.md5(data_).hexdigest()
+    assert stats['sha256'] == hashlib.sha256(data_).hexdigest()
+    assert stats['bytes_reread'] == 0
+    assert stats['files'] == len(files)
+    assert stats['linked'] == 2
+    assert stats['contents'] == {rel_: {'size': len(c_), 'sha256': hashlib.sha256(c_).hexdigest()}
+                                 for rel_, c_ in contents.items()}
+
+    iso = pycdlib.PyCdlib()
+    iso.open(iso_filename)
+    try:
+        for rel_, content_ in contents.items():
+            with iso.open_file_from_iso(rr_path='/' + rel_) as lf:
+                assert lf.read() == content_, rel_
+        extent_ = lambda rel_: iso.get_record(rr_path='/' + rel_).extent_location()
+        assert extent_('lib/linked.dll') == extent_('lib/Some_Long-Library.Name.dll')
+        assert extent_('docs/readme.txt') == extent_('docs/copy-of-readme.txt')
+    finally:
+        iso.close()
@@ -0,0 +1,31 @@
+"""
+    Offline resolver of wheel lockfile (stage_09_download_wheels).
+"""
+
+from terrarium_assembler_win.wheellock import resolve
+
+
+def wheel(name, version, requires=(), priority=1):
+    return {'name': name, 'version': version, 'requires': list(requires),
+            'priority': priority, 'sha256': f'{name}-{version}'}
+
+
+def versions(chosen):
+    return {name_: meta_['version'] for name_, meta_ in chosen.items()}
+
+
+def test_constraints_of_dropped_candidates_do_not_stay():
+    # a 2 requires c<2, but b rejects a 2, so nothing requires c<2 at the end.
+    catalog = {
+        'a': [wheel('a', '1'), wheel('a', '2', ['c<2'])],
+        'b': [wheel('b', '1', ['a<2'])],
+        'c': [wheel('c', '1'), wheel('c', '2')],
+    }
+    assert versions(resolve(['c', 'a', 'b'], catalog)) == {'a': '1', 'b': '1', 'c': '2'}
+
+
+def test_priority_of_directory_wins_over_version():
+    catalog = {
+        'a': [wheel('a', '1', priority=0), wheel('a', '2', priority=2)],
+    }
+    assert versions(resolve(['a'], catalog)) == {'a': '1'}
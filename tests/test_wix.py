@@ -0,0 +1,72 @@
+"""
+    WiX fragments from output manifest (stage_52_make_msi): valid XML, stable ids, incremental rewrite.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+from terrarium_assembler_win.wix import ALL_FILES_FRAGMENT, ALL_FILES_GROUP, guid_namespace, write_fragments
+
+WIX_NS = '{http://schemas.microsoft.com/wix/2006/wi}'
+FILES = [
+    'app.exe',
+    'lib/core.dll',
+    'lib/plugins/a & b.dll',
+    'lib/plugins/Quote"d.dll',
+    'docs/readme.txt',
+]
+
+
+def read_fragments(fragments_dir):
+    result = {}
+    for name_ in sorted(os.listdir(fragments_dir)):
+        if name_.endswith('.wxs'):
+            with open(os.path.join(fragments_dir, name_), 'r', encoding='utf-8') as lf:
+                result[name_] = lf.read()
+    return result
+
+
+def test_fragments_parse(tmp_path):
+    stats = write_fragments(FILES, str(tmp_path), 'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    assert stats['files'] == len(FILES)
+    assert stats['written'] == len(read_fragments(str(tmp_path)))
+
+    sources_ = set()
+    groups_ = set()
+    refs_ = set()
+    for name_, text_ in read_fragments(str(tmp_path)).items():
+        root_ = ET.fromstring(text_.encode('utf-8'))
+        for file_ in root_.iter(WIX_NS + 'File'):
+            sources_.add(file_.get('Source'))
+        for group_ in root_.iter(WIX_NS + 'ComponentGroup'):
+            groups_.add(group_.get('Id'))
+        for ref_ in root_.iter(WIX_NS + 'ComponentGroupRef'):
+            refs_.add(ref_.get('Id'))
+    assert sources_ == {'$(env.TA_DISTR_ISO)\\' + f_.replace('/', '\\') for f_ in FILES}
+    assert ALL_FILES_GROUP in groups_
+    assert refs_ == groups_ - {ALL_FILES_GROUP}
+
+
+def test_stable_and_incremental(tmp_path):
+    first_, second_ = str(tmp_path / 'first'), str(tmp_path / 'second')
+    write_fragments(FILES, first_, 'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    write_fragments(list(reversed(FILES)), second_, 'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    assert read_fragments(first_) == read_fragments(second_)
+    guids_ = re.findall(r'Guid="(\{[0-9A-F-]+\})"', ''.join(read_fragments(first_).values()))
+    assert len(guids_) == len(set(guids_)) == len(FILES)
+
+    # Rerun writes nothing (objects are kept), new file rewrites only fragment of its dir.
+    obj_ = os.path.join(first_, ALL_FILES_FRAGMENT.replace('.wxs', '.wixobj'))
+    open(obj_, 'w').close()
+    stats = write_fragments(FILES, first_, 'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    assert stats['written'] == 0 and stats['removed'] == 0
+    assert os.path.exists(obj_)
+
+    stats = write_fragments(FILES + ['docs/new.txt'], first_, 'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    assert stats['written'] == 1
+    stats = write_fragments([f_ for f_ in FILES + ['docs/new.txt'] if not f_.startswith('lib/plugins/')], first_,
+                            'env.TA_DISTR_ISO', guid_namespace('Vendor'))
+    # Fragment of the removed dir is removed, of its parent (subdir list) and of all files rewritten.
+    assert stats['removed'] == 1
+    assert stats['written'] == 2